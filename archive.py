@@ -0,0 +1,195 @@
+"""Static archive of past editions.
+
+Every edition ``pipeline.py send`` has checkpointed under
+``.cache/editions/<number>/`` is written to ``archive/<number>/`` as the
+standard variant's HTML, with the DIYL GIFs and other attachments of its
+stored message saved next to it. ``archive/index.html`` lists every edition.
+Editions already in the archive are skipped, so running
+
+    python archive.py
+
+after each send only adds the new one. ``--backfill`` also rebuilds the
+editions that were never checkpointed, in parallel: from their stored
+response snapshot when one exists, otherwise from the full sheet limited to
+the edition's date window. Photos in the standard variant stay links to
+Google Drive.
+
+The archive holds everyone's answers, so ``archive/`` is not committed.
+"""
+
+import argparse
+import email
+import email.policy
+import hashlib
+import html
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from main import (
+    BASE_DIR,
+    EDITIONS_DIR,
+    ENCODE_WORKERS,
+    MESSAGE_CACHE_DIR,
+    AssetCache,
+    edition_number,
+    newsletter_from_environment,
+    read_responses,
+)
+
+ARCHIVE_DIR = BASE_DIR / "archive"
+INDEX_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Chatime Newsletter archive</title></head>
+<body>
+<h1>Chatime Newsletter archive</h1>
+<ul>
+{}
+</ul>
+</body>
+</html>
+"""
+
+
+def _asset_name(cid, subtype):
+    return "{}.{}".format(re.sub(r"[^A-Za-z0-9_.-]", "_", cid), subtype)
+
+
+def archive_message(edition, payload, output=ARCHIVE_DIR, date=None):
+    """Write one edition's serialized message into the archive.
+
+    Returns ``False`` without writing anything when the archive already
+    holds this exact message.
+    """
+    directory = Path(output) / str(edition)
+    source = hashlib.sha256(payload).hexdigest()
+    metadata_path = directory / "edition.json"
+    if metadata_path.exists() and json.loads(metadata_path.read_text(encoding="utf8"))["source"] == source:
+        return False
+
+    message = email.message_from_bytes(payload, policy=email.policy.default)
+    directory.mkdir(parents=True, exist_ok=True)
+    document = ""
+    assets = {}
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        content_id = part.get("Content-ID")
+        if content_id:
+            cid = content_id.strip("<>")
+            assets[cid] = _asset_name(cid, part.get_content_subtype())
+            (directory / assets[cid]).write_bytes(part.get_payload(decode=True))
+        elif part.get_content_type() == "text/html":
+            document = part.get_content()
+    document = re.sub(
+        r"cid:([^\"'\s)>]+)",
+        lambda match: assets.get(match.group(1), match.group(0)),
+        document,
+    )
+    (directory / "index.html").write_text(document, encoding="utf8")
+    metadata = {"edition": edition, "subject": str(message["Subject"] or ""), "date": date, "source": source}
+    # Written last: an edition without it is rebuilt on the next run.
+    metadata_path.write_text(json.dumps(metadata, indent=1, sort_keys=True), encoding="utf8")
+    return True
+
+
+def archived_editions(output=ARCHIVE_DIR):
+    """Return the metadata of every archived edition, newest first."""
+    editions = []
+    for metadata_path in Path(output).glob("*/edition.json"):
+        editions.append(json.loads(metadata_path.read_text(encoding="utf8")))
+    return sorted(editions, key=lambda metadata: metadata["edition"], reverse=True)
+
+
+def write_index(output=ARCHIVE_DIR):
+    items = [
+        '<li><a href="{0}/index.html">Edition {0}</a> {1} {2}</li>'.format(
+            metadata["edition"], html.escape(metadata["date"] or ""), html.escape(metadata["subject"])
+        )
+        for metadata in archived_editions(output)
+    ]
+    Path(output).mkdir(parents=True, exist_ok=True)
+    (Path(output) / "index.html").write_text(INDEX_PAGE.format("\n".join(items)), encoding="utf8")
+
+
+def archive_builds(build_root=EDITIONS_DIR, output=ARCHIVE_DIR):
+    """Add every checkpointed edition with a stored message; return the new ones."""
+    added = []
+    for message_path in sorted(Path(build_root).glob("*/standard.eml")):
+        build = message_path.parent
+        if not build.name.isdigit():
+            continue
+        status_path = build / "status.json"
+        status = json.loads(status_path.read_text(encoding="utf8")) if status_path.exists() else {}
+        if archive_message(int(build.name), message_path.read_bytes(), output, date=status.get("date")):
+            added.append(int(build.name))
+    return added
+
+
+def backfill(newsletter, editions, build_root=EDITIONS_DIR, output=ARCHIVE_DIR, workers=ENCODE_WORKERS):
+    """Rebuild the ``editions`` missing from the archive in parallel.
+
+    Each uses its stored response snapshot when the edition was
+    checkpointed, and otherwise the full sheet within its date window.
+    """
+    archived = {metadata["edition"] for metadata in archived_editions(output)}
+    missing = [edition for edition in editions if edition not in archived]
+    if not missing:
+        return []
+    sheet = None
+    if any(not (Path(build_root) / str(edition) / "responses.csv").exists() for edition in missing):
+        sheet = read_responses(newsletter.sheet_url, session=newsletter.session)
+
+    def rebuild(edition):
+        snapshot = Path(build_root) / str(edition) / "responses.csv"
+        responses = read_responses(snapshot) if snapshot.exists() else None
+        past = newsletter.for_edition(edition, responses=responses, sheet=sheet)
+        if not len(past.responses):
+            print("Edition {}: no responses, skipped".format(edition))
+            return None
+        past.generate_newsletter(edition=edition)
+        payload = past.serialized_message(spark=False)
+        archive_message(edition, payload, output, date=past.datetime_now.strftime("%Y-%m-%d"))
+        return edition
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        rebuilt = list(pool.map(rebuild, missing))
+    return [edition for edition in rebuilt if edition is not None]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Write past editions into a static archive.")
+    parser.add_argument("--output", type=Path, default=ARCHIVE_DIR, help="Archive directory (default: archive/).")
+    parser.add_argument(
+        "--backfill",
+        action="store_true",
+        help="Also rebuild every earlier edition that was never checkpointed.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=ENCODE_WORKERS,
+        help="Editions rebuilt at the same time when backfilling.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    added = archive_builds(output=args.output)
+    if args.backfill:
+        newsletter = newsletter_from_environment(
+            asset_cache=AssetCache(),
+            message_cache=AssetCache(MESSAGE_CACHE_DIR, suffix=".eml"),
+        )
+        editions = range(1, edition_number(update_log=False))
+        added += backfill(newsletter, editions, output=args.output, workers=args.workers)
+        if newsletter.image_index is not None:
+            newsletter.image_index.save()
+    write_index(args.output)
+    print("Archived {} new edition(s) in {}".format(len(added), args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Run several newsletters from one process.
+
+A JSON manifest lists one entry per friend group: its sheet, recipients,
+templates and schedule. ``python batch.py newsletters.json send`` builds and
+sends all of them concurrently through the ``pipeline`` stages. They share
+one HTTP connection pool, the image index, the asset and message caches, the
+compiled templates and one SMTP login per sender account, so a group only
+pays for what is actually its own.
+
+    {
+      "defaults": {"timezone": "Pacific/Auckland", "first_edition_date": "2024/03/01"},
+      "newsletters": [
+        {
+          "name": "flatmates",
+          "sheet_id": "1AbC...",
+          "sheet_name": "Form Responses 1",
+          "recipients": ["friend@example.com"],
+          "recipients_spark": [],
+          "background_url": "https://drive.google.com/open?id=...",
+          "templates": ["template.html", "template_spark.html"]
+        }
+      ]
+    }
+
+Entries may also set ``frequency_unit``, ``frequency``, ``special_edition``,
+``sender`` and ``password_env`` (the variable holding the app password).
+Each newsletter counts its editions in ``log_<name>.txt`` next to the
+manifest (override with ``log``), checkpoints its sends under
+``.cache/editions/<name>/`` and keeps its own response history. Relative paths are resolved from the manifest.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from main import (
+    EDITIONS_DIR,
+    ENCODE_WORKERS,
+    HISTORY_PATH,
+    MESSAGE_CACHE_DIR,
+    AssetCache,
+    ImageIndex,
+    Newsletter,
+    ResponseHistory,
+    SMTPSession,
+    environment_options,
+    lazy_import,
+)
+import pipeline
+
+requests = lazy_import("requests")
+
+MANIFEST_DEFAULTS = {
+    "first_edition_date": "2024/03/01",
+    "frequency_unit": "month",
+    "frequency": 1,
+    "timezone": "Pacific/Auckland",
+    "special_edition": True,
+    "recipients_spark": [],
+    "password_env": "APP_PASSWORD",
+}
+REQUIRED_FIELDS = ("name", "sheet_id", "sheet_name", "recipients", "background_url")
+STAGES = {"prepare": pipeline.prepare, "send": pipeline.send}
+
+
+def load_manifest(path):
+    """Return the manifest's newsletters with defaults and paths filled in."""
+    path = Path(path)
+    manifest = json.loads(path.read_text(encoding="utf8"))
+    defaults = dict(MANIFEST_DEFAULTS, **manifest.get("defaults", {}))
+    entries = []
+    for position, entry in enumerate(manifest.get("newsletters", [])):
+        entry = dict(defaults, **entry)
+        missing = [field for field in REQUIRED_FIELDS if field not in entry]
+        if missing:
+            raise ValueError("Newsletter {} in {} is missing {}".format(position, path, ", ".join(missing)))
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", entry["name"]):
+            raise ValueError("Newsletter name {!r} may only use letters, digits, - and _".format(entry["name"]))
+        entry["log"] = path.parent / entry.get("log", "log_{}.txt".format(entry["name"]))
+        if "templates" in entry:
+            entry["templates"] = tuple(path.parent / template for template in entry["templates"])
+        entries.append(entry)
+    names = [entry["name"] for entry in entries]
+    if len(set(names)) != len(names):
+        raise ValueError("Newsletter names in {} must be unique".format(path))
+    return entries
+
+
+class SharedResources:
+    """What every newsletter of one batch run uses together."""
+
+    def __init__(self, newsletter_count):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(newsletter_count, 1) * ENCODE_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.image_index = ImageIndex()
+        self.asset_cache = AssetCache()
+        self.message_cache = AssetCache(MESSAGE_CACHE_DIR, suffix=".eml")
+        self.smtp_sessions = {}
+        self._lock = threading.Lock()
+
+    def smtp_session(self, sender, password):
+        with self._lock:
+            if sender not in self.smtp_sessions:
+                self.smtp_sessions[sender] = SMTPSession(sender, password)
+            return self.smtp_sessions[sender]
+
+    def close(self):
+        for smtp_session in self.smtp_sessions.values():
+            smtp_session.close()
+        self.image_index.save()
+        self.session.close()
+
+
+def build_newsletter(entry, shared):
+    sender = entry.get("sender") or os.getenv("GMAIL_ADDRESS")
+    password = os.getenv(entry["password_env"])
+    return Newsletter(
+        entry["first_edition_date"],
+        entry["frequency_unit"],
+        entry["frequency"],
+        entry["timezone"],
+        sender,
+        entry["recipients"],
+        entry["recipients_spark"],
+        password,
+        entry["sheet_id"],
+        entry["sheet_name"],
+        entry["background_url"],
+        special_edition=entry["special_edition"],
+        image_index=shared.image_index,
+        templates=entry.get("templates"),
+        log_path=entry["log"],
+        session=shared.session,
+        smtp_session=shared.smtp_session(sender, password),
+        history=ResponseHistory(HISTORY_PATH.with_name("history_{}.sqlite3".format(entry["name"]))),
+        **environment_options(asset_cache=shared.asset_cache, message_cache=shared.message_cache),
+    )
+
+
+def run_stage(stage, entry, shared, build_root=EDITIONS_DIR):
+    newsletter = build_newsletter(entry, shared)
+    if stage == "send":
+        STAGES[stage](newsletter, build_root=Path(build_root) / entry["name"])
+    else:
+        STAGES[stage](newsletter)
+
+
+def run(stage, entries, build_root=EDITIONS_DIR):
+    """Run ``stage`` for every entry concurrently and return the failures.
+
+    One newsletter failing does not stop the others. The result maps each
+    failed newsletter's name to its error.
+    """
+    shared = SharedResources(len(entries))
+    failures = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(entries), 1)) as pool:
+            runs = [(entry["name"], pool.submit(run_stage, stage, entry, shared, build_root)) for entry in entries]
+        for name, future in runs:
+            try:
+                future.result()
+            except (Exception, SystemExit) as error:
+                failures[name] = error
+    finally:
+        shared.close()
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare or send every newsletter in a manifest.")
+    parser.add_argument("manifest", type=Path, help="JSON file listing the newsletters.")
+    parser.add_argument("stage", choices=sorted(STAGES))
+    parser.add_argument(
+        "--only",
+        action="append",
+        default=[],
+        metavar="NAME",
+        help="Only run this newsletter; repeat for several.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    try:
+        entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as error:
+        raise SystemExit("Manifest error: " + str(error))
+    if args.only:
+        unknown = set(args.only) - {entry["name"] for entry in entries}
+        if unknown:
+            raise SystemExit("Unknown newsletter(s): " + ", ".join(sorted(unknown)))
+        entries = [entry for entry in entries if entry["name"] in args.only]
+    failures = run(args.stage, entries)
+    for name, error in failures.items():
+        print("{}: {}".format(name, error))
+    if failures:
+        raise SystemExit("{} of {} newsletters failed".format(len(failures), len(entries)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,1224 @@
-from jinja2 import Environment
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
+from email.generator import BytesGenerator
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from PIL import Image, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps, UnidentifiedImageError
 from io import BytesIO
-try:
-    from pillow_heif import register_heif_opener
-except ImportError:
-    def register_heif_opener():
-        return None
 import ast
+import copy
+import csv
+import hashlib
+import importlib.util
+import io
+import json
+import math
 import os
+import sys
+import threading
+import time
+import weakref
 import pytz
-import pandas as pd
-import numpy as np
-import requests
 import smtplib
+import sqlite3
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 
 
+def lazy_import(name):
+    '''
+    Return module ``name``, deferring its import until an attribute is used.
+
+    requests and jinja2 make up most of the start-up time, and many runs
+    (``--help``, serving a preview bundle, the unit tests) never touch some
+    of them.
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+jinja2 = lazy_import('jinja2')
+requests = lazy_import('requests')
+
+HEIF_SUPPORT = importlib.util.find_spec('pillow_heif') is not None
+_heif_lock = threading.Lock()
+_heif_registered = False
+
+def register_heif():
+    '''
+    Register the pillow-heif opener the first time a HEIF image shows up.
+    '''
+    global _heif_registered
+    with _heif_lock:
+        if not _heif_registered:
+            from pillow_heif import register_heif_opener
+            register_heif_opener()
+            _heif_registered = True
+
+
 BASE_DIR = Path(__file__).resolve().parent
+MAX_IMAGE_DOWNLOAD_BYTES = 50 * 1024 * 1024
+IMAGE_INDEX_PATH = BASE_DIR / '.cache' / 'image_index.json'
+IMAGE_CACHE_DIR = BASE_DIR / '.cache' / 'images'
+HISTORY_PATH = BASE_DIR / '.cache' / 'history.sqlite3'
+ASSET_CACHE_DIR = BASE_DIR / '.cache' / 'assets'
+EDITIONS_DIR = BASE_DIR / '.cache' / 'editions'
+MESSAGE_CACHE_DIR = BASE_DIR / '.cache' / 'messages'
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 465
+RECIPIENT_BATCH_SIZE = 50 # Gmail accepts at most 100 recipients per message
+SEND_INTERVAL_SECONDS = 2.0
+ENCODE_WORKERS = 4
+# Reminder hero image: email width at 2x density, kept well under a megabyte.
+HERO_IMAGE_MAX_SIDE = 1200
+DECODE_MAX_SIDE = 2400 # no attachment is ever sent larger than this
+NEAR_DUPLICATE_DISTANCE = 6 # dHash bits two photos may differ by and still count as one
+HEIF_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'hevm', b'hevs', b'mif1', b'msf1'}
+HERO_IMAGE_MAX_BYTES = 400 * 1000
+ON_THIS_DAY_QUESTIONS = ("✨ Any life updates?", "☀️ One Good Thing!")
+GMAIL_CLIP_BYTES = 102 * 1024 # Gmail hides the rest of a longer HTML body behind "View entire message"
+HTML_CLIP_POLICIES = ('warn', 'fail')
+# Named JPEG settings for each kind of attachment. Every profile writes
+# optimized, progressive files without EXIF or ICC blocks; ``webp`` lets
+# encode_image keep a WebP instead when it is smaller, for targets that
+# can display it (Outlook cannot, so none of the email profiles do).
+ENCODER_PROFILES = {
+    'standard': {'min_quality': 40, 'max_quality': 90, 'subsampling': '4:2:0', 'webp': False},
+    'spark-tight': {'min_quality': 30, 'max_quality': 85, 'subsampling': '4:2:0', 'webp': False},
+    'reminder-hero': {'max_side': HERO_IMAGE_MAX_SIDE, 'min_quality': 50, 'max_quality': 92,
+                      'subsampling': '4:2:2', 'webp': False},
+}
+SPARK_IMAGE_PROFILE = 'spark-tight'
+
+class CardRenderer:
+    '''
+    Render the ``answer_card`` and ``photo_card`` macros from cards.html with
+    a shared fragment cache.
+
+    Both email variants and repeated preview renders call the cards with the
+    same arguments, so each distinct card is rendered once and reused.
+    '''
+
+    def __init__(self, source, max_entries=4096):
+        module = jinja2.Environment(autoescape=True).from_string(source).module
+        self.source = source
+        self._macros = {"answer_card": module.answer_card, "photo_card": module.photo_card}
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, macro, *args, **kwargs):
+        # Markup and str compare equal, so keep the type in the key to avoid
+        # reusing an unescaped card for already-escaped input.
+        key = (macro,) + tuple((type(arg).__name__, str(arg)) for arg in args) + tuple(sorted((k, type(v).__name__, str(v)) for k, v in kwargs.items()))
+        with self._lock:
+            fragment = self._cache.get(key)
+            if fragment is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return fragment
+        fragment = self._macros[macro](*args, **kwargs)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = fragment
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return fragment
+
+    def install(self, environment):
+        environment.globals["answer_card"] = lambda *args, **kwargs: self.render("answer_card", *args, **kwargs)
+        environment.globals["photo_card"] = lambda *args, **kwargs: self.render("photo_card", *args, **kwargs)
+        return environment
+
+
+_card_renderer = None
+_card_renderer_lock = threading.Lock()
+
+def card_renderer():
+    '''
+    Return the process-wide card renderer, rebuilding it when cards.html
+    changes on disk.
+    '''
+    global _card_renderer
+    source = (BASE_DIR / 'cards.html').read_text(encoding="utf8")
+    with _card_renderer_lock:
+        if _card_renderer is None or _card_renderer.source != source:
+            _card_renderer = CardRenderer(source)
+        return _card_renderer
+
+def newsletter_environment(**options):
+    '''
+    Jinja environment for the newsletter templates with the cached cards.
+    '''
+    return card_renderer().install(jinja2.Environment(autoescape=True, **options))
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def load_template(path):
+    '''
+    Return the compiled newsletter template at ``path``.
+
+    Templates are compiled once per process and shared by every newsletter
+    that uses them. Editing the file or cards.html compiles it again.
+    '''
+    path = Path(path)
+    renderer = card_renderer()
+    mtime = path.stat().st_mtime_ns
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is not None and cached[:2] == (mtime, renderer):
+            return cached[2]
+    template = renderer.install(jinja2.Environment(autoescape=True)).from_string(path.read_text(encoding='utf8'))
+    with _templates_lock:
+        _templates[path] = (mtime, renderer, template)
+    return template
+
+class EmailTooLargeError(ValueError):
+    '''
+    Raised when a rendered email would be clipped by Gmail and the clip
+    policy is ``fail``.
+    '''
+
+_PRESERVED_HTML = re.compile(r'(<(pre|textarea)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+_HTML_COMMENT = re.compile(r'<!--(?!\[if)[\s\S]*?-->')
+_LAYOUT_WHITESPACE = re.compile(r'>[ \t\r\n\f]*\n[ \t\r\n\f]*<')
+_HTML_WHITESPACE = re.compile(r'[ \t\r\n\f]+')
+_STYLE_BLOCK = re.compile(r'(<style\b[^>]*>)(.*?)(</style\s*>)', re.IGNORECASE | re.DOTALL)
+_START_TAG = re.compile(r'<[A-Za-z][^<>]*>')
+_STYLE_ATTRIBUTE = re.compile(r'\sstyle="([^"]*)"')
+_CLASS_ATTRIBUTE = re.compile(r'\sclass="([^"]*)"')
+
+def _minify_css(css):
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css.strip())
+    return re.sub(r';(?=}|$)', '', css)
+
+def _collapse_whitespace(content):
+    # Whitespace with a line break between two tags is template indentation.
+    # Any other run renders as one space, so it becomes one.
+    content = _HTML_COMMENT.sub('', content)
+    content = _LAYOUT_WHITESPACE.sub('><', content)
+    content = _HTML_WHITESPACE.sub(' ', content)
+    content = _STYLE_BLOCK.sub(lambda m: m.group(1) + _minify_css(m.group(2)) + m.group(3), content)
+    return _START_TAG.sub(
+        lambda m: _STYLE_ATTRIBUTE.sub(lambda s: ' style="{}"'.format(_minify_css(s.group(1))), m.group(0)),
+        content,
+    )
+
+def _hoist_styles(content):
+    '''
+    Replace every ``style`` attribute used more than once with a class
+    defined in a ``<style>`` block at the end of ``<head>``.
+
+    The new rules come after the template's own, so they win over its
+    class rules just like the inline styles did; overrides in media
+    queries keep working because they are ``!important``.
+    '''
+    head_end = content.lower().find('</head>')
+    if head_end < 0:
+        return content
+    counts = {}
+    for tag in _START_TAG.findall(content, head_end):
+        match = _STYLE_ATTRIBUTE.search(tag)
+        if match:
+            counts[match.group(1)] = counts.get(match.group(1), 0) + 1
+    classes = {}
+    for style, count in counts.items():
+        name = 'hs{}'.format(len(classes))
+        saved = count * (len(' style=""') + len(style) - len(' class=""') - len(name)) - len('.{}{{{}}}'.format(name, style))
+        if count > 1 and saved > 0:
+            classes[style] = name
+    if not classes:
+        return content
+
+    def replace_tag(match):
+        tag = match.group(0)
+        style = _STYLE_ATTRIBUTE.search(tag)
+        if not style or style.group(1) not in classes:
+            return tag
+        name = classes[style.group(1)]
+        tag = tag[:style.start()] + tag[style.end():]
+        if _CLASS_ATTRIBUTE.search(tag):
+            return _CLASS_ATTRIBUTE.sub(lambda m: ' class="{} {}"'.format(m.group(1), name), tag, count=1)
+        return tag[:style.start()] + ' class="{}"'.format(name) + tag[style.start():]
+
+    rules = ''.join('.{}{{{}}}'.format(name, style) for style, name in classes.items())
+    body = _START_TAG.sub(replace_tag, content[head_end:])
+    return content[:head_end] + '<style>' + rules + '</style>' + body
+
+def optimize_email_html(content, variant='standard', policy='warn'):
+    '''
+    Shrink rendered email HTML and check it against Gmail's clip limit.
+
+    Comments and indentation are removed and the CSS is minified. The
+    standard variant also moves repeated inline styles into shared classes;
+    the Spark / Outlook variant keeps every style inline because those
+    clients drop or rewrite ``<style>`` blocks. Above ``GMAIL_CLIP_BYTES``
+    a warning is printed, or ``EmailTooLargeError`` raised when ``policy``
+    is ``fail``. Returns the HTML with its size in bytes before and after.
+    '''
+    if policy not in HTML_CLIP_POLICIES:
+        raise ValueError(f"Unknown clip policy {policy!r}, expected one of {HTML_CLIP_POLICIES}")
+    before = len(content.encode('utf8'))
+    # <pre> and <textarea> keep their whitespace.
+    parts = _PRESERVED_HTML.split(content)
+    optimized = ''.join(
+        part if index % 3 == 1 else _collapse_whitespace(part) if index % 3 == 0 else ''
+        for index, part in enumerate(parts)
+    )
+    if variant == 'standard':
+        optimized = _hoist_styles(optimized)
+    after = len(optimized.encode('utf8'))
+    if after > GMAIL_CLIP_BYTES:
+        problem = f"The {variant} email is {after / 1024:.1f} KB of HTML; Gmail clips anything over {GMAIL_CLIP_BYTES / 1024:.0f} KB"
+        if policy == 'fail':
+            raise EmailTooLargeError(problem)
+        print("Warning: " + problem)
+    return optimized, before, after
+
+def drive_file_id(url):
+    normalized = str(url).strip()
+    match = re.search(r"[?&]id=([^&]+)", normalized) or re.search(r"/d/([^/]+)", normalized)
+    if not match:
+        return None
+    return match.group(1)
+
+def drive_url_candidates(url):
+    normalized = str(url).strip()
+    file_id = drive_file_id(normalized)
+    if file_id is None:
+        return [normalized]
+    return [
+        f"https://drive.google.com/uc?export=view&id={file_id}",
+        f"https://drive.google.com/uc?export=download&id={file_id}",
+        f"https://drive.google.com/thumbnail?id={file_id}&sz=w2000",
+        normalized,
+    ]
+
+class DownloadStats:
+    '''
+    Count, time and failures of every image download.
+
+    Listeners, such as the preview's /metrics, are told about each one, so
+    downloads made while building GIFs are counted like any other.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.downloads = 0
+        self.seconds = 0.0
+        self.errors = {}
+
+    def subscribe(self, listener):
+        '''
+        Call ``listener(seconds, error)`` after every download. Bound methods
+        are held weakly, so a discarded preview state stops listening.
+        '''
+        reference = weakref.WeakMethod(listener) if hasattr(listener, '__self__') else (lambda: listener)
+        with self._lock:
+            self._listeners.append(reference)
+
+    def record(self, seconds, error=None):
+        with self._lock:
+            self.downloads += 1
+            self.seconds += seconds
+            if error is not None:
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            listeners = [(reference, reference()) for reference in self._listeners]
+            self._listeners = [reference for reference, listener in listeners if listener is not None]
+        for _, listener in listeners:
+            if listener is not None:
+                listener(seconds, error)
+
+DOWNLOAD_STATS = DownloadStats()
+
+def download_file(url, timeout=30, max_bytes=MAX_IMAGE_DOWNLOAD_BYTES, session=None, stats=DOWNLOAD_STATS):
+    '''
+    Stream ``url`` into a seekable buffer, aborting past ``max_bytes``.
+
+    A ``requests.Session`` passed as ``session`` reuses its connections.
+    Every attempt is recorded in ``stats``. Returns the response's content
+    type and the buffer.
+    '''
+    started = time.perf_counter()
+    try:
+        with (session or requests).get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').split(';', 1)[0].strip()
+            payload = BytesIO()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                payload.write(chunk)
+                if payload.tell() > max_bytes:
+                    raise ValueError(f"Download is larger than {max_bytes} bytes")
+    except Exception as error:
+        stats.record(time.perf_counter() - started, error)
+        raise
+    stats.record(time.perf_counter() - started)
+    payload.seek(0)
+    return content_type, payload
+
+def download_image(url, timeout=30, max_bytes=MAX_IMAGE_DOWNLOAD_BYTES, session=None):
+    '''
+    Stream ``url`` into a seekable buffer, aborting past ``max_bytes``.
+    '''
+    return download_file(url, timeout=timeout, max_bytes=max_bytes, session=session)[1]
+
+def sniff_image_format(header):
+    '''
+    Return the Pillow format name for the magic bytes in ``header``, or
+    ``None`` when they are not one of the formats the sheet usually holds.
+    '''
+    header = bytes(header)
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    if header[4:8] == b'ftyp':
+        box_size = int.from_bytes(header[:4], 'big')
+        brands = [header[8:12]] + [header[offset:offset + 4] for offset in range(16, min(box_size, len(header)), 4)]
+        if HEIF_BRANDS.intersection(brands):
+            return 'HEIF'
+    return None
+
+def decode_image(image_bytes, max_side=None):
+    '''
+    Decode downloaded bytes with the decoder their magic bytes call for.
+
+    With ``max_side``, large JPEGs are decoded at a reduced DCT scale and
+    HEIF images from an embedded thumbnail when one is big enough, so
+    photos are not decoded at full resolution only to be shrunk.
+
+    Returns the upright image, the format it was stored in and its stored
+    size.
+    '''
+    image_format = sniff_image_format(image_bytes.getbuffer()[:64])
+    if image_format == 'HEIF':
+        if not HEIF_SUPPORT:
+            raise UnidentifiedImageError("HEIF image but pillow-heif is not installed")
+        register_heif()
+    image_bytes.seek(0)
+    opened = Image.open(image_bytes, formats=[image_format] if image_format else None)
+    size = opened.size
+    if max_side and max(size) > max_side:
+        scale = max_side / max(size)
+        opened.draft(None, (math.ceil(size[0] * scale), math.ceil(size[1] * scale)))
+    return ImageOps.exif_transpose(opened), opened.format, size
+
+def fetch_image(url, timeout=30, max_bytes=MAX_IMAGE_DOWNLOAD_BYTES, max_side=None, session=None):
+    '''
+    Download ``url`` once and decode it.
+    '''
+    image_bytes = download_image(url, timeout=timeout, max_bytes=max_bytes, session=session)
+    return decode_image(image_bytes, max_side=max_side)[0]
+
+def difference_hash(image, size=8):
+    '''
+    Perceptual dHash of ``image`` as hex: one bit per neighbouring pixel
+    pair of a tiny grayscale copy, so resized or recompressed copies of a
+    photo differ in only a few bits.
+    '''
+    small = image.convert('L').resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(size):
+        for column in range(size):
+            offset = row * (size + 1) + column
+            bits = bits << 1 | (pixels[offset] > pixels[offset + 1])
+    return f'{bits:0{size * size // 4}x}'
+
+def hash_distance(first, second):
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+def open_remote_image(url, index=None, max_side=DECODE_MAX_SIDE, session=None, derivative=False):
+    '''
+    Return the first Drive URL variant of ``url`` that decodes, or ``None``.
+
+    When an ``ImageIndex`` is given, the outcome is recorded in it, along
+    with a reminder derivative if ``derivative`` is set.
+    '''
+    last_error = None
+    for candidate in drive_url_candidates(url):
+        try:
+            image_bytes = download_image(candidate, session=session)
+            image, image_format, size = decode_image(image_bytes, max_side=max_side)
+        except Exception as error:
+            last_error = error
+            continue
+        if index is not None:
+            index.record(url, image=image, image_format=image_format, byte_size=len(image_bytes.getbuffer()), size=size,
+                         digest=hashlib.sha256(image_bytes.getbuffer()).hexdigest(), dhash=difference_hash(image),
+                         derivative=derivative)
+        return image
+    if index is not None:
+        index.record(url, error=last_error)
+    print(f"Skipping unrecognized image URL: {url}. Last error: {last_error}")
+    return None
+
+def encode_jpeg(image, max_bytes, max_side=None, min_quality=40, max_quality=90, image_format="JPEG", **save_options):
+    '''
+    Encode ``image`` as a JPEG of at most ``max_bytes``.
+
+    Quality is binary-searched between ``min_quality`` and ``max_quality``;
+    if even the lowest quality is too large the image is scaled down by a
+    quarter and searched again. ``max_side`` caps the longest edge up front.
+    ``image_format`` and ``save_options`` are passed on to ``Image.save``.
+    '''
+    lanczos = Image.Resampling.LANCZOS if hasattr(Image, "Resampling") else Image.LANCZOS
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if max_side and max(image.size) > max_side:
+        ratio = max_side / max(image.size)
+        image = image.resize((max(1, int(image.width * ratio)), max(1, int(image.height * ratio))), resample=lanczos)
+
+    def encode(quality):
+        byte_buffer = BytesIO()
+        try:
+            image.save(byte_buffer, format=image_format, quality=quality, **save_options)
+        except OSError:
+            # libjpeg must fit optimized and progressive output in a buffer
+            # of about one byte per pixel, which very detailed images exceed.
+            if not (save_options.get("optimize") or save_options.get("progressive")):
+                raise
+            byte_buffer = BytesIO()
+            baseline = dict(save_options, optimize=False, progressive=False)
+            image.save(byte_buffer, format=image_format, quality=quality, **baseline)
+        return byte_buffer.getvalue()
+
+    while True:
+        best = None
+        low, high = min_quality, max_quality
+        while low <= high:
+            quality = (low + high) // 2
+            encoded = encode(quality)
+            if len(encoded) <= max_bytes:
+                best = encoded
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None:
+            return best
+        if max(image.size) <= 64:
+            return encode(min_quality)
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)), resample=lanczos)
+
+def to_srgb(image):
+    '''
+    Convert ``image`` from its embedded ICC profile to sRGB, so the profile
+    can be dropped without shifting colours. Images without a profile, or
+    with one that cannot be read, are returned unchanged.
+    '''
+    icc_profile = image.info.get('icc_profile')
+    if not icc_profile or image.mode != 'RGB':
+        return image
+    try:
+        from PIL import ImageCms
+    except ImportError:
+        return image
+    try:
+        source = ImageCms.ImageCmsProfile(BytesIO(icc_profile))
+        if 'sRGB' in ImageCms.getProfileDescription(source):
+            return image
+        return ImageCms.profileToProfile(image, source, ImageCms.createProfile('sRGB'), outputMode='RGB')
+    except (OSError, ImageCms.PyCMSError):
+        return image
+
+class EncoderStats:
+    '''
+    Output size and encode time per encoder profile, to compare profiles.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.profiles = {}
+
+    def record(self, profile, pixels, byte_size, seconds):
+        with self._lock:
+            totals = self.profiles.setdefault(profile, {'images': 0, 'pixels': 0, 'bytes': 0, 'seconds': 0.0})
+            totals['images'] += 1
+            totals['pixels'] += pixels
+            totals['bytes'] += byte_size
+            totals['seconds'] += seconds
+
+    def summary(self):
+        '''
+        Return one line per profile: images, total size, bytes per source
+        megapixel and mean encode time.
+        '''
+        with self._lock:
+            profiles = sorted(self.profiles.items())
+        return [
+            "{}: {} images, {:.0f} KB, {:.0f} KB/MP, {:.0f} ms each".format(
+                profile, totals['images'], totals['bytes'] / 1000,
+                totals['bytes'] / 1000 / max(totals['pixels'] / 1e6, 1e-6),
+                totals['seconds'] * 1000 / totals['images'])
+            for profile, totals in profiles
+        ]
+
+ENCODER_STATS = EncoderStats()
+
+def encode_image(image, max_bytes, profile='standard', stats=ENCODER_STATS):
+    '''
+    Encode ``image`` within ``max_bytes`` using one of ``ENCODER_PROFILES``.
+
+    The image is converted to sRGB and written without metadata. Profiles
+    with ``webp`` also try WebP at the same budget and keep the smaller
+    file. The result's size and encode time are added to ``stats``.
+    '''
+    settings = ENCODER_PROFILES[profile]
+    started = time.perf_counter()
+    pixels = image.width * image.height
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image = to_srgb(image)
+    search = {'max_side': settings.get('max_side'), 'min_quality': settings['min_quality'],
+              'max_quality': settings['max_quality'], 'icc_profile': b'', 'exif': b''}
+    encoded = encode_jpeg(image, max_bytes, optimize=True, progressive=True,
+                          subsampling=settings['subsampling'], **search)
+    if settings.get('webp'):
+        webp = encode_jpeg(image, max_bytes, image_format='WEBP', method=6, **search)
+        if len(webp) < len(encoded):
+            encoded = webp
+    if stats is not None:
+        stats.record(profile, pixels, len(encoded), time.perf_counter() - started)
+    return encoded
+
+def _palette_indices(image):
+    return Image.frombytes('L', image.size, image.tobytes())
+
+def encode_gif(frames, color_count=128, duration_ms=1200, transparent_share=0.25):
+    '''
+    Encode equally sized RGB ``frames`` as a looping GIF that stores only
+    what changes from frame to frame.
+
+    Every frame is mapped, without dithering, onto one palette built from
+    all of them, so pixels that stay the same keep their palette index.
+    Frames are kept on screen (disposal 1) and Pillow writes each one as
+    the rectangle that differs from the frame before. When at least
+    ``transparent_share`` of that rectangle is unchanged, those pixels are
+    set to a reserved transparent index, which compresses to almost nothing.
+    '''
+    no_dither = Image.Dither.NONE if hasattr(Image, "Dither") else Image.NONE
+    transparent = color_count - 1
+    thumbnails = [frame.reduce(4) if min(frame.size) >= 16 else frame for frame in frames]
+    sheet = Image.new('RGB', (max(t.width for t in thumbnails), sum(t.height for t in thumbnails)), 'white')
+    top = 0
+    for thumbnail in thumbnails:
+        sheet.paste(thumbnail, (0, top))
+        top += thumbnail.height
+    palette = sheet.quantize(colors=color_count - 1)
+    indexed = [frame.quantize(palette=palette, dither=no_dither) for frame in frames]
+
+    written = indexed[:1]
+    for previous, frame in zip(indexed, indexed[1:]):
+        difference = ImageChops.difference(_palette_indices(previous), _palette_indices(frame))
+        changed = difference.getbbox()
+        if changed is not None:
+            unchanged = difference.point(lambda value: 255 if value == 0 else 0)
+            area = (changed[2] - changed[0]) * (changed[3] - changed[1])
+            if unchanged.crop(changed).histogram()[255] >= area * transparent_share:
+                frame = frame.copy()
+                frame.paste(transparent, mask=unchanged)
+        written.append(frame)
+
+    output = BytesIO()
+    written[0].save(
+        output,
+        format="GIF",
+        save_all=True,
+        append_images=written[1:],
+        duration=duration_ms,
+        loop=0,
+        disposal=1,
+        transparency=transparent,
+    )
+    return output.getvalue()
+
+class ImageIndex:
+    '''
+    Persistent record of every form image a newsletter run has downloaded.
+
+    Entries are keyed by Drive file ID and hold the pixel size, stored format,
+    download size, content hashes and whether the image decoded. The reminder
+    uses it to pick a hero image without downloading candidates that are
+    broken or huge, and reuses the email-sized JPEG derivative written to
+    ``cache_dir`` for each photo it could pick. Newsletter runs use the
+    content hashes to spot the same photo behind different links.
+    '''
+
+    HERO_MAX_BYTES = 15 * 1000 * 1000
+    HERO_MAX_PIXELS = 50 * 1000 * 1000
+
+    def __init__(self, path=IMAGE_INDEX_PATH, cache_dir=IMAGE_CACHE_DIR):
+        self.path = Path(path)
+        self.cache_dir = Path(cache_dir)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            self.entries = json.loads(self.path.read_text(encoding='utf8'))
+
+    @staticmethod
+    def key(url):
+        return drive_file_id(url) or str(url).strip()
+
+    def record(self, url, image=None, image_format=None, byte_size=None, error=None, size=None, digest=None, dhash=None,
+               derivative=False):
+        '''
+        Record the outcome of downloading ``url``. With ``derivative``, also
+        write the reminder-sized JPEG if ``candidates`` could pick the image.
+        '''
+        key = self.key(url)
+        if image is None:
+            entry = {"ok": False, "error": type(error).__name__ if error else None}
+        else:
+            width, height = size or image.size
+            entry = {
+                "ok": True,
+                "width": width,
+                "height": height,
+                "format": image_format,
+                "bytes": byte_size,
+            }
+            if digest is not None:
+                entry["sha256"] = digest
+            if dhash is not None:
+                entry["dhash"] = dhash
+            path = self.derivative_path(url)
+            if derivative and self._is_candidate(entry) and not path.exists():
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(encode_image(image, HERO_IMAGE_MAX_BYTES, 'reminder-hero'))
+        with self._lock:
+            self.entries[key] = entry
+
+    def entry(self, url):
+        with self._lock:
+            return self.entries.get(self.key(url))
+
+    def content_keys(self, urls, max_distance=None):
+        '''
+        Map each of ``urls`` to the content it points at.
+
+        Links whose downloads had the same bytes share their SHA-256. With
+        ``max_distance``, photos whose dHashes differ by at most that many
+        bits share the key of the first such photo as well. Links never
+        downloaded map to themselves.
+        '''
+        keys = {}
+        representatives = []
+        for url in urls:
+            entry = self.entry(url) or {}
+            key = entry.get("sha256") or url
+            if max_distance is not None and entry.get("dhash"):
+                for dhash, representative in representatives:
+                    if hash_distance(dhash, entry["dhash"]) <= max_distance:
+                        key = representative
+                        break
+                else:
+                    representatives.append((entry["dhash"], key))
+            keys[url] = key
+        return keys
+
+    def derivative_path(self, url):
+        return self.cache_dir / (re.sub(r"[^A-Za-z0-9_-]", "_", self.key(url)) + ".jpg")
+
+    def candidates(self, urls, max_bytes=HERO_MAX_BYTES, max_pixels=HERO_MAX_PIXELS):
+        '''
+        Return the ``urls`` whose images decoded and are reasonably sized.
+        '''
+        return [url for url in urls if self._is_candidate(self.entries.get(self.key(url)), max_bytes, max_pixels)]
+
+    @staticmethod
+    def _is_candidate(entry, max_bytes=HERO_MAX_BYTES, max_pixels=HERO_MAX_PIXELS):
+        if not entry or not entry.get("ok"):
+            return False
+        return (entry.get("bytes") or 0) <= max_bytes and entry["width"] * entry["height"] <= max_pixels
+
+    def save(self):
+        with self._lock:
+            payload = json.dumps(self.entries, indent=1, sort_keys=True)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = self.path.with_name(self.path.name + '.tmp')
+            temporary_path.write_text(payload, encoding='utf8')
+            temporary_path.replace(self.path)
+
+class ResponseHistory:
+    '''
+    Every answer ever submitted to the sheet, in an SQLite file indexed
+    by respondent, question and date, with full-text search over answers
+    and captions.
+
+    ``ingest`` takes the whole sheet each run but only writes rows that are
+    new or were edited since, so lookups over years of editions never
+    rescan the CSV.
+    '''
+
+    def __init__(self, path=HISTORY_PATH):
+        self.path = Path(path)
+        if str(path) != ':memory:':
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._connection.executescript('''
+            CREATE TABLE IF NOT EXISTS responses (row_key TEXT PRIMARY KEY, digest TEXT, submitted TEXT, respondent TEXT);
+            CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, row_key TEXT, submitted TEXT,
+                                                respondent TEXT, question TEXT, answer TEXT);
+            CREATE INDEX IF NOT EXISTS answers_by_row ON answers (row_key);
+            CREATE INDEX IF NOT EXISTS answers_by_respondent ON answers (respondent, submitted);
+            CREATE INDEX IF NOT EXISTS answers_by_question ON answers (question, submitted);
+            CREATE INDEX IF NOT EXISTS answers_by_date ON answers (submitted);
+        ''')
+        try:
+            self._connection.executescript('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS answers_text USING fts5 (answer, content='answers', content_rowid='id');
+                CREATE TRIGGER IF NOT EXISTS answers_text_insert AFTER INSERT ON answers BEGIN
+                    INSERT INTO answers_text (rowid, answer) VALUES (new.id, new.answer);
+                END;
+                CREATE TRIGGER IF NOT EXISTS answers_text_delete AFTER DELETE ON answers BEGIN
+                    INSERT INTO answers_text (answers_text, rowid, answer) VALUES ('delete', old.id, old.answer);
+                END;
+            ''')
+            self.full_text = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: search falls back to LIKE.
+            self.full_text = False
+
+    @classmethod
+    def copy_of(cls, path=HISTORY_PATH):
+        '''
+        Return an in-memory copy of the history at ``path``, empty if there
+        is none. Ingesting into the copy never touches the file.
+        '''
+        history = cls(':memory:')
+        if Path(path).exists():
+            source = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+            try:
+                source.backup(history._connection)
+            finally:
+                source.close()
+        return history
+
+    def ingest(self, responses, name_column="Your Name", timestamp_column="Timestamp"):
+        '''
+        Add the rows of ``responses`` not stored yet, replacing edited ones.
+        Returns how many rows were written.
+        '''
+        questions = [column for column in responses.columns if column not in (name_column, timestamp_column)]
+        rows = zip(responses[timestamp_column], responses[name_column], *(responses[column] for column in questions))
+        with self._lock:
+            stored = dict(self._connection.execute('SELECT row_key, digest FROM responses'))
+            written = 0
+            with self._connection:
+                for timestamp, name, *answers in rows:
+                    submitted = response_date(timestamp)
+                    if submitted is None:
+                        continue
+                    row_key = hashlib.sha256(f'{timestamp}\0{name}'.encode('utf8')).hexdigest()
+                    digest = hashlib.sha256(repr(answers).encode('utf8')).hexdigest()
+                    if stored.get(row_key) == digest:
+                        continue
+                    if row_key in stored:
+                        self._connection.execute('DELETE FROM answers WHERE row_key = ?', (row_key,))
+                    self._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                             (row_key, digest, submitted.isoformat(), str(name).strip()))
+                    self._connection.executemany(
+                        'INSERT INTO answers (row_key, submitted, respondent, question, answer) VALUES (?, ?, ?, ?, ?)',
+                        [(row_key, submitted.isoformat(), str(name).strip(), question, str(answer))
+                         for question, answer in zip(questions, answers) if str(answer).strip()])
+                    stored[row_key] = digest
+                    written += 1
+        return written
+
+    def _query(self, sql, parameters):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @staticmethod
+    def _range(since, until):
+        return (since.isoformat() if since else '0000-00-00', until.isoformat() if until else '9999-99-99')
+
+    def answers_by(self, respondent, question=None, since=None, until=None):
+        '''
+        ``(date, question, answer)`` of everything ``respondent`` submitted.
+        '''
+        sql = 'SELECT submitted, question, answer FROM answers WHERE respondent = ? AND submitted BETWEEN ? AND ?'
+        parameters = [str(respondent).strip(), *self._range(since, until)]
+        if question is not None:
+            sql += ' AND question = ?'
+            parameters.append(question)
+        return self._query(sql + ' ORDER BY submitted, id', parameters)
+
+    def answers_to(self, question, since=None, until=None):
+        '''
+        ``(date, respondent, answer)`` of every answer to ``question``.
+        '''
+        return self._query('SELECT submitted, respondent, answer FROM answers WHERE question = ? '
+                           'AND submitted BETWEEN ? AND ? ORDER BY submitted, id',
+                           [question, *self._range(since, until)])
+
+    def search(self, text, limit=20):
+        '''
+        ``(date, respondent, question, answer)`` of answers containing the
+        words in ``text``, newest first.
+        '''
+        if self.full_text:
+            words = ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+            return self._query('SELECT submitted, respondent, question, answers.answer FROM answers_text '
+                               'JOIN answers ON answers.id = answers_text.rowid WHERE answers_text MATCH ? '
+                               'ORDER BY submitted DESC LIMIT ?', [words, limit])
+        return self._query('SELECT submitted, respondent, question, answer FROM answers WHERE answer LIKE ? '
+                           'ORDER BY submitted DESC LIMIT ?', ['%{}%'.format(text), limit])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+class AssetCache:
+    '''
+    Encoded email attachments kept on disk between pipeline runs.
+
+    Keys hash the source URLs together with the encoding settings, so a new
+    photo or a different size budget produces a new entry, never a stale one.
+    '''
+
+    def __init__(self, directory=ASSET_CACHE_DIR, suffix=''):
+        self.directory = Path(directory)
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf8')).hexdigest()
+        return self.directory / digest[:2] / (digest + self.suffix)
+
+    def get_or_build(self, key, build):
+        path = self.get_or_build_path(key, build)
+        return None if path is None else path.read_bytes()
+
+    def get_or_build_path(self, key, build):
+        '''
+        Like ``get_or_build`` but return the cached file's path, so large
+        payloads can be streamed rather than read into memory.
+        '''
+        path = self.path(key)
+        if path.exists():
+            self.hits += 1
+            return path
+        self.misses += 1
+        payload = build()
+        if payload is None:
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Newsletters sharing the cache may build the same entry at once.
+        temporary_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        temporary_path.write_bytes(payload)
+        temporary_path.replace(path)
+        return path
+
+class SourceImages:
+    '''
+    Decoded source images shared by concurrent encode jobs.
+
+    Jobs announce the URLs they will read with ``expect``. Each announced
+    image is downloaded and decoded once, kept while announced jobs still
+    need it and dropped after the last ``release``. URLs nobody announced
+    are decoded on demand and not kept. ``key`` maps a URL to the content
+    it points at, so links known to hold the same photo share one decode.
+    '''
+
+    def __init__(self, open_image, key=None):
+        self.open_image = open_image
+        self.key = key or (lambda url: url)
+        self.decodes = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._images = {}
+        self._url_locks = {}
+
+    def expect(self, urls):
+        with self._lock:
+            for url in urls:
+                key = self.key(url)
+                self._pending[key] = self._pending.get(key, 0) + 1
+
+    def get(self, url):
+        key = self.key(url)
+        with self._lock:
+            key_lock = self._url_locks.setdefault(key, threading.Lock()) if key in self._pending else None
+        if key_lock is None:
+            return self._decode(url)
+        with key_lock:
+            with self._lock:
+                if key in self._images:
+                    return self._images[key]
+            image = self._decode(url)
+            with self._lock:
+                if key in self._pending:
+                    self._images[key] = image
+            return image
+
+    def release(self, urls):
+        with self._lock:
+            for url in urls:
+                key = self.key(url)
+                remaining = self._pending.get(key, 0) - 1
+                if remaining > 0:
+                    self._pending[key] = remaining
+                    continue
+                self._pending.pop(key, None)
+                self._images.pop(key, None)
+                self._url_locks.pop(key, None)
+
+    def _decode(self, url):
+        image = self.open_image(url)
+        if image is not None:
+            image.load() # decode now so concurrent readers never race on lazy loading
+        with self._lock:
+            self.decodes += 1
+        return image
+
+def peak_memory_mb():
+    '''
+    Peak resident memory of this process so far in MB, or ``None`` where
+    the ``resource`` module is missing (Windows).
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB.
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def serialize_message(msg):
+    '''
+    Serialize ``msg`` with CRLF line endings, ready to be sent as-is.
+    '''
+    output = BytesIO()
+    BytesGenerator(output, policy=msg.policy.clone(linesep="\r\n")).flatten(msg)
+    return output.getvalue()
+
+def stream_message(smtp_server, sender, recipients, path, chunk_size=64 * 1024):
+    '''
+    Send the serialized message at ``path`` over an open SMTP session.
+
+    The file is read line by line and written to the DATA command in chunks,
+    applying only the dot-stuffing the protocol requires, so the message is
+    never re-encoded or held in memory as a whole. Returns the refused
+    recipients, like ``smtplib.SMTP.sendmail``.
+    '''
+    code, response = smtp_server.mail(sender)
+    if code != 250:
+        smtp_server.rset()
+        raise smtplib.SMTPSenderRefused(code, response, sender)
+    refused = {}
+    for recipient in recipients:
+        code, response = smtp_server.rcpt(recipient)
+        if code not in (250, 251):
+            refused[recipient] = (code, response)
+    if len(refused) == len(recipients):
+        smtp_server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, response = smtp_server.docmd("data")
+    if code != 354:
+        smtp_server.rset()
+        raise smtplib.SMTPDataError(code, response)
+    chunk = bytearray()
+    with Path(path).open('rb') as message_file:
+        for line in message_file:
+            if line.startswith(b'.'):
+                chunk += b'.'
+            chunk += line.rstrip(b'\r\n') + b'\r\n'
+            if len(chunk) >= chunk_size:
+                smtp_server.send(bytes(chunk))
+                chunk.clear()
+    chunk += b'.\r\n'
+    smtp_server.send(bytes(chunk))
+    code, response = smtp_server.getreply()
+    if code != 250:
+        smtp_server.rset()
+        raise smtplib.SMTPDataError(code, response)
+    return refused
+
+def delivery_result(code, response):
+    '''
+    Describe a failed delivery: 4xx replies are "deferred" and worth
+    retrying, anything else is "refused" for good.
+    '''
+    if isinstance(response, bytes):
+        response = response.decode('utf8', errors='replace')
+    outcome = 'deferred' if 400 <= code < 500 else 'refused'
+    return '{} {} {}'.format(outcome, code, response)
+
+def is_settled(result):
+    return result is not None and (result == 'sent' or result.startswith(('refused', 'undelivered')))
+
+class Responses:
+    '''
+    Form responses stored as one list per column.
+
+    Covers what the newsletter needs from the sheet: ``responses[column]``
+    returns a column as a list, ``columns`` the header in sheet order and
+    ``len(responses)`` the number of rows. Empty cells are ``''``.
+    '''
+
+    __slots__ = ('columns', '_data')
+
+    def __init__(self, columns, rows=()):
+        self.columns = []
+        for column in columns:
+            name, suffix = str(column), 1
+            while name in self.columns: # duplicate headers get pandas-style suffixes
+                name, suffix = f"{column}.{suffix}", suffix + 1
+            self.columns.append(name)
+        self._data = {column: [] for column in self.columns}
+        cells = list(self._data.values())
+        for row in rows:
+            for i, cells_of_column in enumerate(cells):
+                cells_of_column.append(row[i] if i < len(row) else '')
+
+    @classmethod
+    def from_columns(cls, data):
+        '''
+        Build responses from a ``{column: values}`` mapping.
+        '''
+        return cls(data, zip(*data.values()))
+
+    @classmethod
+    def from_csv(cls, text):
+        reader = csv.reader(io.StringIO(text, newline=''))
+        header = next(reader, [])
+        return cls(header, (row for row in reader if any(row)))
+
+    def __getitem__(self, column):
+        return list(self._data[column])
+
+    def __len__(self):
+        return len(self._data[self.columns[0]]) if self.columns else 0
+
+    def where(self, keep):
+        '''
+        Return the rows for which ``keep`` (one flag per row) is true.
+        '''
+        selected = Responses(self.columns)
+        for column in self.columns:
+            selected._data[column] = [cell for cell, kept in zip(self._data[column], keep) if kept]
+        return selected
+
+    def to_csv(self, path):
+        with Path(path).open('w', encoding='utf8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(zip(*(self._data[column] for column in self.columns)))
+
+def read_responses(source, backend=None, session=None):
+    '''
+    Read a response sheet from a CSV URL or path into ``Responses``.
+
+    The default ``csv`` backend only needs the standard library and keeps
+    every cell as text. Set ``NEWSLETTER_BACKEND=pandas`` to parse with
+    pandas instead. URLs are fetched through ``session`` when given.
+    '''
+    backend = backend or os.getenv('NEWSLETTER_BACKEND', 'csv')
+    if backend not in ('csv', 'pandas'):
+        raise ValueError(f"Unknown response backend {backend!r}, expected 'csv' or 'pandas'")
+    if str(source).startswith(('http://', 'https://')):
+        response = (session or requests).get(source, timeout=30)
+        response.raise_for_status()
+        text = response.content.decode('utf-8-sig')
+    else:
+        with open(source, encoding='utf-8-sig', newline='') as f: # keep line breaks inside answers as written
+            text = f.read()
+    if backend == 'pandas':
+        import pandas as pd # optional, and not installed by the workflows
+        frame = pd.read_csv(io.StringIO(text), dtype=str, keep_default_na=False)
+        return Responses(frame.columns, frame.values.tolist())
+    return Responses.from_csv(text)
+
+def response_date(timestamp):
+    '''
+    Return the date of a sheet timestamp (day first), or ``None``.
+    '''
+    for timestamp_format in ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return date(*time.strptime(str(timestamp).strip(), timestamp_format)[:3])
+        except ValueError:
+            continue
+    return None
+
+class SMTPSession:
+    '''
+    One logged-in SMTP connection shared by every newsletter sent from the
+    same account in a process.
+
+    Sends hold the connection one at a time. It is opened on first use and
+    opened again if the server has dropped it in between.
+    '''
+
+    def __init__(self, sender, password, host=SMTP_HOST, port=SMTP_PORT, context=None):
+        self.sender = sender
+        self.password = password
+        self.host = host
+        self.port = port
+        self.context = context
+        self.logins = 0
+        self._server = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.noop()
+                except smtplib.SMTPException:
+                    self._server = None
+            if self._server is None:
+                server = smtplib.SMTP_SSL(self.host, self.port, context=self.context)
+                server.ehlo()
+                server.login(self.sender, self.password)
+                self.logins += 1
+                self._server = server
+            yield self._server
+
+    def close(self):
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.quit()
+                except smtplib.SMTPException:
+                    pass
+                self._server = None
 
 class Newsletter:
 
     def __init__(self, first_edition_date, frequency_unit, frequency, timezone, sender, recipients, 
-                 recipients_spark, password, sheet_id, sheet_name, background_url, special_edition=False, num_images=3):
+                 recipients_spark, password, sheet_id, sheet_name, background_url, special_edition=False, num_images=3,
+                 image_index=None, asset_cache=None, message_cache=None,
+                 batch_size=RECIPIENT_BATCH_SIZE, send_interval=SEND_INTERVAL_SECONDS, workers=ENCODE_WORKERS,
+                 near_duplicate_distance=None, image_profile=SPARK_IMAGE_PROFILE,
+                 templates=None, log_path=None, session=None, smtp_session=None, history=None,
+                 html_clip_policy='warn'):
         
-        self.datetime_now = datetime.now(tz=pytz.timezone(timezone))
         self.sender = sender
         self.recipients = recipients
         self.recipients_spark = recipients_spark
@@ -42,82 +1230,195 @@ class Newsletter:
         self.max_image_byte = 0.
         self.special_edition = special_edition
         self.num_images = num_images
+        self.image_index = image_index
+        self.asset_cache = asset_cache
+        self.message_cache = message_cache
+        self.batch_size = batch_size
+        self.send_interval = send_interval
+        self.workers = workers
+        self.near_duplicate_distance = near_duplicate_distance
+        self.image_profile = image_profile
+        self.templates = templates
+        self.log_path = log_path
+        self.session = session
+        self.smtp_session = smtp_session
+        self.history = history
+        self.html_clip_policy = html_clip_policy
+        self.html_sizes = {}
+        self.incomplete_variants = set()
+        self._content_keys = {}
+        self._prefetched = {}
+        self.sources = SourceImages(self._fetch_source, key=self._content_key)
+        self.frequency_unit = frequency_unit
+        self.timezone = timezone
+        self.sheet_url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}'.replace(" ", "%20")
+        self._sections = {}
+        self.changed_sections = set()
+        self.load_responses()
 
-        url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}'.replace(" ", "%20")
-        data_df = pd.read_csv(url).replace(np.nan, '')
-        timestamps = pd.to_datetime(
-            data_df["Timestamp"],
-            dayfirst=True,
-            errors="coerce",
-        )
-        if frequency_unit == 'month':
-            cutoff_date = (self.datetime_now - timedelta(days=14)).date()
-        else:
-            cutoff_date = (self.datetime_now - self.time_delta).date()
-        self.data_df = data_df[timestamps.dt.date >= cutoff_date]
+    def load_responses(self):
+        '''
+        Download the response sheet and keep the rows for this edition.
+
+        Calling this again on the same instance lets ``generate_newsletter``
+        recompute only the sections whose source columns changed.
+        '''
+        self.datetime_now = datetime.now(tz=pytz.timezone(self.timezone))
+        responses = read_responses(self.sheet_url, session=self.session)
+        if self.history is not None:
+            self.history.ingest(responses)
+        self.responses = self.edition_responses(responses)
+
+    def reloaded(self):
+        '''
+        Return a copy of this newsletter with freshly downloaded responses.
+
+        The copy starts from this one's sections, so its
+        ``generate_newsletter`` still rebuilds only what changed, but
+        nothing it does is visible through this instance.
+        '''
+        fresh = copy.copy(self)
+        fresh._sections = dict(self._sections)
+        fresh.changed_sections = set()
+        fresh.html_sizes = {}
+        fresh.incomplete_variants = set()
+        fresh._content_keys = {}
+        fresh._prefetched = {}
+        fresh.sources = SourceImages(fresh._fetch_source, key=fresh._content_key)
+        fresh.load_responses()
+        return fresh
+
+    def edition_responses(self, responses, until=None):
+        '''
+        Keep the rows of ``responses`` submitted in the window that ends at
+        ``datetime_now``. With ``until``, rows after that date are dropped
+        too, which recovers a past edition's rows from the full sheet.
+        '''
+        dates = [response_date(timestamp) for timestamp in responses["Timestamp"]]
+        cutoff_date = self.window_start()
+        return responses.where([day is not None and cutoff_date <= day and (until is None or day <= until)
+                                for day in dates])
+
+    def window_start(self):
+        if self.frequency_unit == 'month':
+            return (self.datetime_now - timedelta(days=14)).date()
+        return (self.datetime_now - self.time_delta).date()
+
+    def _on_this_day(self):
+        '''
+        Answers from the edition a year before this one, as ``(name, answer)``.
+        '''
+        if self.history is None:
+            return []
+        year = relativedelta(years=1)
+        since, until = self.window_start() - year, self.datetime_now.date() - year
+        answers = []
+        for question in ON_THIS_DAY_QUESTIONS:
+            answers += [(name, answer) for _, name, answer in self.history.answers_to(question, since=since, until=until)]
+        return answers
+
+    def edition_date(self, edition):
+        '''
+        Scheduled send date of ``edition``, counting from ``first_edition_date``.
+        '''
+        first = datetime.strptime(self.first_edition_date, '%Y/%m/%d')
+        return pytz.timezone(self.timezone).localize(first + self.time_delta * (edition - 1))
+
+    def for_edition(self, edition, responses=None, sheet=None):
+        '''
+        Return a copy of this newsletter dated for past ``edition``.
+
+        ``responses`` are that edition's stored rows. Without them, the rows
+        come from ``sheet`` (the full sheet, downloaded if not given),
+        limited to the edition's date window. The copy has its own sections
+        and decoded images, so several past editions can be built at once.
+        '''
+        past = copy.copy(self)
+        past.datetime_now = self.edition_date(edition)
+        if responses is None:
+            if sheet is None:
+                sheet = read_responses(self.sheet_url, session=self.session)
+            responses = past.edition_responses(sheet, until=past.datetime_now.date())
+        past.responses = responses
+        past._sections = {}
+        past.changed_sections = set()
+        past.incomplete_variants = set()
+        past._content_keys = {}
+        past._prefetched = {}
+        past.sources = SourceImages(past._fetch_source, key=past._content_key)
+        return past
+
+    def save_responses(self, path):
+        '''
+        Write this edition's responses so a resumed send uses the same rows.
+        '''
+        self.responses.to_csv(path)
+
+    def restore_responses(self, path):
+        self.responses = read_responses(path)
+
+    def _section(self, key, columns, build):
+        '''
+        Return section ``key``, rebuilding it only when ``columns`` changed.
+
+        Each section is cached with a hash of the response columns it reads,
+        so repeated builds skip sections whose responses are unchanged.
+        '''
+        digest = hashlib.sha256()
+        for column in columns:
+            digest.update(repr((column, self.responses[column])).encode("utf8"))
+        digest = digest.hexdigest()
+        cached = self._sections.get(key)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        value = build()
+        self._sections[key] = (digest, value)
+        self.changed_sections.add(key)
+        return value
 
-    def generate_newsletter(self, update_edition=True):
+    def generate_newsletter(self, update_edition=True, edition=None):
         '''
         Generate newsletter using HTML templates and Jinja.
 
         The local preview passes ``update_edition=False`` so rendering shows
-        the next issue number without advancing the persisted counter.
+        the next issue number without advancing the persisted counter. A
+        resumed pipeline build passes its already allocated ``edition``.
         '''
-        environment = Environment(autoescape=True)
-        with (BASE_DIR / 'template.html').open(encoding="utf8") as f:
-            template = environment.from_string(f.read())
+        standard_path, spark_path = self.templates or (BASE_DIR / 'template.html', BASE_DIR / 'template_spark.html')
+        template = load_template(standard_path)
+        template_spark = load_template(spark_path)
 
-        with (BASE_DIR / 'template_spark.html').open(encoding="utf8") as f:
-            template_spark = environment.from_string(f.read())
+        self.changed_sections = set()
+        columns = list(self.responses.columns)
+        question_column = columns[2]
+        name_column = "Your Name"
+        image_columns = [f"Image {i}" for i in range(1, self.num_images + 1)]
+        caption_columns = [f"Caption {i}" for i in range(1, self.num_images + 1)]
+        diyl_columns = ["Description of a DIYL"] if "Description of a DIYL" in columns else []
 
-        question = self.data_df.iloc[:, 2].to_list()
-        names = self.data_df["Your Name"].to_list()
-        one_good_thing = self.data_df["☀️ One Good Thing!"].to_list()
-        life_updates = self.data_df["✨ Any life updates?"].to_list()
-        images = [self.data_df[f"Image {i}"].to_list() for i in range(1, self.num_images + 1)]
-        captions = [self.data_df[f"Caption {i}"].to_list() for i in range(1, self.num_images + 1)]
-        food_spot = self.data_df['😋 Food spot of the month?'].to_list()
-        confessions = self.data_df['🤫 Any interesting, funny, or embarrassing moments?'].to_list()
+        def text_section(column):
+            return lambda: [(name, answer) for name, answer in zip(self.responses[name_column], self.responses[column]) if answer != '']
 
-        has_diyl_col = "Description of a DIYL" in self.data_df.columns
-        existing_diyl_rows = (
-            has_diyl_col
-            and any(self.data_df["Description of a DIYL"].astype(str).str.strip() != '')
+        question_answers, question_mode = self._section(
+            "question_answers",
+            [question_column, name_column] + diyl_columns,
+            self._build_question_answers,
         )
-        looks_like_diyl_links = any("drive.google.com" in str(a) for a in question if str(a).strip())
-        use_diyl_mode = existing_diyl_rows and looks_like_diyl_links
-
-        if use_diyl_mode:
-            diyl_desc = self.data_df["Description of a DIYL"].to_list()
-            qa = []
-            for i, (name, raw, desc) in enumerate(zip(names, question, diyl_desc)):
-                raw = str(raw).strip()
-                if not raw:
-                    continue
-                links = [x.strip() for x in raw.split(",") if x.strip()]
-                if not links:
-                    continue
-                cid = f"questiongif{i}"
-                qa.append((name, cid, str(desc), links))
-            question_answers = qa
-            question_mode = "diyl_gif"
-        else:
-            question_answers = [(name, answer) for name, answer in zip(names, question) if answer != ""]
-            question_mode = "text"
 
-        self.email_data = {
+        email_data = {
             "subject": "Chatime Newsletter 🍵",
-            "question_title": self.data_df.columns[2],
+            "question_title": question_column,
             "question_answers": question_answers,
             "question_mode": question_mode,
-            "life_updates": [(name, answer) for name, answer in zip(names, life_updates) if answer != ''],
-            "one_good_thing": [(name, ogt) for ogt, name in zip(one_good_thing, names) if ogt != ''],
-            "food_spot": [(name, fs) for fs, name in zip(food_spot, names) if fs != ''],
-            "confessions": [(name, c) for c, name in zip(confessions, names) if c != ''],
-            "images": [[self._drive_direct_url(images[i][j]), names[j], captions[i][j]] for j in range(len(names)) for i in range(len(images)) if images[i][j] != ''],
+            "life_updates": self._section("life_updates", [name_column, "✨ Any life updates?"], text_section("✨ Any life updates?")),
+            "one_good_thing": self._section("one_good_thing", [name_column, "☀️ One Good Thing!"], text_section("☀️ One Good Thing!")),
+            "food_spot": self._section("food_spot", [name_column, '😋 Food spot of the month?'], text_section('😋 Food spot of the month?')),
+            "confessions": self._section("confessions", [name_column, '🤫 Any interesting, funny, or embarrassing moments?'], text_section('🤫 Any interesting, funny, or embarrassing moments?')),
+            "images": self._section("images", [name_column] + image_columns + caption_columns, self._build_images),
+            "on_this_day": self._on_this_day(),
             "date": self.datetime_now,
             "next_date": self.datetime_now + self.time_delta,
-            "edition_number": edition_number(update_log=update_edition),
+            "edition_number": edition if edition is not None else edition_number(update_log=update_edition, log_path=self.log_path),
             "background_url": self.background_url,
             # "special_images": [],
             # "extra_images": [],
@@ -125,14 +1426,21 @@ class Newsletter:
 
         # special edition
         if self.special_edition:
-            special_edition_questions = self.data_df.columns.to_list()[13:21]
-            special_edition_answers = {q: self.data_df[q].to_list() for q in special_edition_questions}
-            extra_images = [self.data_df[f"Extra Image {i}"].to_list() for i in range(1, self.num_images + 1)]
-            extra_image_captions = [self.data_df[f"Extra Caption {i}"].to_list() for i in range(1, self.num_images + 1)]
-            self.email_data["special_edition_questions"] = special_edition_questions
-            self.email_data["special_edition_answers"] = {q: [(name, answer) for name, answer in zip(names, special_edition_answers[q]) if answer != ''] for q in special_edition_questions}
-            self.email_data["extra_images"] = [[extra_images[i][j].replace('open?', 'uc?export=view&'), names[j], extra_image_captions[i][j]] for j in range(len(names)) for i in range(len(extra_images)) if extra_images[i][j] != '']
-            self.email_data["special_images"] = [
+            special_edition_questions = columns[13:21]
+            extra_image_columns = [f"Extra Image {i}" for i in range(1, self.num_images + 1)]
+            extra_caption_columns = [f"Extra Caption {i}" for i in range(1, self.num_images + 1)]
+            email_data["special_edition_questions"] = special_edition_questions
+            email_data["special_edition_answers"] = self._section(
+                "special_edition_answers",
+                [name_column] + special_edition_questions,
+                lambda: {q: text_section(q)() for q in special_edition_questions},
+            )
+            email_data["extra_images"] = self._section(
+                "extra_images",
+                [name_column] + extra_image_columns + extra_caption_columns,
+                self._build_extra_images,
+            )
+            email_data["special_images"] = [
                 ["https://drive.google.com/uc?export=view&id=1N6Y3mYt3VbrL3NrUmn7vOUbP5RPHC5gy", "portraits", "need more selfies from some of y'all"],
                 ["https://drive.google.com/uc?export=view&id=1IUrWCdUdtwRD91bcKb5qdugiyzXZWHa4", "outdoor", "outdoor adventures"],
                 ["https://drive.google.com/uc?export=view&id=1IsQWyY3QxgkA15EvTgPOJ1BXr8tpvRuL", "instagram1", "if we had a chatime insta..."],
@@ -140,107 +1448,364 @@ class Newsletter:
                 ["https://drive.google.com/uc?export=view&id=1pU2sp4Kk8Oy0FjV2SbFbYxYFRUEI6fzI", "instagram3", "chatime instagram 3"]
             ]
 
+        self.email_data = email_data
         self.max_image_byte = 25. / (1 + len(self.email_data["images"])) # + len(self.email_data["extra_images"]) + len(self.email_data["special_images"]))
-        self.email_content = template.render(self.email_data)
-        self.email_content_spark = template_spark.render(self.email_data)
+        self.email_content = self._optimize_html(template.render(self.email_data), 'standard')
+        self.email_content_spark = self._optimize_html(template_spark.render(self.email_data), 'spark')
+
+    def _optimize_html(self, content, variant):
+        content, before, after = optimize_email_html(content, variant, self.html_clip_policy)
+        self.html_sizes[variant] = (before, after)
+        return content
+
+    def _build_question_answers(self):
+        question = self.responses[self.responses.columns[2]]
+        names = self.responses["Your Name"]
+        has_diyl_col = "Description of a DIYL" in self.responses.columns
+        existing_diyl_rows = (
+            has_diyl_col
+            and any(str(desc).strip() != '' for desc in self.responses["Description of a DIYL"])
+        )
+        looks_like_diyl_links = any("drive.google.com" in str(a) for a in question if str(a).strip())
+        use_diyl_mode = existing_diyl_rows and looks_like_diyl_links
+
+        if use_diyl_mode:
+            diyl_desc = self.responses["Description of a DIYL"]
+            qa = []
+            for i, (name, raw, desc) in enumerate(zip(names, question, diyl_desc)):
+                raw = str(raw).strip()
+                if not raw:
+                    continue
+                links = [x.strip() for x in raw.split(",") if x.strip()]
+                if not links:
+                    continue
+                cid = f"questiongif{i}"
+                qa.append((name, cid, str(desc), links))
+            return qa, "diyl_gif"
+        return [(name, answer) for name, answer in zip(names, question) if answer != ""], "text"
+
+    def _build_images(self):
+        names = self.responses["Your Name"]
+        images = [self.responses[f"Image {i}"] for i in range(1, self.num_images + 1)]
+        captions = [self.responses[f"Caption {i}"] for i in range(1, self.num_images + 1)]
+        return [[self._drive_direct_url(images[i][j]), names[j], captions[i][j]] for j in range(len(names)) for i in range(len(images)) if images[i][j] != '']
+
+    def _build_extra_images(self):
+        names = self.responses["Your Name"]
+        extra_images = [self.responses[f"Extra Image {i}"] for i in range(1, self.num_images + 1)]
+        extra_image_captions = [self.responses[f"Extra Caption {i}"] for i in range(1, self.num_images + 1)]
+        return [[extra_images[i][j].replace('open?', 'uc?export=view&'), names[j], extra_image_captions[i][j]] for j in range(len(names)) for i in range(len(extra_images)) if extra_images[i][j] != '']
+
+    def build_message(self, spark=False):
+        '''
+        Assemble the MIME message for one variant without sending it.
+        '''
+        return self.build_messages((spark,))[spark]
+
+    def build_messages(self, variants=(False, True)):
+        '''
+        Assemble several variants at once, keyed by ``spark``.
+
+        Every attachment of every variant is an encode job on one worker
+        pool, and the jobs share decoded source images, so a photo used by
+        both variants, or behind several links, is downloaded and decoded
+        only once. Attachments repeating an earlier one's photos are left
+        out and their content ids point at the earlier attachment.
+        '''
+        try:
+            return self._build_messages(variants)
+        finally:
+            self._prefetched.clear()
+
+    def _build_messages(self, variants):
+        self.incomplete_variants = set()
+        self.resolve_content_keys(variants)
+        jobs = {spark: self._attachment_jobs(spark) for spark in variants}
+        needed = set()
+        for variant_jobs in jobs.values():
+            for urls, _, _ in variant_jobs:
+                self.sources.expect(urls)
+                needed.update(urls)
+        for url in set(self._prefetched) - needed: # aliased or unused by these variants
+            del self._prefetched[url]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            payloads = {
+                spark: [pool.submit(self._run_job, urls, build) for urls, build, _ in variant_jobs]
+                for spark, variant_jobs in jobs.items()
+            }
+            messages = {}
+            for spark, variant_jobs in jobs.items():
+                msg = MIMEMultipart()
+                msg['Subject'] = self.email_data["subject"] + " " + self.email_data["date"].strftime("%m/%d")
+                msg['From'] = self.sender
+                msg['To'] = self.sender
+                for (_, _, attach), payload in zip(variant_jobs, payloads[spark]):
+                    payload = payload.result()
+                    if payload is not None:
+                        attach(msg, payload)
+                    else:
+                        self.incomplete_variants.add(spark)
+                msg.attach(MIMEText(self._variant_content(spark), "html"))
+                messages[spark] = msg
+        return messages
+
+    def _attachment_jobs(self, spark=False):
+        '''
+        One variant's attachments in message order, as ``(urls, build,
+        attach)``: ``build`` encodes the attachment from the source ``urls``
+        and ``attach`` adds the encoded bytes to a message.
+        '''
+        max_image_byte = self._spark_budget_mb() if spark else None
+        aliases = self._cid_aliases(spark)
+        jobs = []
+        if self.email_data.get("question_mode") == "diyl_gif":
+            jobs += self._question_gif_jobs(max_image_byte=max_image_byte, skip=aliases)
+        if spark:
+            jobs += self._image_jobs(max_image_byte=max_image_byte, skip=aliases)
+        return jobs
+
+    def _attachment_sources(self, spark=False):
+        '''
+        One variant's attachments in message order, as ``(content id, key
+        parts, source urls)``. Attachments with equal key parts and sources
+        of equal content come out identical.
+        '''
+        sources = []
+        if self.email_data.get("question_mode") == "diyl_gif":
+            for answer in self.email_data.get("question_answers", []):
+                if len(answer) >= 4:
+                    sources.append((answer[1], ("gif", str(answer[0]).strip()), list(answer[3])))
+        if spark:
+            for i, (url, _, _) in enumerate([[self.background_url, '', '']] + self.email_data["images"]):
+                sources.append((f"image{i}", ("jpeg",), [url]))
+        return sources
+
+    def resolve_content_keys(self, variants=(False, True)):
+        '''
+        Resolve the image links of ``variants`` to the content they hold.
+
+        Links the image index has not seen yet are downloaded first; the
+        decoded images are handed to the encode jobs rather than fetched
+        again. Without an image index every link counts as distinct.
+        '''
+        if self.image_index is None:
+            return self._content_keys
+        urls = list(dict.fromkeys(url for spark in variants for _, _, urls in self._attachment_sources(spark) for url in urls))
+        unknown = [url for url in urls if self.image_index.entry(url) is None]
+        if unknown:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                self._prefetched.update(zip(unknown, pool.map(self._open_remote_image, unknown)))
+        self._content_keys = self.image_index.content_keys(urls, max_distance=self.near_duplicate_distance)
+        return self._content_keys
+
+    def _content_key(self, url):
+        return self._content_keys.get(url, url)
+
+    def _fetch_source(self, url):
+        image = self._prefetched.pop(url, None)
+        return image if image is not None else self._open_remote_image(url)
+
+    def _cid_aliases(self, spark=False):
+        '''
+        Map the content id of each attachment that repeats an earlier one's
+        photos to the earlier attachment's content id.
+        '''
+        aliases = {}
+        seen = {}
+        for cid, parts, urls in self._attachment_sources(spark):
+            key = parts + tuple(self._content_key(url) for url in urls)
+            if key in seen:
+                aliases[cid] = seen[key]
+            else:
+                seen[key] = cid
+        return aliases
+
+    def _variant_content(self, spark=False):
+        content = self.email_content_spark if spark else self.email_content
+        aliases = self._cid_aliases(spark)
+        if not aliases:
+            return content
+        return re.sub(r'cid:([\w.-]+)', lambda match: 'cid:' + aliases.get(match.group(1), match.group(1)), content)
+
+    def _run_job(self, urls, build):
+        try:
+            return build()
+        finally:
+            self.sources.release(urls)
+
+    def prepare_assets(self):
+        '''
+        Encode every attachment of both variants into ``asset_cache`` ahead of
+        the send, so the send itself only assembles and transmits.
+        '''
+        self.serialized_messages()
+        if self.image_index is not None:
+            self.image_index.save()
+
+    def message_key(self, spark=False):
+        '''
+        Key identifying everything that goes into one variant's message: the
+        rendered HTML, every attachment source and the encoding settings.
+
+        Only links and settings go in, never downloaded content or anything
+        derived from the image index, so the key is the same before and
+        after a build and looking it up needs no image. The duplicate
+        merging and the Spark size budget follow from the same links.
+        '''
+        content = self.email_content_spark if spark else self.email_content
+        budget = self._image_profile_key() if spark else None
+        images = [self.background_url] + [picture[0] for picture in self.email_data["images"]] if spark else []
+        gifs = []
+        if self.email_data.get("question_mode") == "diyl_gif":
+            gifs = [(answer[0], answer[1], tuple(answer[3])) for answer in self.email_data["question_answers"] if len(answer) >= 4]
+        return ("message", "spark" if spark else "standard", self.sender, self.email_data["subject"],
+                self.email_data["date"].strftime("%m/%d"), content, tuple(images), tuple(gifs), budget,
+                (self.image_index is not None, self.near_duplicate_distance))
+
+    def serialized_message(self, spark=False):
+        '''
+        Return the message for one variant as bytes, reusing the ``.eml``
+        in ``message_cache`` when the same edition was already assembled.
+        '''
+        return self.serialized_messages((spark,))[spark]
+
+    def serialized_messages(self, variants=(False, True)):
+        '''
+        Like ``serialized_message`` for several variants, assembling the ones
+        missing from ``message_cache`` together with ``build_messages``.
+
+        A message with a missing attachment (listed in
+        ``incomplete_variants``) is returned but never stored, so a later
+        run builds it again instead of reusing the broken copy.
+        '''
+        cache = self.message_cache
+        self.incomplete_variants = set()
+        missing = [spark for spark in variants if cache is None or not cache.path(self.message_key(spark)).exists()]
+        built = {spark: serialize_message(msg) for spark, msg in self.build_messages(missing).items()} if missing else {}
+        if cache is None:
+            return built
+        return {
+            spark: built[spark] if spark in self.incomplete_variants
+            else cache.get_or_build(self.message_key(spark), partial(built.get, spark))
+            for spark in variants
+        }
 
     def send_email(self, spark=False):
         '''
         Send email containing newsletter
         '''
-        msg = MIMEMultipart()
-        msg['Subject'] = self.email_data["subject"] + " " + self.email_data["date"].strftime("%m/%d")
-        msg['From'] = sender
-        msg['To'] = sender
-        if spark: 
-            spark_max_image_byte = self._spark_budget_mb()
-            if self.email_data.get("question_mode") == "diyl_gif":
-                self._attach_question_gifs(msg, max_image_byte=spark_max_image_byte)
-            self.image_to_byte(msg, max_image_byte=spark_max_image_byte)
-            msg.attach(MIMEText(self.email_content_spark, "html"))
+        message = self.serialized_message(spark=spark)
+        if self.message_cache is not None and spark not in self.incomplete_variants:
+            message = self.message_cache.path(self.message_key(spark))
+        self.send_message(message, spark=spark)
+
+    def send_message(self, message, spark=False, recipients=None, results=None):
+        '''
+        Send an already serialized message to one variant's recipients.
+
+        ``message`` is either bytes or the path of a stored ``.eml`` file,
+        which is streamed to the server without being re-encoded. Recipients
+        are sent in batches of ``batch_size``, ``send_interval`` seconds
+        apart, all reusing the same serialized message.
+
+        ``results`` maps each recipient to "sent" or a ``delivery_result``
+        and is updated as batches complete. Recipients whose result is
+        already settled are skipped, so passing a previous run's results
+        retries only the deferred ones. Returns ``results``.
+        '''
+        if recipients is None:
+            recipients = [self.sender] + (self.recipients_spark if spark else self.recipients) # recipients are BCCed
+        results = {} if results is None else results
+        pending = [recipient for recipient in recipients if not is_settled(results.get(recipient))]
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        if not batches:
+            return results
+        with self._smtp_connection() as smtp_server:
+            for number, batch in enumerate(batches):
+                if number:
+                    time.sleep(self.send_interval)
+                try:
+                    if isinstance(message, Path):
+                        refused = stream_message(smtp_server, self.sender, batch, message)
+                    else:
+                        refused = smtp_server.sendmail(self.sender, batch, message)
+                except smtplib.SMTPRecipientsRefused as error:
+                    refused = error.recipients
+                except (smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as error:
+                    refused = {recipient: (error.smtp_code, error.smtp_error) for recipient in batch}
+                for recipient in batch:
+                    results[recipient] = delivery_result(*refused[recipient]) if recipient in refused else 'sent'
+        failed = [recipient for recipient in pending if results[recipient] != 'sent']
+        if failed:
+            print("Message sent to {} of {} recipients, failed: {}".format(
+                len(pending) - len(failed), len(pending), ", ".join(failed)))
         else:
-            if self.email_data.get("question_mode") == "diyl_gif":
-                self._attach_question_gifs(msg)
-            msg.attach(MIMEText(self.email_content, "html"))
+            print("Message sent!")
+        return results
 
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
+    @contextmanager
+    def _smtp_connection(self):
+        if self.smtp_session is not None and self.smtp_session.sender == self.sender:
+            with self.smtp_session.connection() as smtp_server:
+                yield smtp_server
+            return
+        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as smtp_server:
             smtp_server.ehlo()
             smtp_server.login(self.sender, self.password)
-            if spark:
-                smtp_server.sendmail(self.sender, [sender] + self.recipients_spark, msg.as_string()) # recipients are BCCed
-            else:
-                smtp_server.sendmail(self.sender, [sender] + self.recipients, msg.as_string()) # recipients are BCCed
-        print("Message sent!")
+            yield smtp_server
 
-    def image_to_byte(self, msg, max_image_byte=None):
+    def _image_jobs(self, max_image_byte=None, skip=()):
         target_max_image_byte = self.max_image_byte if max_image_byte is None else max_image_byte
+        jobs = []
         for i, (url, _, _) in enumerate([[self.background_url, '', '']] 
                                         + self.email_data["images"] 
                                         # + self.email_data["special_images"] 
                                         # + self.email_data["extra_images"]
             ):
-            image_data = self._open_remote_image(url)
-            if image_data is None:
+            if f"image{i}" in skip:
                 continue
-            if image_data.mode in ("RGBA", "P"): image_data = image_data.convert("RGB")
-            quality = 95
-            while True:
-                byte_buffer = BytesIO()
-                image_data.save(byte_buffer, format="JPEG", quality=quality)
-                if byte_buffer.tell() / 1000000 > target_max_image_byte:
-                    quality -= 5
-                    if quality <= 0:
-                        break
-                else:
-                    break 
-            image = MIMEImage(byte_buffer.getvalue())
-            image.add_header('Content-ID', f"<image{i}>")
-            msg.attach(image)
-            print("image", i, byte_buffer.tell() / 1000000)
+            build = partial(self._cached_asset, ("jpeg", self._content_key(url), target_max_image_byte,
+                                                 self._image_profile_key()),
+                            partial(self._encode_attachment, url, target_max_image_byte))
+            jobs.append(([url], build, partial(self._attach_image, index=i)))
+        return jobs
+
+    def _attach_image(self, msg, image_bytes, index):
+        image = MIMEImage(image_bytes)
+        image.add_header('Content-ID', f"<image{index}>")
+        msg.attach(image)
+        print("image", index, len(image_bytes) / 1000000)
+
+    def _encode_attachment(self, url, max_image_byte):
+        image_data = self.sources.get(url)
+        if image_data is None:
+            return None
+        return encode_image(image_data, int(max_image_byte * 1000000), self.image_profile)
+
+    def _image_profile_key(self):
+        return (self.image_profile, tuple(sorted(ENCODER_PROFILES[self.image_profile].items())))
+
+    def _cached_asset(self, key, build):
+        if self.asset_cache is None:
+            return build()
+        return self.asset_cache.get_or_build(key, build)
 
     def _spark_budget_mb(self):
-        asset_count = 1 + len(self.email_data["images"])
-        if self.email_data.get("question_mode") == "diyl_gif":
-            asset_count += len(self.email_data["question_answers"])
+        # Repeated photos are attached once, so only distinct ones share the budget.
+        asset_count = len(self._attachment_sources(spark=True)) - len(self._cid_aliases(spark=True))
         # ~28% overhead buffer for base64 + MIME wrappers.
         return (25.0 * 0.72) / max(asset_count, 1)
 
     def _drive_file_id(self, url: str):
-        normalized = str(url).strip()
-        match = re.search(r"[?&]id=([^&]+)", normalized) or re.search(r"/d/([^/]+)", normalized)
-        if not match:
-            return None
-        return match.group(1)
+        return drive_file_id(url)
 
     def _drive_url_candidates(self, url: str):
-        normalized = str(url).strip()
-        file_id = self._drive_file_id(normalized)
-        if file_id is None:
-            return [normalized]
-        return [
-            f"https://drive.google.com/uc?export=view&id={file_id}",
-            f"https://drive.google.com/uc?export=download&id={file_id}",
-            f"https://drive.google.com/thumbnail?id={file_id}&sz=w2000",
-            normalized,
-        ]
+        return drive_url_candidates(url)
 
     def _open_remote_image(self, url):
-        for candidate in self._drive_url_candidates(url):
-            try:
-                response = requests.get(candidate, timeout=30)
-                response.raise_for_status()
-                image_bytes = BytesIO(response.content)
-                try:
-                    return ImageOps.exif_transpose(Image.open(image_bytes))
-                except UnidentifiedImageError:
-                    register_heif_opener()
-                    image_bytes.seek(0)
-                    return ImageOps.exif_transpose(Image.open(image_bytes))
-            except Exception as error:
-                last_error = error
-                continue
-        print(f"Skipping unrecognized image URL: {url}. Last error: {last_error}")
-        return None
+        # Only the form photos can become a reminder's hero image.
+        hero = any(url == picture[0] for picture in self.email_data.get("images", []))
+        return open_remote_image(url, index=self.image_index, session=self.session, derivative=hero)
 
     def _drive_direct_url(self, url: str) -> str:
         url = url.strip()
@@ -270,7 +1835,7 @@ class Newsletter:
         lanczos = Image.Resampling.LANCZOS if hasattr(Image, "Resampling") else Image.LANCZOS
         frames = []
         for u in urls:
-            im = self._open_remote_image(u)
+            im = self.sources.get(u)
             if im is None:
                 continue
             if im.mode in ("RGBA", "P"):
@@ -300,34 +1865,25 @@ class Newsletter:
             for frame in resized:
                 canvas = Image.new("RGB", (width, height), "white")
                 canvas.paste(frame, ((width - frame.width) // 2, (height - frame.height) // 2))
-                normalized.append(canvas.convert("P", palette=Image.ADAPTIVE, colors=color_count))
+                normalized.append(canvas)
 
             if intro_text:
-                intro = self._build_intro_frame(width, height, intro_text)
-                normalized.insert(0, intro.convert("P", palette=Image.ADAPTIVE, colors=color_count))
-
-            output = BytesIO()
-            normalized[0].save(
-                output,
-                format="GIF",
-                save_all=True,
-                append_images=normalized[1:],
-                duration=duration_ms,
-                loop=0,
-                optimize=True,
-                disposal=2,
-            )
-            return output.getvalue()
+                normalized.insert(0, self._build_intro_frame(width, height, intro_text))
+
+            return encode_gif(normalized, color_count=color_count, duration_ms=duration_ms)
 
         if max_image_byte is None:
             return build_bytes(max_side=1200, color_count=128, frame_step=1, duration_ms=1200)
 
         max_bytes = int(max_image_byte * 1000000)
+        # Delta frames are small enough to keep every frame through the
+        # 560 px step before any are dropped.
         candidates = [
             (1200, 128, 1, 1200),
-            (1000, 96, 1, 1200),
-            (850, 80, 1, 1000),
-            (700, 64, 2, 1000),
+            (1000, 112, 1, 1200),
+            (850, 96, 1, 1100),
+            (700, 80, 1, 1000),
+            (560, 64, 1, 1000),
             (560, 48, 2, 900),
             (440, 32, 3, 850),
             (340, 24, 4, 800),
@@ -340,34 +1896,38 @@ class Newsletter:
                 return gif_bytes
         return fallback
 
-    def _attach_question_gifs(self, msg, max_image_byte=None):
+    def _question_gif_jobs(self, max_image_byte=None, skip=()):
+        jobs = []
         for answer in self.email_data.get("question_answers", []):
-            if len(answer) < 4:
+            if len(answer) < 4 or answer[1] in skip:
                 continue
             name = str(answer[0]).strip()
             cid = answer[1]
             links = answer[3]
             intro_text = f"Day in my life: {name}" if name else "Day in my life"
-            gif_bytes = self._make_gif_bytes(
-                links,
-                max_image_byte=max_image_byte,
-                intro_text=intro_text,
+            build = partial(
+                self._cached_asset,
+                ("gif", tuple(self._content_key(link) for link in links), max_image_byte, intro_text),
+                partial(self._make_gif_bytes, links, max_image_byte=max_image_byte, intro_text=intro_text),
             )
-            if gif_bytes is None:
-                continue
-            part = MIMEImage(gif_bytes, _subtype="gif")
-            part.add_header("Content-ID", f"<{cid}>")
-            part.add_header("Content-Disposition", "inline", filename=f"{cid}.gif")
-            msg.attach(part)
+            jobs.append((links, build, partial(self._attach_question_gif, cid=cid)))
+        return jobs
+
+    def _attach_question_gif(self, msg, gif_bytes, cid):
+        part = MIMEImage(gif_bytes, _subtype="gif")
+        part.add_header("Content-ID", f"<{cid}>")
+        part.add_header("Content-Disposition", "inline", filename=f"{cid}.gif")
+        msg.attach(part)
 
-def edition_number(update_log=True):
+def edition_number(update_log=True, log_path=None):
     '''
     Return the next newsletter edition number.
 
     Production sends use the default and persist the increment. Local
     previews pass ``update_log=False`` and never create or modify ``log.txt``.
+    Newsletters run from a batch manifest keep their own ``log_path``.
     '''
-    log_path = BASE_DIR / 'log.txt'
+    log_path = Path(log_path) if log_path is not None else BASE_DIR / 'log.txt'
     current_edition = 0
     if log_path.exists():
         current_edition = int(log_path.read_text(encoding='utf8').strip())
@@ -377,8 +1937,10 @@ def edition_number(update_log=True):
         log_path.write_text(str(next_edition), encoding='utf8')
     return next_edition
 
-if __name__ == "__main__":
-
+def newsletter_from_environment(**options):
+    '''
+    Build the production newsletter from ``.env`` / GitHub Actions secrets.
+    '''
     # parameters
     first_edition_date = '2024/03/01'
     frequency_unit = 'month' #'month' or 'day'
@@ -393,11 +1955,33 @@ if __name__ == "__main__":
     sheet_id = os.getenv("SHEET_ID")
     sheet_name = os.getenv("SHEET_NAME")
     background_url = os.getenv("BACKGROUND_URL")
+    # Opening the history creates its database, so only when not overridden.
+    if "image_index" not in options:
+        options["image_index"] = ImageIndex()
+    if "history" not in options:
+        options["history"] = ResponseHistory()
+
+    return Newsletter(first_edition_date, frequency_unit, frequency, timezone, sender, recipients, 
+                      recipients_spark, password, sheet_id, sheet_name, background_url, special_edition=True,
+                      **environment_options(**options))
+
+def environment_options(**options):
+    '''
+    Fill in the sending, deduplication and size options set in ``.env``.
+    '''
+    options.setdefault("batch_size", int(os.getenv("RECIPIENT_BATCH_SIZE", RECIPIENT_BATCH_SIZE)))
+    options.setdefault("send_interval", float(os.getenv("SEND_INTERVAL_SECONDS", SEND_INTERVAL_SECONDS)))
+    options.setdefault("near_duplicate_distance", NEAR_DUPLICATE_DISTANCE if os.getenv("NEAR_DUPLICATES") else None)
+    options.setdefault("html_clip_policy", os.getenv("HTML_CLIP_POLICY", "warn"))
+    return options
+
+if __name__ == "__main__":
 
-    # send email
-    newsletter = Newsletter(first_edition_date, frequency_unit, frequency, timezone, sender, recipients, 
-                            recipients_spark, password, sheet_id, sheet_name, background_url, special_edition=True)
-    newsletter.generate_newsletter()
-    newsletter.send_email()
-    if recipients_spark:
-        newsletter.send_email(spark=True)
+    if "--benchmark" in sys.argv[1:]:
+        # build the edition and send it to a local SMTP sink instead of Gmail
+        import send_benchmark
+        send_benchmark.main(["newsletter"])
+    else:
+        # send email through the checkpointed pipeline so a failed run resumes
+        import pipeline
+        pipeline.main(["send"])
@@ -0,0 +1,303 @@
+"""Two-stage newsletter pipeline.
+
+``prepare`` runs ahead of the send deadline: it syncs the current responses
+and encodes every photo and DIYL GIF of both variants into the on-disk asset
+cache, and stores the serialized message of each variant. ``send`` re-reads
+the sheet, so late responses are still included; when nothing changed it
+sends the prepared message as-is, otherwise it only encodes what ``prepare``
+has not already cached. ``resend`` mails a stored copy to a late subscriber.
+
+``send`` checkpoints each edition under ``.cache/editions/<number>``: the
+response snapshot, the rendered HTML, the serialized message of every
+variant and the delivery result of every recipient. If a send fails
+part-way, or the server defers some batches, the next run resumes that
+edition instead of allocating a new number and only retries the recipients
+that did not get it. A recipient still deferred after
+``MAX_DEFERRED_ATTEMPTS`` runs is recorded as undelivered, and a build left
+unfinished from an earlier send window is abandoned for a fresh one.
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from main import EDITIONS_DIR, ENCODER_STATS, MESSAGE_CACHE_DIR, AssetCache, edition_number, newsletter_from_environment
+
+MAX_DEFERRED_ATTEMPTS = 3
+
+
+class EditionBuild:
+    """Checkpoint directory for one edition's send."""
+
+    def __init__(self, path, edition, resumed=False):
+        self.path = Path(path)
+        self.edition = edition
+        self.resumed = resumed
+        self.status_path = self.path / "status.json"
+        if self.status_path.exists():
+            self.status = json.loads(self.status_path.read_text(encoding="utf8"))
+        else:
+            self.status = {"edition": edition, "complete": False, "variants": {}, "recipients": {}}
+
+    @classmethod
+    def resume_or_start(cls, root=EDITIONS_DIR, log_path=None, window_start=None):
+        """Resume the unfinished build of the current edition or start one.
+
+        Only a new build advances ``log.txt`` (or ``log_path``), so
+        re-running after a failure never skips an edition number. An
+        unfinished build dated on or before ``window_start`` belongs to an
+        earlier send window; it is marked abandoned and a new one starts.
+        """
+        root = Path(root)
+        current = edition_number(update_log=False, log_path=log_path) - 1
+        build = cls(root / str(current), current, resumed=True)
+        if current > 0 and build.status_path.exists() and not build.status["complete"]:
+            if not build.is_stale(window_start):
+                return build
+            print("Abandoning unfinished edition {} from {}".format(current, build.status["date"]))
+            build.status["abandoned"] = True
+            build.save()
+        edition = edition_number(log_path=log_path)
+        build = cls(root / str(edition), edition)
+        build.path.mkdir(parents=True, exist_ok=True)
+        build.save()
+        return build
+
+    def is_stale(self, window_start):
+        date = self.status.get("date")
+        return window_start is not None and date is not None and date <= window_start.isoformat()
+
+    def artifact(self, name):
+        return self.path / name
+
+    def write_artifact(self, name, payload):
+        path = self.artifact(name)
+        temporary_path = path.with_name(path.name + ".tmp")
+        if isinstance(payload, str):
+            temporary_path.write_text(payload, encoding="utf8")
+        else:
+            temporary_path.write_bytes(payload)
+        temporary_path.replace(path)
+        return path
+
+    def variant_status(self, variant):
+        return self.status["variants"].get(variant, "pending")
+
+    def recipient_results(self, variant):
+        return self.status.setdefault("recipients", {}).setdefault(variant, {})
+
+    def set_variant_status(self, variant, status):
+        self.status["variants"][variant] = status
+        self.save()
+
+    def mark_complete(self):
+        self.status["complete"] = True
+        self.save()
+
+    def save(self):
+        self.write_artifact("status.json", json.dumps(self.status, indent=1, sort_keys=True))
+
+
+def _cache_summary(cache):
+    if cache is None:
+        return ""
+    return " ({} assets from cache, {} encoded)".format(cache.hits, cache.misses)
+
+
+def _print_encoder_stats():
+    for line in ENCODER_STATS.summary():
+        print("  " + line)
+
+
+def _print_html_sizes(newsletter):
+    for variant, (before, after) in newsletter.html_sizes.items():
+        print("  {} HTML: {:.1f} KB, {:.1f} KB before optimizing".format(variant, after / 1024, before / 1024))
+
+
+def prepare(newsletter):
+    """Warm the asset cache without sending or advancing the edition."""
+    started = time.perf_counter()
+    newsletter.generate_newsletter(update_edition=False)
+    newsletter.prepare_assets()
+    print(
+        "Prepared {} responses in {:.1f}s{}".format(
+            len(newsletter.responses),
+            time.perf_counter() - started,
+            _cache_summary(newsletter.asset_cache),
+        )
+    )
+    _print_html_sizes(newsletter)
+    _print_encoder_stats()
+
+
+def _count_deferred_attempts(build, variant, results):
+    """Count another attempt for each deferred recipient of ``variant`` and
+    return the ones to retry; the rest are recorded as undelivered."""
+    attempts = build.status.setdefault("deferred_attempts", {}).setdefault(variant, {})
+    retry = []
+    for recipient, result in results.items():
+        if not result.startswith("deferred"):
+            continue
+        attempts[recipient] = attempts.get(recipient, 0) + 1
+        if attempts[recipient] < MAX_DEFERRED_ATTEMPTS:
+            retry.append(recipient)
+            continue
+        results[recipient] = "undelivered after {} attempts: {}".format(attempts[recipient], result)
+        print("Giving up on {} ({})".format(recipient, result))
+    build.status["recipients"][variant] = dict(results)
+    build.save()
+    return retry
+
+
+def send(newsletter, build_root=EDITIONS_DIR):
+    """Send both variants, resuming an unfinished edition if there is one."""
+    started = time.perf_counter()
+    build = EditionBuild.resume_or_start(build_root, newsletter.log_path, window_start=newsletter.window_start())
+    if build.resumed:
+        print("Resuming edition {}".format(build.edition))
+
+    responses = build.artifact("responses.csv")
+    if responses.exists():
+        newsletter.restore_responses(responses)
+    else:
+        newsletter.save_responses(responses)
+
+    newsletter.generate_newsletter(edition=build.edition)
+    build.status.setdefault("date", newsletter.email_data["date"].strftime("%Y-%m-%d"))
+    build.write_artifact("standard.html", newsletter.email_content)
+    build.write_artifact("spark.html", newsletter.email_content_spark)
+    _print_html_sizes(newsletter)
+
+    variants = [("standard", False)]
+    if newsletter.recipients_spark:
+        variants.append(("spark", True))
+    pending = []
+    for variant, spark in variants:
+        if build.variant_status(variant) == "sent":
+            print("Skipping {} variant, already sent".format(variant))
+        else:
+            pending.append((variant, spark))
+
+    # Assemble every variant without a stored message in one go, so their
+    # encodes share a worker pool and decoded source images.
+    # A message missing an attachment is sent from memory and not stored,
+    # so a resumed run builds it again.
+    unstored = {}
+    unbuilt = [spark for variant, spark in pending if not build.artifact(variant + ".eml").exists()]
+    if unbuilt:
+        for spark, payload in newsletter.serialized_messages(unbuilt).items():
+            variant = "spark" if spark else "standard"
+            if spark in newsletter.incomplete_variants:
+                print("The {} variant is missing an attachment, not storing it".format(variant))
+                unstored[variant] = payload
+                continue
+            build.write_artifact(variant + ".eml", payload)
+            build.set_variant_status(variant, "built")
+        _print_encoder_stats()
+    # Save the index as soon as the build has filled it, so a failed
+    # delivery below does not lose the downloads it records.
+    if newsletter.image_index is not None:
+        newsletter.image_index.save()
+
+    # Each variant goes out over its own SMTP connection in parallel. The
+    # senders work on copies of their results; only this lock's holder
+    # touches the shared status.
+    lock = threading.Lock()
+
+    def deliver(variant, spark, results):
+        try:
+            message = unstored.get(variant, build.artifact(variant + ".eml"))
+            return newsletter.send_message(message, spark=spark, results=results)
+        finally:
+            with lock:
+                build.status["recipients"][variant] = dict(results)
+                build.save()
+
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as pool:
+        sends = [
+            (variant, pool.submit(deliver, variant, spark, dict(build.recipient_results(variant))))
+            for variant, spark in pending
+        ]
+    deferred = []
+    errors = []
+    for variant, future in sends:
+        try:
+            results = future.result()
+        except Exception as error:
+            errors.append(error)
+            continue
+        retry = _count_deferred_attempts(build, variant, results)
+        build.set_variant_status(variant, "partial" if retry else "sent")
+        deferred.extend(retry)
+    if errors:
+        raise errors[0]
+    if deferred:
+        raise SystemExit(
+            "Edition {}: {} recipient(s) deferred, run send again to retry them".format(
+                build.edition, len(deferred)
+            )
+        )
+    build.mark_complete()
+    print(
+        "Sent edition {} in {:.1f}s{}".format(
+            build.edition,
+            time.perf_counter() - started,
+            _cache_summary(newsletter.asset_cache),
+        )
+    )
+
+
+def resend(newsletter, recipients, spark=False, build_root=EDITIONS_DIR):
+    """Send a copy of the latest edition's stored message to ``recipients``."""
+    edition = edition_number(update_log=False, log_path=newsletter.log_path) - 1
+    variant = "spark" if spark else "standard"
+    message = EditionBuild(Path(build_root) / str(edition), edition).artifact(variant + ".eml")
+    if not message.exists():
+        raise SystemExit("No stored {} message for edition {}".format(variant, edition))
+    newsletter.send_message(message, spark=spark, recipients=recipients)
+    print("Resent edition {} to {} recipient(s)".format(edition, len(recipients)))
+
+
+STAGES = {"prepare": prepare, "send": send, "resend": resend}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Prepare newsletter assets ahead of time or send the newsletter."
+    )
+    parser.add_argument("stage", choices=sorted(STAGES))
+    parser.add_argument(
+        "--to",
+        action="append",
+        default=[],
+        metavar="ADDRESS",
+        help="Recipient for the resend stage; repeat for several.",
+    )
+    parser.add_argument(
+        "--spark",
+        action="store_true",
+        help="Resend the Spark / Outlook variant instead of the standard one.",
+    )
+    args = parser.parse_args(argv)
+    if args.stage == "resend" and not args.to:
+        parser.error("resend needs at least one --to address")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    newsletter = newsletter_from_environment(
+        asset_cache=AssetCache(),
+        message_cache=AssetCache(MESSAGE_CACHE_DIR, suffix=".eml"),
+    )
+    if args.stage == "resend":
+        resend(newsletter, args.to, spark=args.spark)
+    else:
+        STAGES[args.stage](newsletter)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,24 +9,36 @@ from __future__ import annotations
 
 import argparse
 import base64
+import hashlib
 import html
 import json
+import mmap
 import os
 import re
 import threading
-from dataclasses import dataclass
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from string import Template as StringTemplate
-from typing import Dict, Optional
+from typing import Callable, Dict, Iterable, Optional, Tuple
 from urllib.parse import parse_qs, quote, unquote, urlparse
 
-import requests
 from dotenv import load_dotenv
-from jinja2 import Environment, StrictUndefined
 
-from main import Newsletter
+from main import (
+    DOWNLOAD_STATS,
+    Newsletter,
+    ResponseHistory,
+    download_file,
+    lazy_import,
+    newsletter_environment,
+    optimize_email_html,
+)
+
+jinja2 = lazy_import("jinja2")
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -36,6 +48,41 @@ VARIANTS = {
     "standard": "Standard",
     "spark": "Spark / Outlook",
 }
+TEMPLATE_FILES = ("template.html", "template_spark.html")
+WATCHED_FILES = TEMPLATE_FILES + ("cards.html",)
+DEFAULT_SHEET_INTERVAL = 30.0
+BUNDLE_MAGIC = b"CHATIME-PREVIEW-BUNDLE\x001"
+BUNDLE_GIF_PATTERN = re.compile(r"data:image/gif;base64,([A-Za-z0-9+/=]+)")
+BUNDLE_BLOB_PATTERN = re.compile(r"bundle-blob:([0-9a-f]{64})")
+PROXIED_IMAGE_PATTERN = re.compile(r"/image/([A-Za-z0-9_-]{10,200})")
+DRIVE_IMAGE_URL = "https://drive.google.com/uc?export=view&id={}"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRIC_HELP = {
+    "preview_requests_total": ("counter", "Requests served, by route and status."),
+    "preview_request_duration_seconds": ("histogram", "Time to answer a request, by route."),
+    "preview_snapshot_build_seconds": (
+        "histogram",
+        "Time spent building the preview: loading the sheet, building the email data, building DIYL GIFs or rendering.",
+    ),
+    "preview_snapshot_age_seconds": ("gauge", "Seconds since the served preview was built."),
+    "preview_image_cache_requests_total": ("counter", "Proxied image lookups, by cache hit or miss."),
+    "preview_image_cache_hit_ratio": ("gauge", "Share of proxied image lookups served from the cache."),
+    "preview_image_cache_entries": ("gauge", "Drive images held in the cache."),
+    "preview_image_cache_bytes": ("gauge", "Bytes of Drive images held in the cache."),
+    "preview_drive_fetch_seconds": ("histogram", "Time to fetch one image from Drive."),
+    "preview_drive_fetch_errors_total": ("counter", "Failed Drive image fetches, by error."),
+}
+METRIC_ROUTES = ("/", "/email", "/events", "/health", "/live-reload.js", "/metrics")
+LIVE_RELOAD_SCRIPT = """(function () {
+    var version = document.currentScript.getAttribute("data-version");
+    var events = new EventSource("/events?since=" + encodeURIComponent(version));
+    events.addEventListener("reload", function () {
+        var url = new URL(window.location.href);
+        url.searchParams.delete("refresh");
+        window.location.replace(url.toString());
+    });
+})();
+"""
 
 
 class PreviewConfigurationError(RuntimeError):
@@ -48,6 +95,9 @@ class PreviewNewsletter(Newsletter):
     def send_email(self, *args, **kwargs):
         raise RuntimeError("Email sending is disabled in local preview mode.")
 
+    def send_message(self, *args, **kwargs):
+        raise RuntimeError("Email sending is disabled in local preview mode.")
+
 
 @dataclass(frozen=True)
 class PreviewConfig:
@@ -140,53 +190,98 @@ def _drive_file_id(url: str) -> Optional[str]:
     return file_id
 
 
-def _proxy_drive_image_sources(rendered_html: str) -> str:
-    """Use same-origin image URLs so Drive photos display in the browser."""
+IMAGE_REFERENCE_PATTERN = re.compile(
+    r"(?P<prefix>\bsrc\s*=\s*(?P<quote>['\"]))(?P<url>[^'\"]+)(?P=quote)"
+    r"|cid:(?P<cid>[^\"'\s>]+)",
+    re.IGNORECASE,
+)
 
-    def replace_source(match):
-        file_id = _drive_file_id(match.group("url"))
-        if not file_id:
-            return match.group(0)
-        return "{}{}{}".format(
-            match.group("prefix"),
-            "/image/" + quote(file_id, safe=""),
-            match.group("quote"),
-        )
 
-    return re.sub(
-        r"(?P<prefix>\bsrc\s*=\s*(?P<quote>['\"]))(?P<url>[^'\"]+)(?P=quote)",
-        replace_source,
-        rendered_html,
-        flags=re.IGNORECASE,
-    )
+def _browser_url(source: str) -> str:
+    """Return an attribute-safe browser URL, proxying Drive files locally."""
+    file_id = _drive_file_id(source)
+    if file_id:
+        return "/image/" + quote(file_id, safe="")
+    return html.escape(source, quote=True)
+
+
+def _rewrite_image_references(
+    rendered_html: str, cid_sources: Dict[str, str]
+) -> str:
+    """Resolve every CID and Drive image reference in one scan.
+
+    ``cid_sources`` maps Content-IDs to unescaped source URLs. Unknown CIDs
+    become the placeholder so no email-only reference survives.
+    """
+
+    def resolve_cid(cid):
+        source = cid_sources.get(cid)
+        return _browser_url(source) if source else PLACEHOLDER_IMAGE
+
+    def replace_reference(match):
+        cid = match.group("cid")
+        if cid is not None:
+            return resolve_cid(cid)
+
+        url = match.group("url")
+        if url[:4].lower() == "cid:":
+            resolved = resolve_cid(url[4:])
+        else:
+            file_id = _drive_file_id(url)
+            if not file_id:
+                return match.group(0)
+            resolved = "/image/" + quote(file_id, safe="")
+        return match.group("prefix") + resolved + match.group("quote")
+
+    return IMAGE_REFERENCE_PATTERN.sub(replace_reference, rendered_html)
 
 
 def _render_templates(newsletter: PreviewNewsletter) -> Dict[str, str]:
-    """Render sheet content with browser-safe HTML escaping enabled."""
-    environment = Environment(autoescape=True, undefined=StrictUndefined)
+    """Render sheet content with browser-safe HTML escaping enabled.
+
+    Both variants go through the same size optimizer as the sent email, so
+    the preview shows what recipients get and warns about Gmail clipping.
+    """
+    environment = newsletter_environment(undefined=jinja2.StrictUndefined)
     rendered = {}
-    for variant, filename in (
-        ("standard", "template.html"),
-        ("spark", "template_spark.html"),
-    ):
+    for variant, filename in zip(VARIANTS, TEMPLATE_FILES):
         source = (BASE_DIR / filename).read_text(encoding="utf8")
-        rendered[variant] = environment.from_string(source).render(
-            newsletter.email_data
+        rendered[variant], _, _ = optimize_email_html(
+            environment.from_string(source).render(newsletter.email_data),
+            variant,
         )
     return rendered
 
 
-def _question_cid_sources(newsletter: PreviewNewsletter) -> Dict[str, str]:
+def _question_cid_sources(
+    newsletter: PreviewNewsletter,
+    cache: Optional[Dict[tuple, str]] = None,
+) -> Dict[str, str]:
+    """Build browser sources for DIYL GIFs.
+
+    ``cache`` maps ``(name, links)`` to a previously built source, so a sheet
+    refresh only rebuilds the GIFs of respondents whose links changed. Stale
+    entries are dropped from the cache in place.
+    """
     sources = {}
     if newsletter.email_data.get("question_mode") != "diyl_gif":
+        if cache is not None:
+            cache.clear()
         return sources
 
+    current_keys = set()
+
     for answer in newsletter.email_data.get("question_answers", []):
         if len(answer) < 4:
             continue
         name = str(answer[0]).strip()
         cid = str(answer[1])
         links = answer[3]
+        key = (name, tuple(links))
+        current_keys.add(key)
+        if cache is not None and key in cache:
+            sources[cid] = cache[key]
+            continue
         intro_text = "Day in my life: " + name if name else "Day in my life"
         gif_bytes = newsletter._make_gif_bytes(
             links,
@@ -198,45 +293,65 @@ def _question_cid_sources(newsletter: PreviewNewsletter) -> Dict[str, str]:
             sources[cid] = "data:image/gif;base64," + encoded
         else:
             sources[cid] = PLACEHOLDER_IMAGE
+        if cache is not None:
+            cache[key] = sources[cid]
+
+    if cache is not None:
+        for key in set(cache) - current_keys:
+            del cache[key]
     return sources
 
 
-def _replace_browser_cids(
-    rendered_html: str,
+def _browser_cid_sources(
     newsletter: PreviewNewsletter,
     question_sources: Optional[Dict[str, str]] = None,
-) -> str:
-    """Replace email-only CID references with browser-viewable sources."""
+) -> Dict[str, str]:
+    """Map every email Content-ID to the source the browser should load."""
     image_sources = [newsletter.background_url]
     image_sources.extend(
         picture[0] for picture in newsletter.email_data.get("images", [])
     )
+    cid_sources = {
+        "image{}".format(index): source
+        for index, source in enumerate(image_sources)
+        if source
+    }
+    cid_sources.update(question_sources or {})
+    return cid_sources
 
-    def replace_image(match):
-        index = int(match.group(1))
-        source = image_sources[index] if index < len(image_sources) else ""
-        return html.escape(source, quote=True) if source else PLACEHOLDER_IMAGE
 
-    browser_html = re.sub(r"cid:image(\d+)", replace_image, rendered_html)
+def _replace_browser_cids(
+    rendered_html: str,
+    newsletter: PreviewNewsletter,
+    question_sources: Optional[Dict[str, str]] = None,
+    cid_sources: Optional[Dict[str, str]] = None,
+) -> str:
+    """Replace email-only CID references with browser-viewable sources."""
+    if cid_sources is None:
+        cid_sources = _browser_cid_sources(newsletter, question_sources)
+    return _rewrite_image_references(rendered_html, cid_sources)
 
-    for cid, source in (question_sources or {}).items():
-        browser_html = browser_html.replace(
-            "cid:" + cid,
-            html.escape(source, quote=True),
-        )
 
-    # Never leave an email-only source broken in the browser preview.
-    browser_html = re.sub(
-        r"cid:[^\"'\s>]+",
-        PLACEHOLDER_IMAGE,
-        browser_html,
-    )
-    return _proxy_drive_image_sources(browser_html)
+def load_newsletter(config: PreviewConfig, session=None, history=None) -> PreviewNewsletter:
+    """Fetch live form responses and build the read-only email data.
 
+    The sheet is fetched through ``session`` when given.
+    """
+    newsletter = open_newsletter(config, session, history)
+    newsletter.generate_newsletter(update_edition=False)
+    return newsletter
 
-def build_snapshot(config: PreviewConfig) -> PreviewSnapshot:
-    """Fetch live form responses and build both read-only preview variants."""
-    newsletter = PreviewNewsletter(
+
+def open_newsletter(config: PreviewConfig, session=None, history=None) -> PreviewNewsletter:
+    """Fetch live form responses without building the email data yet.
+
+    ``history`` feeds the "A year ago" section like in a real send. By
+    default it is an in-memory copy of the send's history, so the preview
+    never writes to it.
+    """
+    if history is None:
+        history = ResponseHistory.copy_of()
+    return PreviewNewsletter(
         config.first_edition_date,
         config.frequency_unit,
         config.frequency,
@@ -250,45 +365,246 @@ def build_snapshot(config: PreviewConfig) -> PreviewSnapshot:
         background_url=config.background_url,
         special_edition=True,
         num_images=config.num_images,
+        session=session,
+        history=history,
     )
-    newsletter.generate_newsletter(update_edition=False)
 
+
+def render_snapshot(
+    newsletter: PreviewNewsletter, question_sources: Dict[str, str]
+) -> PreviewSnapshot:
+    """Render both preview variants from already loaded email data."""
     rendered = _render_templates(newsletter)
-    question_sources = _question_cid_sources(newsletter)
+    cid_sources = _browser_cid_sources(newsletter, question_sources)
     standard_html = _replace_browser_cids(
-        rendered["standard"], newsletter, question_sources
+        rendered["standard"], newsletter, cid_sources=cid_sources
     )
     spark_html = _replace_browser_cids(
-        rendered["spark"], newsletter, question_sources
+        rendered["spark"], newsletter, cid_sources=cid_sources
     )
 
-    if "cid:" in standard_html or "cid:" in spark_html:
-        raise RuntimeError("A browser-incompatible image reference remains.")
-
     return PreviewSnapshot(
         standard_html=standard_html,
         spark_html=spark_html,
         loaded_at=newsletter.datetime_now.strftime("%A, %B %d at %I:%M %p %Z"),
         edition_number=int(newsletter.email_data["edition_number"]),
-        response_count=len(newsletter.data_df.index),
+        response_count=len(newsletter.responses),
         question_mode=str(newsletter.email_data.get("question_mode", "text")),
     )
 
 
+def build_snapshot(config: PreviewConfig) -> PreviewSnapshot:
+    """Fetch live form responses and build both read-only preview variants."""
+    newsletter = load_newsletter(config)
+    return render_snapshot(newsletter, _question_cid_sources(newsletter))
+
+
+def _metric_value(value) -> str:
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _metric_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    ) + "}"
+
+
+def _metric_route(path: str) -> str:
+    """Collapse a request path into a low-cardinality route label."""
+    if path.startswith("/image/"):
+        return "/image"
+    if path == "/healthz":
+        return "/health"
+    return path if path in METRIC_ROUTES else "other"
+
+
+class PreviewMetrics:
+    """Counters, gauges and latency histograms for ``/metrics``.
+
+    Everything in ``METRIC_HELP`` is rendered in the Prometheus text
+    format. Gauges are read when scraped from the callables registered
+    with ``gauge``; a callable returning ``None`` leaves its gauge out.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def count(self, name: str, **labels) -> int:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self._histograms.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            counts[-2] += seconds
+            counts[-1] += 1
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name: str, read: Callable[[], Optional[float]]):
+        self._gauges[name] = read
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            if kind == "gauge":
+                value = self._gauges[name]() if name in self._gauges else None
+                if value is not None:
+                    lines.append("{} {}".format(name, _metric_value(value)))
+            elif kind == "counter":
+                for (series, labels), value in sorted(counters.items()):
+                    if series == name:
+                        lines.append("{}{} {}".format(name, _metric_labels(labels), value))
+            else:
+                for (series, labels), counts in sorted(histograms.items()):
+                    if series != name:
+                        continue
+                    for bound, count in zip(self.buckets, counts):
+                        bucket_labels = labels + (("le", _metric_value(bound)),)
+                        lines.append("{}_bucket{} {}".format(name, _metric_labels(bucket_labels), count))
+                    lines.append("{}_bucket{} {}".format(name, _metric_labels(labels + (("le", "+Inf"),)), counts[-1]))
+                    lines.append("{}_sum{} {}".format(name, _metric_labels(labels), _metric_value(counts[-2])))
+                    lines.append("{}_count{} {}".format(name, _metric_labels(labels), counts[-1]))
+        return "\n".join(lines) + "\n"
+
+
 class PreviewState:
-    def __init__(self, config: PreviewConfig):
+    def __init__(self, config: PreviewConfig, session=None, metrics: Optional[PreviewMetrics] = None, history=None):
         self.config = config
+        self.session = session
+        self.history = history
+        self.metrics = metrics or PreviewMetrics()
         self._snapshot = None
         self._lock = threading.Lock()
         self._image_cache = {}
         self._image_lock = threading.Lock()
+        self._newsletter = None
+        self._question_sources = {}
+        self._gif_cache = {}
+        self._version = 0
+        self._changed = threading.Condition()
+        self._published_at = None
+        self.metrics.gauge("preview_snapshot_age_seconds", self._snapshot_age)
+        self.metrics.gauge("preview_image_cache_hit_ratio", self._image_hit_ratio)
+        self.metrics.gauge("preview_image_cache_entries", lambda: len(self._image_cache))
+        self.metrics.gauge("preview_image_cache_bytes", self._image_cache_bytes)
+        # Downloads made while building GIFs go through the same helper.
+        DOWNLOAD_STATS.subscribe(self._record_drive_fetch)
+
+    @property
+    def version(self) -> int:
+        """Counter that increases whenever the rendered preview changes."""
+        with self._changed:
+            return self._version
 
     def get_snapshot(self, refresh: bool = False) -> PreviewSnapshot:
         with self._lock:
             if refresh or self._snapshot is None:
-                self._snapshot = build_snapshot(self.config)
+                with self.metrics.timer("preview_snapshot_build_seconds", stage="sheet"):
+                    newsletter = open_newsletter(self.config, self.session, self._response_history())
+                self._generate(newsletter)
+                self._load(newsletter)
             return self._snapshot
 
+    def poll_sheet(self) -> bool:
+        """Reload responses, recomputing only the sections that changed.
+
+        The reload builds a new newsletter and swaps it in under the lock,
+        so requests served meanwhile only ever see a complete one.
+        """
+        with self._lock:
+            newsletter = self._newsletter
+        with self.metrics.timer("preview_snapshot_build_seconds", stage="sheet"):
+            if newsletter is None:
+                newsletter = open_newsletter(self.config, self.session, self._response_history())
+            else:
+                newsletter = newsletter.reloaded()
+        self._generate(newsletter)
+        with self._lock:
+            return self._load(newsletter)
+
+    def rerender(self) -> bool:
+        """Re-render the cached email data after a template change."""
+        with self._lock:
+            if self._newsletter is None:
+                return False
+            return self._publish(self._render(self._newsletter))
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """Block until the preview moves past ``version`` or ``timeout``."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def _response_history(self):
+        # One in-memory copy for the life of the server, refreshed by every
+        # sheet load.
+        if self.history is None:
+            self.history = ResponseHistory.copy_of()
+        return self.history
+
+    def _generate(self, newsletter: PreviewNewsletter) -> None:
+        with self.metrics.timer("preview_snapshot_build_seconds", stage="data"):
+            newsletter.generate_newsletter(update_edition=False)
+
+    def _load(self, newsletter: PreviewNewsletter) -> bool:
+        with self.metrics.timer("preview_snapshot_build_seconds", stage="gifs"):
+            self._question_sources = _question_cid_sources(
+                newsletter, self._gif_cache
+            )
+        self._newsletter = newsletter
+        return self._publish(self._render(newsletter))
+
+    def _render(self, newsletter: PreviewNewsletter) -> PreviewSnapshot:
+        with self.metrics.timer("preview_snapshot_build_seconds", stage="render"):
+            return render_snapshot(newsletter, self._question_sources)
+
+    def _publish(self, snapshot: PreviewSnapshot) -> bool:
+        previous = self._snapshot
+        self._snapshot = snapshot
+        self._published_at = time.monotonic()
+        if previous is not None and (
+            previous.standard_html == snapshot.standard_html
+            and previous.spark_html == snapshot.spark_html
+        ):
+            return False
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+        return True
+
     def get_image(self, file_id: str):
         """Fetch and cache one explicitly identified Google Drive image."""
         if not re.fullmatch(r"[A-Za-z0-9_-]{10,200}", file_id):
@@ -296,27 +612,247 @@ class PreviewState:
 
         with self._image_lock:
             cached = self._image_cache.get(file_id)
+        self.metrics.increment(
+            "preview_image_cache_requests_total",
+            result="hit" if cached else "miss",
+        )
         if cached:
             return cached
 
-        response = requests.get(
-            "https://drive.google.com/uc?export=view&id=" + file_id,
-            timeout=30,
+        content_type, payload = download_file(
+            DRIVE_IMAGE_URL.format(file_id),
+            max_bytes=50 * 1024 * 1024,
+            session=self.session,
         )
-        response.raise_for_status()
-        content_type = response.headers.get("Content-Type", "").split(";", 1)[0]
         if not content_type.startswith("image/"):
+            self.metrics.increment("preview_drive_fetch_errors_total", error="ValueError")
             raise ValueError("Drive file is not an image")
-        if len(response.content) > 50 * 1024 * 1024:
-            raise ValueError("Drive image is too large for the local preview")
 
-        image = (content_type, response.content)
+        image = (content_type, payload.getvalue())
         with self._image_lock:
             self._image_cache[file_id] = image
         return image
 
+    def _record_drive_fetch(self, seconds: float, error: Optional[BaseException]):
+        self.metrics.observe("preview_drive_fetch_seconds", seconds)
+        if error is not None:
+            self.metrics.increment(
+                "preview_drive_fetch_errors_total", error=type(error).__name__
+            )
+
+    def _snapshot_age(self) -> Optional[float]:
+        if self._published_at is None:
+            return None
+        return time.monotonic() - self._published_at
+
+    def _image_hit_ratio(self) -> Optional[float]:
+        hits = self.metrics.count("preview_image_cache_requests_total", result="hit")
+        misses = self.metrics.count("preview_image_cache_requests_total", result="miss")
+        if not hits + misses:
+            return None
+        return hits / (hits + misses)
+
+    def _image_cache_bytes(self) -> int:
+        with self._image_lock:
+            return sum(len(payload) for _, payload in self._image_cache.values())
+
 
-def _dashboard_html(snapshot: PreviewSnapshot, variant: str) -> str:
+class PreviewWatcher(threading.Thread):
+    """Poll template files and the sheet, updating ``state`` on change.
+
+    Template edits only re-render the cached email data; the sheet is
+    re-fetched every ``sheet_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        state: PreviewState,
+        template_paths: Iterable[Path],
+        sheet_interval: float = DEFAULT_SHEET_INTERVAL,
+        poll_interval: float = 0.5,
+    ):
+        super().__init__(name="preview-watcher", daemon=True)
+        self.state = state
+        self.template_paths = list(template_paths)
+        self.sheet_interval = sheet_interval
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+        self._mtimes = self._template_mtimes()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        next_sheet_poll = time.monotonic() + self.sheet_interval
+        while not self._stop_event.wait(self.poll_interval):
+            mtimes = self._template_mtimes()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self._run_step("Template change", self.state.rerender)
+            if self.sheet_interval > 0 and time.monotonic() >= next_sheet_poll:
+                self._run_step("Sheet poll", self.state.poll_sheet)
+                next_sheet_poll = time.monotonic() + self.sheet_interval
+
+    def _run_step(self, label: str, step):
+        started = time.perf_counter()
+        try:
+            changed = step()
+        except Exception as error:
+            print("{} failed: {}".format(label, type(error).__name__))
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        outcome = "preview updated" if changed else "no visible change"
+        print("{}: {} in {:.0f} ms".format(label, outcome, elapsed_ms))
+
+    def _template_mtimes(self):
+        mtimes = []
+        for path in self.template_paths:
+            try:
+                mtimes.append(path.stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+
+def write_bundle(
+    path: Path,
+    snapshot: PreviewSnapshot,
+    images: Dict[str, Tuple[str, bytes]],
+) -> int:
+    """Write ``snapshot`` and its proxied images to one bundle file.
+
+    The file holds a JSON index followed by blobs named by their SHA-256, so
+    repeated payloads such as a GIF shared by both variants are stored once.
+    DIYL GIFs are lifted out of their base64 data URIs and stored as raw
+    bytes. Returns the number of bytes written.
+    """
+    blobs = {}
+
+    def store(payload: bytes) -> str:
+        digest = hashlib.sha256(payload).hexdigest()
+        blobs.setdefault(digest, payload)
+        return digest
+
+    def lift_gif(match):
+        return "bundle-blob:" + store(base64.b64decode(match.group(1)))
+
+    fields = asdict(snapshot)
+    for key in ("standard_html", "spark_html"):
+        document = BUNDLE_GIF_PATTERN.sub(lift_gif, fields[key])
+        fields[key] = store(document.encode("utf8"))
+
+    index = {
+        "snapshot": fields,
+        "images": {
+            file_id: {"content_type": content_type, "blob": store(payload)}
+            for file_id, (content_type, payload) in sorted(images.items())
+        },
+        "blobs": {},
+    }
+    offset = 0
+    for digest, payload in blobs.items():
+        index["blobs"][digest] = [offset, len(payload)]
+        offset += len(payload)
+
+    encoded_index = json.dumps(index, sort_keys=True).encode("utf8")
+    path = Path(path)
+    temporary_path = path.with_name(path.name + ".tmp")
+    with temporary_path.open("wb") as bundle_file:
+        bundle_file.write(BUNDLE_MAGIC)
+        bundle_file.write(len(encoded_index).to_bytes(8, "big"))
+        bundle_file.write(encoded_index)
+        for payload in blobs.values():
+            bundle_file.write(payload)
+    temporary_path.replace(path)
+    return path.stat().st_size
+
+
+class PreviewBundle:
+    """Memory-mapped, read-only view of a file written by ``write_bundle``."""
+
+    def __init__(self, path: Path):
+        with Path(path).open("rb") as bundle_file:
+            self._map = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_size = len(BUNDLE_MAGIC) + 8
+        if self._map[: len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            self._map.close()
+            raise ValueError("Not a newsletter preview bundle")
+        index_size = int.from_bytes(self._map[len(BUNDLE_MAGIC):header_size], "big")
+        self._data_start = header_size + index_size
+        self._index = json.loads(self._map[header_size:self._data_start].decode("utf8"))
+
+    def close(self):
+        self._map.close()
+
+    def blob(self, digest: str) -> bytes:
+        offset, length = self._index["blobs"][digest]
+        start = self._data_start + offset
+        return self._map[start:start + length]
+
+    def snapshot(self) -> PreviewSnapshot:
+        def restore_gif(match):
+            encoded = base64.b64encode(self.blob(match.group(1))).decode("ascii")
+            return "data:image/gif;base64," + encoded
+
+        fields = dict(self._index["snapshot"])
+        for key in ("standard_html", "spark_html"):
+            document = self.blob(fields[key]).decode("utf8")
+            fields[key] = BUNDLE_BLOB_PATTERN.sub(restore_gif, document)
+        return PreviewSnapshot(**fields)
+
+    def image_ids(self):
+        return list(self._index["images"])
+
+    def image(self, file_id: str) -> Tuple[str, bytes]:
+        entry = self._index["images"].get(file_id)
+        if entry is None:
+            raise KeyError(file_id)
+        return entry["content_type"], self.blob(entry["blob"])
+
+
+class BundledPreviewState:
+    """Serve one bundled edition with no sheet or Drive access."""
+
+    version = 0
+
+    def __init__(self, bundle: PreviewBundle):
+        self.bundle = bundle
+        self.metrics = PreviewMetrics()
+        self._snapshot = bundle.snapshot()
+
+    def get_snapshot(self, refresh: bool = False) -> PreviewSnapshot:
+        return self._snapshot
+
+    def get_image(self, file_id: str):
+        try:
+            return self.bundle.image(file_id)
+        except KeyError:
+            raise ValueError("Image is not in the preview bundle") from None
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        time.sleep(timeout)
+        return self.version
+
+
+def export_bundle(state: PreviewState, path: Path) -> int:
+    """Build the live snapshot, fetch every proxied image and bundle both."""
+    snapshot = state.get_snapshot()
+    images = {}
+    file_ids = set(PROXIED_IMAGE_PATTERN.findall(snapshot.standard_html))
+    file_ids.update(PROXIED_IMAGE_PATTERN.findall(snapshot.spark_html))
+    for file_id in sorted(file_ids):
+        try:
+            images[file_id] = state.get_image(file_id)
+        except Exception as error:
+            print("Bundle skipped image {}: {}".format(file_id, type(error).__name__))
+    return write_bundle(path, snapshot, images)
+
+
+def _dashboard_html(
+    snapshot: PreviewSnapshot,
+    variant: str,
+    live_reload_version: Optional[int] = None,
+) -> str:
     variant_label = VARIANTS[variant]
     buttons = []
     for value, label in VARIANTS.items():
@@ -330,6 +866,11 @@ def _dashboard_html(snapshot: PreviewSnapshot, variant: str) -> str:
         )
 
     email_url = "/email?variant=" + quote(variant)
+    live_reload = ""
+    if live_reload_version is not None:
+        live_reload = '<script src="/live-reload.js" data-version="{}"></script>'.format(
+            int(live_reload_version)
+        )
     status = (
         "Issue No. {} · {} responses · loaded {} · {} mode"
     ).format(
@@ -381,6 +922,7 @@ def _dashboard_html(snapshot: PreviewSnapshot, variant: str) -> str:
     </header>
     <div class="notice">This page only reads the sheet. It cannot send email or advance the edition counter.</div>
     <iframe title="Rendered newsletter" src="$email_url" sandbox=""></iframe>
+    $live_reload
 </body>
 </html>""")
     return template.substitute(
@@ -389,6 +931,7 @@ def _dashboard_html(snapshot: PreviewSnapshot, variant: str) -> str:
         buttons="".join(buttons),
         variant=quote(variant),
         email_url=html.escape(email_url, quote=True),
+        live_reload=live_reload,
     )
 
 
@@ -419,15 +962,47 @@ def _error_html() -> str:
 </html>"""
 
 
-def create_handler(state: PreviewState):
+def create_handler(
+    state: PreviewState,
+    live_reload: bool = False,
+    metrics: Optional[PreviewMetrics] = None,
+):
+    """Build the request handler; requests are counted into ``metrics``,
+    by default the state's own."""
+    metrics = metrics or getattr(state, "metrics", None) or PreviewMetrics()
+
     class PreviewRequestHandler(BaseHTTPRequestHandler):
         server_version = "ChatimePreview/1.0"
 
         def do_GET(self):
-            self._dispatch(send_body=True)
+            self._measure(send_body=True)
 
         def do_HEAD(self):
-            self._dispatch(send_body=False)
+            self._measure(send_body=False)
+
+        def send_response(self, code, message=None):
+            self._status = code
+            super().send_response(code, message)
+
+        def _measure(self, send_body: bool):
+            route = _metric_route(urlparse(self.path).path)
+            self._status = None
+            started = time.perf_counter()
+            try:
+                self._dispatch(send_body)
+            finally:
+                # Event streams stay open for as long as the tab does.
+                if route != "/events":
+                    metrics.observe(
+                        "preview_request_duration_seconds",
+                        time.perf_counter() - started,
+                        route=route,
+                    )
+                metrics.increment(
+                    "preview_requests_total",
+                    route=route,
+                    status=str(self._status),
+                )
 
         def do_POST(self):
             self._write(
@@ -462,6 +1037,32 @@ def create_handler(state: PreviewState):
                 )
                 return
 
+            if parsed.path == "/metrics":
+                self._write(
+                    HTTPStatus.OK,
+                    metrics.render(),
+                    "text/plain; version=0.0.4; charset=utf-8",
+                    send_body,
+                )
+                return
+
+            if live_reload and parsed.path == "/live-reload.js":
+                self._write(
+                    HTTPStatus.OK,
+                    LIVE_RELOAD_SCRIPT,
+                    "text/javascript; charset=utf-8",
+                    send_body,
+                )
+                return
+
+            if live_reload and parsed.path == "/events":
+                try:
+                    since = int(query.get("since", ["0"])[0])
+                except ValueError:
+                    since = 0
+                self._stream_events(since, send_body)
+                return
+
             if parsed.path.startswith("/image/"):
                 file_id = unquote(parsed.path.removeprefix("/image/"))
                 if not re.fullmatch(r"[A-Za-z0-9_-]{10,200}", file_id):
@@ -538,11 +1139,38 @@ def create_handler(state: PreviewState):
 
             self._write(
                 HTTPStatus.OK,
-                _dashboard_html(snapshot, variant),
+                _dashboard_html(
+                    snapshot,
+                    variant,
+                    state.version if live_reload else None,
+                ),
                 "text/html; charset=utf-8",
                 send_body,
             )
 
+        def _stream_events(self, since: int, send_body: bool):
+            """Send a server-sent ``reload`` event when the preview changes."""
+            self.send_response(HTTPStatus.OK.value)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("X-Content-Type-Options", "nosniff")
+            self.end_headers()
+            if not send_body:
+                return
+            try:
+                while True:
+                    version = state.wait_for_change(since, timeout=15.0)
+                    if version == since:
+                        self.wfile.write(b": keep-alive\n\n")
+                    else:
+                        since = version
+                        self.wfile.write(
+                            "event: reload\ndata: {}\n\n".format(version).encode("utf8")
+                        )
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
         def _write(
             self,
             status: HTTPStatus,
@@ -571,8 +1199,10 @@ def create_handler(state: PreviewState):
                 self.send_header(
                     "Content-Security-Policy",
                     "default-src 'self'; style-src 'unsafe-inline'; "
-                    "img-src 'self' data:; script-src 'none'; object-src 'none'; "
-                    "base-uri 'none'; form-action 'none'; frame-src 'self'",
+                    "img-src 'self' data:; script-src {}; object-src 'none'; "
+                    "base-uri 'none'; form-action 'none'; frame-src 'self'".format(
+                        "'self'" if live_reload else "'none'"
+                    ),
                 )
             self.end_headers()
             if send_body:
@@ -602,6 +1232,8 @@ def create_handler(state: PreviewState):
                 self.wfile.write(payload)
 
         def log_message(self, message_format, *args):
+            if urlparse(getattr(self, "path", "")).path == "/metrics":
+                return
             print("Preview: " + (message_format % args))
 
     return PreviewRequestHandler
@@ -622,29 +1254,80 @@ def parse_args(argv=None):
         default=DEFAULT_PORT,
         help="Local port to use (default: %(default)s).",
     )
-    return parser.parse_args(argv)
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Re-render on template edits, poll the sheet, and live-reload the browser.",
+    )
+    parser.add_argument(
+        "--sheet-interval",
+        type=float,
+        default=DEFAULT_SHEET_INTERVAL,
+        help="Seconds between sheet polls in watch mode; 0 disables polling "
+        "(default: %(default)s).",
+    )
+    bundle = parser.add_mutually_exclusive_group()
+    bundle.add_argument(
+        "--write-bundle",
+        metavar="PATH",
+        type=Path,
+        help="Build the live preview, save it with its images to PATH, and exit.",
+    )
+    bundle.add_argument(
+        "--from-bundle",
+        metavar="PATH",
+        type=Path,
+        help="Serve a saved preview bundle without contacting Google.",
+    )
+    args = parser.parse_args(argv)
+    if args.from_bundle and args.watch:
+        parser.error("--watch cannot be combined with --from-bundle")
+    return args
 
 
 def main(argv=None):
     args = parse_args(argv)
-    load_dotenv(BASE_DIR / ".env")
-    try:
-        config = PreviewConfig.from_environment()
-    except PreviewConfigurationError as error:
-        raise SystemExit("Preview configuration error: " + str(error))
+    if args.from_bundle:
+        try:
+            state = BundledPreviewState(PreviewBundle(args.from_bundle))
+        except (OSError, ValueError) as error:
+            raise SystemExit("Preview bundle error: " + str(error))
+    else:
+        load_dotenv(BASE_DIR / ".env")
+        try:
+            config = PreviewConfig.from_environment()
+        except PreviewConfigurationError as error:
+            raise SystemExit("Preview configuration error: " + str(error))
+        state = PreviewState(config)
+
+    if args.write_bundle:
+        size = export_bundle(state, args.write_bundle)
+        print("Wrote preview bundle {} ({:.1f} MB)".format(args.write_bundle, size / 1000000))
+        return
 
-    state = PreviewState(config)
     server = LocalPreviewServer(
         (LOCAL_HOST, args.port),
-        create_handler(state),
+        create_handler(state, live_reload=args.watch, metrics=state.metrics),
     )
+    watcher = None
+    if args.watch:
+        watcher = PreviewWatcher(
+            state,
+            [BASE_DIR / filename for filename in WATCHED_FILES],
+            sheet_interval=args.sheet_interval,
+        )
+        watcher.start()
     print("Chatime newsletter preview: http://{}:{}".format(LOCAL_HOST, args.port))
     print("Local preview only — email sending is disabled.")
+    if watcher is not None:
+        print("Watching templates and polling the sheet for changes.")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nPreview stopped.")
     finally:
+        if watcher is not None:
+            watcher.stop()
         server.server_close()
 
 
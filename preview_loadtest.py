@@ -0,0 +1,360 @@
+"""Load test for the local preview server.
+
+Serves the real preview handler against a stand-in for Google Sheets and
+Drive on the loopback interface, so nothing leaves the machine. Each client
+thread views the preview the way a browser does: the dashboard, the email
+it frames, then every ``/image/`` that email shows over a few parallel
+connections. Every ``--refresh-every`` views a client asks for live data
+instead, which reloads the sheet while the other clients keep reading.
+
+    python preview_loadtest.py --clients 16 --views 25
+
+Prints p50/p95/p99 latency per route, overall throughput, how often the
+stand-in Drive was asked for each photo and the peak resident memory of the
+process. Clients and server share the process, so the memory includes both.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+from urllib.request import urlopen
+
+from PIL import Image
+
+import preview
+from main import lazy_import, peak_memory_mb
+
+requests = lazy_import("requests")
+
+STAND_IN_HOSTS = ("docs.google.com", "drive.google.com")
+ROUTES = ("/", "/email", "/image", "refresh")
+QUESTION = "What are you looking forward to?"
+TEXT_COLUMNS = (
+    "✨ Any life updates?",
+    "☀️ One Good Thing!",
+    "😋 Food spot of the month?",
+    "🤫 Any interesting, funny, or embarrassing moments?",
+)
+SPECIAL_QUESTIONS = tuple("Special question {}".format(number) for number in range(1, 9))
+
+
+def drive_id(respondent, slot):
+    """A Drive-shaped file ID for one respondent's photo."""
+    return "loadtest{:04d}x{}".format(respondent, slot).ljust(33, "0")
+
+
+def sheet_csv(respondents, num_images=3):
+    """Return a response sheet with ``respondents`` rows from two days ago.
+
+    Everyone answers every text question and uploads ``num_images``
+    photos, which gives the preview its heaviest page.
+    """
+    image_columns = ["Image {}".format(number) for number in range(1, num_images + 1)]
+    caption_columns = ["Caption {}".format(number) for number in range(1, num_images + 1)]
+    header = (
+        ["Timestamp", "Your Name", QUESTION]
+        + list(TEXT_COLUMNS)
+        + image_columns
+        + caption_columns
+        + list(SPECIAL_QUESTIONS)
+        + ["Extra Image {}".format(number) for number in range(1, num_images + 1)]
+        + ["Extra Caption {}".format(number) for number in range(1, num_images + 1)]
+    )
+    timestamp = (datetime.now() - timedelta(days=2)).strftime("%d/%m/%Y %H:%M:%S")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for respondent in range(respondents):
+        name = "Friend {}".format(respondent + 1)
+        writer.writerow(
+            [timestamp, name, "Answer from " + name]
+            + ["{} from {}".format(column, name) for column in TEXT_COLUMNS]
+            + [
+                "https://drive.google.com/open?id=" + drive_id(respondent, slot)
+                for slot in range(num_images)
+            ]
+            + ["Caption {} from {}".format(slot + 1, name) for slot in range(num_images)]
+            + ["" for _ in SPECIAL_QUESTIONS]
+            + ["" for _ in range(2 * num_images)]
+        )
+    return buffer.getvalue().encode("utf8")
+
+
+def photo_bytes(file_id, size=(1200, 900)):
+    """A JPEG of a realistic size whose colour depends on ``file_id``."""
+    red, green, blue = hashlib.sha256(file_id.encode("ascii")).digest()[:3]
+    image = Image.effect_noise(size, 48).convert("RGB")
+    tint = Image.new("RGB", size, (red, green, blue))
+    output = io.BytesIO()
+    Image.blend(image, tint, 0.6).save(output, "JPEG", quality=85)
+    return output.getvalue()
+
+
+class StandInServer(ThreadingHTTPServer):
+    """Loopback stand-in for the sheet CSV export and Drive image links."""
+
+    daemon_threads = True
+
+    def __init__(self, respondents, drive_latency=0.0):
+        super().__init__((preview.LOCAL_HOST, 0), StandInHandler)
+        self.sheet = sheet_csv(respondents)
+        self.drive_latency = drive_latency
+        self.fetches = {"sheet": 0, "drive": 0}
+        self.fetched_ids = set()
+        self._photos = {}
+        self._lock = threading.Lock()
+
+    def photo(self, file_id):
+        with self._lock:
+            self.fetches["drive"] += 1
+            self.fetched_ids.add(file_id)
+            if file_id not in self._photos:
+                self._photos[file_id] = photo_bytes(file_id)
+            return self._photos[file_id]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parsed = urlsplit(self.path)
+        if parsed.path.startswith("/spreadsheets/"):
+            with self.server._lock:
+                self.server.fetches["sheet"] += 1
+            self._reply(self.server.sheet, "text/csv; charset=utf-8")
+        elif parsed.path == "/uc":
+            time.sleep(self.server.drive_latency)
+            file_id = parse_qs(parsed.query).get("id", [""])[0]
+            self._reply(self.server.photo(file_id), "image/jpeg")
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND.value)
+
+    def _reply(self, payload, content_type):
+        self.send_response(HTTPStatus.OK.value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, message_format, *args):
+        pass
+
+
+def stand_in_session(stand_in, pool_size):
+    """A session that sends every Google request to ``stand_in`` instead."""
+    netloc = "{}:{}".format(*stand_in.server_address[:2])
+
+    class StandInAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, **kwargs):
+            parts = urlsplit(request.url)
+            request.url = urlunsplit(("http", netloc, parts.path, parts.query, ""))
+            return super().send(request, **kwargs)
+
+    session = requests.Session()
+    adapter = StandInAdapter(pool_maxsize=pool_size)
+    for host in STAND_IN_HOSTS:
+        session.mount("https://" + host + "/", adapter)
+    return session
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of ``values``; ``share`` is 0-100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(-(-share * len(ordered) // 100)), 1)
+    return ordered[rank - 1]
+
+
+class LoadClient:
+    """One browser tab viewing the preview ``views`` times."""
+
+    def __init__(self, base_url, results, image_connections=6, refresh_every=0, seed=0):
+        self.base_url = base_url
+        self.results = results
+        self.image_connections = image_connections
+        self.refresh_every = refresh_every
+        self.random = random.Random(seed)
+
+    def get(self, route, path):
+        started = time.perf_counter()
+        try:
+            with urlopen(self.base_url + path, timeout=60) as response:
+                body = response.read()
+                status = response.status
+        except HTTPError as error:
+            body, status = b"", error.code
+        except OSError:
+            body, status = b"", None
+        self.results.record(route, status, time.perf_counter() - started)
+        return body
+
+    def view(self, refresh=False):
+        variant = self.random.choice(list(preview.VARIANTS))
+        if refresh:
+            self.get("refresh", "/?variant={}&refresh=1".format(variant))
+        else:
+            self.get("/", "/?variant=" + variant)
+        page = self.get("/email", "/email?variant=" + variant).decode("utf8", "replace")
+        file_ids = sorted(set(preview.PROXIED_IMAGE_PATTERN.findall(page)))
+        with ThreadPoolExecutor(max_workers=self.image_connections) as pool:
+            list(pool.map(lambda file_id: self.get("/image", "/image/" + file_id), file_ids))
+
+    def run(self, views):
+        for number in range(1, views + 1):
+            self.view(refresh=bool(self.refresh_every) and number % self.refresh_every == 0)
+
+
+class Results:
+    """Thread-safe latency samples per route."""
+
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+        self._lock = threading.Lock()
+
+    def record(self, route, status, seconds):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if status != HTTPStatus.OK:
+                self.errors[route] += 1
+
+    def summary(self):
+        return {
+            route: {
+                "requests": len(latencies),
+                "errors": self.errors[route],
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+            }
+            for route, latencies in self.latencies.items()
+        }
+
+
+def run(clients=8, views=10, respondents=12, refresh_every=5, drive_latency=0.05, image_connections=6):
+    """Run one load test and return its report as a dictionary."""
+    stand_in = StandInServer(respondents, drive_latency=drive_latency)
+    threading.Thread(target=stand_in.serve_forever, daemon=True).start()
+    session = stand_in_session(stand_in, pool_size=clients * image_connections)
+    config = preview.PreviewConfig(
+        sheet_id="loadtest-sheet",
+        sheet_name="Form Responses 1",
+        background_url="https://drive.google.com/open?id=" + drive_id(9999, 0),
+    )
+    state = preview.PreviewState(config, session=session)
+
+    class QuietHandler(preview.create_handler(state, metrics=state.metrics)):
+        def log_message(self, message_format, *args):
+            pass
+
+    server = preview.LocalPreviewServer((preview.LOCAL_HOST, 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://{}:{}".format(preview.LOCAL_HOST, server.server_address[1])
+    results = Results()
+    memory_before = peak_memory_mb()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            tabs = [
+                LoadClient(base_url, results, image_connections, refresh_every, seed=number)
+                for number in range(clients)
+            ]
+            for finished in [pool.submit(tab.run, views) for tab in tabs]:
+                finished.result()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        server.server_close()
+        stand_in.shutdown()
+        stand_in.server_close()
+        session.close()
+
+    routes = results.summary()
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "routes": routes,
+        "requests": total,
+        "seconds": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "sheet_fetches": stand_in.fetches["sheet"],
+        "drive_fetches": stand_in.fetches["drive"],
+        "distinct_images": len(stand_in.fetched_ids),
+        "memory_before_mb": memory_before,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def print_report(report):
+    print("{:<10} {:>9} {:>7} {:>9} {:>9} {:>9}".format("route", "requests", "errors", "p50", "p95", "p99"))
+    for route, stats in report["routes"].items():
+        if not stats["requests"]:
+            continue
+        print("{:<10} {:>9} {:>7} {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms".format(
+            route,
+            stats["requests"],
+            stats["errors"],
+            stats["p50"] * 1000,
+            stats["p95"] * 1000,
+            stats["p99"] * 1000,
+        ))
+    print("{} requests in {:.1f}s: {:.0f} requests/s".format(
+        report["requests"], report["seconds"], report["throughput"]
+    ))
+    print("Stand-in served {} sheet fetches and {} Drive fetches for {} distinct photos".format(
+        report["sheet_fetches"], report["drive_fetches"], report["distinct_images"]
+    ))
+    if report["peak_memory_mb"] is not None:
+        print("Peak memory {:.0f} MB ({:.0f} MB before the clients started)".format(
+            report["peak_memory_mb"], report["memory_before_mb"]
+        ))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the local preview server against a stand-in sheet.")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent browser tabs (default: %(default)s).")
+    parser.add_argument("--views", type=int, default=10, help="Page views per client (default: %(default)s).")
+    parser.add_argument("--respondents", type=int, default=12, help="Rows in the stand-in sheet (default: %(default)s).")
+    parser.add_argument(
+        "--refresh-every",
+        type=int,
+        default=5,
+        help="Every Nth view reloads live data; 0 never does (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--drive-latency",
+        type=float,
+        default=0.05,
+        help="Seconds the stand-in Drive waits before each photo (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--image-connections",
+        type=int,
+        default=6,
+        help="Parallel image requests per client, like a browser (default: %(default)s).",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print_report(run(
+        clients=args.clients,
+        views=args.views,
+        respondents=args.respondents,
+        refresh_every=args.refresh_every,
+        drive_latency=args.drive_latency,
+        image_connections=args.image_connections,
+    ))
+
+
+if __name__ == "__main__":
+    main()
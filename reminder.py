@@ -1,53 +1,64 @@
-from jinja2 import Template
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.image import MIMEImage
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from datetime import datetime
-from PIL import Image, ImageOps, UnidentifiedImageError
-from io import BytesIO
-from pillow_heif import register_heif_opener
+from main import (HERO_IMAGE_MAX_BYTES, HERO_IMAGE_MAX_SIDE, SMTP_HOST, SMTP_PORT, ImageIndex, encode_image, lazy_import,
+                  open_remote_image, read_responses, serialize_message)
 import ast
 import os
 import pytz
-import pandas as pd
-import numpy as np
-import requests
 import smtplib
 import random
+import sys
+
+jinja2 = lazy_import("jinja2")
+
+TIMEZONE = "Pacific/Auckland"
 
 class Reminder:
 
-    def __init__(self, sender, recipients, recipients_spark, password, sheet_id, sheet_name, form_url):
-        
+    def __init__(self, sender, recipients, recipients_spark, password, sheet_id, sheet_name, form_url, image_index=None,
+                 timezone=TIMEZONE, smtp_session=None):
+
         self.datetime_now = datetime.now(tz=pytz.timezone(timezone))
         self.sender = sender
         self.recipients = recipients
         self.recipients_spark = recipients_spark
         self.password = password
         self.form_url = form_url
+        self.image_index = image_index
+        self.smtp_session = smtp_session
 
         url = f'https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet={sheet_name}'.replace(" ", "%20")
-        self.data_df = pd.read_csv(url).replace(np.nan, '')
+        self.responses = read_responses(url)
 
     def generate_email(self):
         '''
         Generate reminder using HTML template and Jinja
         '''
         with open('reminder.html', encoding="utf8") as f:
-            template = Template(f.read())
+            template = jinja2.Template(f.read())
         self.email_data = {
             "subject": "💌 Newsletter Reminder " + self.datetime_now.strftime("%m/%d"),
-            "image_url": random.choice(
-                [x for i in range(1, 4) for x in self.data_df[f"Image {i}"].to_list() if x]
-                ).replace('open?', 'uc?export=view&'),
-            "form_url": form_url
+            "image_url": self.choose_image_url(),
+            "form_url": self.form_url
         }
         self.email_content = template.render(self.email_data)
 
-    def send_email(self):
+    def choose_image_url(self):
         '''
-        Send email containing newsletter
+        Pick a hero image, preferring ones a newsletter run already validated.
+        '''
+        urls = [x for i in range(1, 4) for x in self.responses[f"Image {i}"] if x]
+        if self.image_index is not None:
+            urls = self.image_index.candidates(urls) or urls
+        return random.choice(urls).replace('open?', 'uc?export=view&')
+
+    def build_message(self):
+        '''
+        Assemble the reminder's MIME message without sending it.
         '''
         msg = MIMEMultipart()
         msg['Subject'] = self.email_data["subject"]
@@ -55,48 +66,72 @@ class Reminder:
         msg['To'] = self.sender
         self.image_to_byte(msg)
         msg.attach(MIMEText(self.email_content, "html"))
+        return msg
 
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp_server:
+    def send_email(self):
+        '''
+        Send email containing newsletter
+        '''
+        self.send_message(serialize_message(self.build_message()))
+
+    def send_message(self, message):
+        '''
+        Send an already serialized reminder to everyone.
+        '''
+        with self._smtp_connection() as smtp_server:
+            smtp_server.sendmail(self.sender, [self.sender] + self.recipients_spark + self.recipients, message) # recipients are BCCed
+        print("Message sent!")
+
+    @contextmanager
+    def _smtp_connection(self):
+        if self.smtp_session is not None and self.smtp_session.sender == self.sender:
+            with self.smtp_session.connection() as smtp_server:
+                yield smtp_server
+            return
+        with smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT) as smtp_server:
             smtp_server.ehlo()
             smtp_server.login(self.sender, self.password)
-            smtp_server.sendmail(self.sender, [self.sender] + self.recipients_spark + self.recipients, msg.as_string()) # recipients are BCCed
-        print("Message sent!")
+            yield smtp_server
 
     def image_to_byte(self, msg):
-        try:
-            image_data = ImageOps.exif_transpose(Image.open(requests.get(self.email_data["image_url"], stream=True).raw))
-        except UnidentifiedImageError:
-            register_heif_opener()
-            image_data = ImageOps.exif_transpose(Image.open(requests.get(self.email_data["image_url"], stream=True).raw))
-        if image_data.mode in ("RGBA", "P"): image_data = image_data.convert("RGB")
-        quality = 100
-        while True:
-            byte_buffer = BytesIO()
-            image_data.save(byte_buffer, format="JPEG", quality=quality)
-            if byte_buffer.tell() / 1000000 > 24.5:
-                quality -= 5
-            else:
-                break 
-        image = MIMEImage(byte_buffer.getvalue())
+        derivative = None
+        if self.image_index is not None:
+            derivative = self.image_index.derivative_path(self.email_data["image_url"])
+        if derivative is not None and derivative.exists():
+            image_bytes = derivative.read_bytes()
+        else:
+            image_data = open_remote_image(self.email_data["image_url"], max_side=HERO_IMAGE_MAX_SIDE)
+            if image_data is None:
+                raise RuntimeError(f"Could not load reminder image {self.email_data['image_url']}")
+            image_bytes = encode_image(image_data, HERO_IMAGE_MAX_BYTES, "reminder-hero")
+        image = MIMEImage(image_bytes)
         image.add_header('Content-ID', f"<image>")
         image.add_header('content-disposition', 'attachment', filename="🍵")
         msg.attach(image)
-        
-if __name__ == "__main__":
-
-    # parameters
-    timezone = "Pacific/Auckland"
 
+def reminder_from_environment(**options):
+    '''
+    Build the reminder from ``.env`` / GitHub Actions secrets.
+    '''
     load_dotenv()
-    sender = os.getenv("GMAIL_ADDRESS")
-    recipients = ast.literal_eval(os.getenv("RECIPIENT"))
-    recipients_spark = ast.literal_eval(os.getenv("RECIPIENT_SPARK"))
-    password = os.getenv("APP_PASSWORD")
-    sheet_id = os.getenv("SHEET_ID")
-    sheet_name = os.getenv("SHEET_NAME")
-    form_url = os.getenv("FORM_URL")
-    
-    # send email
-    reminder = Reminder(sender, recipients, recipients_spark, password, sheet_id, sheet_name, form_url)
-    reminder.generate_email()
-    reminder.send_email()
\ No newline at end of file
+    return Reminder(
+        os.getenv("GMAIL_ADDRESS"),
+        ast.literal_eval(os.getenv("RECIPIENT")),
+        ast.literal_eval(os.getenv("RECIPIENT_SPARK")),
+        os.getenv("APP_PASSWORD"),
+        os.getenv("SHEET_ID"),
+        os.getenv("SHEET_NAME"),
+        os.getenv("FORM_URL"),
+        **options,
+    )
+
+if __name__ == "__main__":
+
+    if "--benchmark" in sys.argv[1:]:
+        # build the reminder and send it to a local SMTP sink instead of Gmail
+        import send_benchmark
+        send_benchmark.main(["reminder"])
+    else:
+        reminder = reminder_from_environment(image_index=ImageIndex())
+        reminder.generate_email()
+        reminder.send_email()
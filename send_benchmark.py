@@ -0,0 +1,342 @@
+"""End-to-end benchmark of the send path against a local SMTP sink.
+
+Builds the real newsletter or reminder from ``.env`` and sends it, over
+implicit TLS with a login like Gmail's port 465, to an SMTP server on the
+loopback interface instead of Gmail. No Gmail credentials are needed and
+nothing is delivered; the edition counter is not advanced and nothing is
+written to ``.cache``.
+
+    python main.py --benchmark
+    python reminder.py --benchmark
+
+Prints the render, MIME build and serialization times, each variant's
+serialized size and transfer throughput, and the peak memory. It also
+checks that the sink received every message byte for byte and that each
+``cid:`` reference in its HTML has a matching attachment.
+
+The sink's certificate is a throwaway self-signed one made with the
+``openssl`` command line tool.
+"""
+
+import argparse
+import base64
+import email
+import email.policy
+import re
+import secrets
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from main import (
+    ImageIndex,
+    SMTPSession,
+    newsletter_from_environment,
+    peak_memory_mb,
+    serialize_message,
+)
+
+SINK_HOST = "127.0.0.1"
+BENCHMARK_SENDER = "benchmark@localhost"
+MAX_LINE = 64 * 1024
+CID_REFERENCE = re.compile(r"cid:([^\"'\s)>]+)")
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    """One SMTP session: EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def setup(self):
+        self.request = self.server.context.wrap_socket(self.request, server_side=True)
+        super().setup()
+
+    def reply(self, code, *lines):
+        lines = lines or ("OK",)
+        for index, line in enumerate(lines):
+            separator = " " if index == len(lines) - 1 else "-"
+            self.wfile.write("{}{}{}\r\n".format(code, separator, line).encode("ascii"))
+
+    def handle(self):
+        self.reply(220, "sink ESMTP")
+        authenticated = False
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline(MAX_LINE)
+            if not line:
+                return
+            command, _, argument = line.decode("ascii", "replace").rstrip("\r\n").partition(" ")
+            command = command.upper()
+            if command in ("EHLO", "HELO"):
+                self.reply(250, "localhost", "AUTH PLAIN", "8BITMIME", "SIZE {}".format(self.server.max_size))
+            elif command == "AUTH":
+                authenticated = self.authenticate(argument)
+            elif command == "NOOP":
+                self.reply(250)
+            elif command == "RSET":
+                sender, recipients = None, []
+                self.reply(250)
+            elif command == "QUIT":
+                self.reply(221, "Bye")
+                return
+            elif not authenticated and command in ("MAIL", "RCPT", "DATA"):
+                self.reply(530, "Authentication required")
+            elif command == "MAIL":
+                sender, recipients = _address(argument), []
+                self.reply(250)
+            elif command == "RCPT" and sender is not None:
+                recipients.append(_address(argument))
+                self.reply(250)
+            elif command == "DATA" and recipients:
+                self.reply(354, "End data with <CR><LF>.<CR><LF>")
+                self.server.record(sender, recipients, self.read_data())
+                sender, recipients = None, []
+                self.reply(250)
+            elif command in ("RCPT", "DATA"):
+                self.reply(503, "Bad sequence of commands")
+            else:
+                self.reply(502, "Command not implemented")
+
+    def authenticate(self, argument):
+        mechanism, _, response = argument.partition(" ")
+        if mechanism.upper() != "PLAIN":
+            self.reply(504, "Only AUTH PLAIN is supported")
+            return False
+        if not response:
+            self.reply(334, "")
+            response = self.rfile.readline(MAX_LINE).decode("ascii", "replace").strip()
+        try:
+            _, username, password = base64.b64decode(response).decode("utf8").split("\0")
+        except ValueError:
+            self.reply(501, "Malformed AUTH PLAIN response")
+            return False
+        if (username, password) != self.server.credentials:
+            self.reply(535, "Authentication credentials invalid")
+            return False
+        with self.server.lock:
+            self.server.logins += 1
+        self.reply(235, "Authentication successful")
+        return True
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline(MAX_LINE)
+            if line in (b".\r\n", b""):
+                return b"".join(lines)
+            lines.append(line[1:] if line.startswith(b".") else line)
+
+
+def _address(argument):
+    match = re.search(r"<([^>]*)>", argument)
+    return match.group(1) if match else argument.partition(":")[2].strip()
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Loopback SMTP server with implicit TLS and AUTH PLAIN that keeps
+    every message it receives in ``messages``.
+
+    Use it as a context manager; ``session(sender)`` returns an
+    ``SMTPSession`` logged in to it that trusts its certificate.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, max_size=50 * 1024 * 1024):
+        self._directory = tempfile.TemporaryDirectory()
+        self.certificate = _self_signed_certificate(Path(self._directory.name))
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.load_cert_chain(self.certificate, Path(self._directory.name) / "key.pem")
+        super().__init__((SINK_HOST, 0), SinkHandler)
+        self.max_size = max_size
+        self.password = secrets.token_urlsafe(16)
+        self.credentials = None
+        self.messages = []
+        self.logins = 0
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+        self._directory.cleanup()
+
+    def record(self, sender, recipients, data):
+        with self.lock:
+            self.messages.append((sender, list(recipients), data))
+
+    def session(self, sender):
+        self.credentials = (sender, self.password)
+        context = ssl.create_default_context(cafile=str(self.certificate))
+        return SMTPSession(sender, self.password, SINK_HOST, self.server_address[1], context=context)
+
+
+def _self_signed_certificate(directory):
+    if shutil.which("openssl") is None:
+        raise RuntimeError("The SMTP sink needs the openssl command to make its TLS certificate")
+    certificate = directory / "cert.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", str(directory / "key.pem"), "-out", str(certificate),
+            "-subj", "/CN=" + SINK_HOST, "-addext", "subjectAltName=IP:" + SINK_HOST,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certificate
+
+
+def content_id_problems(payload):
+    """Return the ``cid:`` references without an attachment and the
+    attachments nothing references, for one serialized message."""
+    message = email.message_from_bytes(payload, policy=email.policy.default)
+    attached, referenced = set(), set()
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        if part.get("Content-ID"):
+            attached.add(part["Content-ID"].strip("<>"))
+        elif part.get_content_type() == "text/html":
+            referenced.update(CID_REFERENCE.findall(part.get_content()))
+    return sorted(referenced - attached), sorted(attached - referenced)
+
+
+def _transfer(sink, send, payload):
+    """Run ``send`` and describe what the sink received because of it."""
+    first = len(sink.messages)
+    started = time.perf_counter()
+    send()
+    seconds = time.perf_counter() - started
+    received = sink.messages[first:]
+    transferred = sum(len(data) for _, _, data in received)
+    missing, unused = content_id_problems(received[-1][2]) if received else ([], [])
+    return {
+        "bytes": len(payload),
+        "messages": len(received),
+        "recipients": sum(len(recipients) for _, recipients, _ in received),
+        "seconds": seconds,
+        "throughput": transferred / seconds if seconds else 0.0,
+        "intact": bool(received) and all(data.rstrip(b"\r\n") == payload.rstrip(b"\r\n") for _, _, data in received),
+        "missing_cids": missing,
+        "unused_cids": unused,
+    }
+
+
+def _timed(stages, name, function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    stages[name] = time.perf_counter() - started
+    return result
+
+
+def benchmark_newsletter(newsletter, sink):
+    """Build ``newsletter`` without its message cache or edition counter
+    and send every variant with recipients to ``sink``. ``main`` also
+    leaves out the image index and response history, so a run writes
+    nothing under ``.cache``."""
+    stages = {}
+    newsletter.sender = newsletter.sender or BENCHMARK_SENDER
+    newsletter.smtp_session = sink.session(newsletter.sender)
+    newsletter.message_cache = None
+    newsletter.send_interval = 0
+    _timed(stages, "render", newsletter.generate_newsletter, False)
+    variants = {"standard": False}
+    if newsletter.recipients_spark:
+        variants["spark"] = True
+    messages = _timed(stages, "mime build", newsletter.build_messages, tuple(variants.values()))
+    report = {"stages": stages, "variants": {}}
+    try:
+        for variant, spark in variants.items():
+            payload = _timed(stages, "serialize " + variant, serialize_message, messages[spark])
+            report["variants"][variant] = _transfer(
+                sink, lambda: newsletter.send_message(payload, spark=spark), payload
+            )
+    finally:
+        newsletter.smtp_session.close()
+    report["logins"] = sink.logins
+    report["peak_memory_mb"] = peak_memory_mb()
+    return report
+
+
+def benchmark_reminder(reminder, sink):
+    """Build ``reminder`` and send it to ``sink``."""
+    stages = {}
+    reminder.sender = reminder.sender or BENCHMARK_SENDER
+    reminder.smtp_session = sink.session(reminder.sender)
+    _timed(stages, "render", reminder.generate_email)
+    message = _timed(stages, "mime build", reminder.build_message)
+    payload = _timed(stages, "serialize reminder", serialize_message, message)
+    try:
+        transfer = _transfer(sink, lambda: reminder.send_message(payload), payload)
+    finally:
+        reminder.smtp_session.close()
+    return {
+        "stages": stages,
+        "variants": {"reminder": transfer},
+        "logins": sink.logins,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def report_problems(report):
+    """Describe every variant that did not arrive intact with matching CIDs."""
+    problems = []
+    for variant, transfer in report["variants"].items():
+        if not transfer["intact"]:
+            problems.append("{}: the sink did not receive the message unchanged".format(variant))
+        if transfer["missing_cids"]:
+            problems.append("{}: no attachment for {}".format(variant, ", ".join(transfer["missing_cids"])))
+    return problems
+
+
+def print_report(report):
+    for name, seconds in report["stages"].items():
+        print("{:<20} {:>9.0f}ms".format(name, seconds * 1000))
+    for variant, transfer in report["variants"].items():
+        print("{}: {:.1f} KB to {} recipient(s) in {} message(s), {:.0f}ms, {:.1f} MB/s".format(
+            variant,
+            transfer["bytes"] / 1024,
+            transfer["recipients"],
+            transfer["messages"],
+            transfer["seconds"] * 1000,
+            transfer["throughput"] / (1024 * 1024),
+        ))
+        if transfer["unused_cids"]:
+            print("  unreferenced attachments: " + ", ".join(transfer["unused_cids"]))
+    print("SMTP logins: {}".format(report["logins"]))
+    if report["peak_memory_mb"] is not None:
+        print("Peak memory: {:.0f} MB".format(report["peak_memory_mb"]))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the send path against a local SMTP sink.")
+    parser.add_argument("email", choices=("newsletter", "reminder"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with SMTPSink() as sink:
+        if args.email == "reminder":
+            from reminder import reminder_from_environment
+
+            report = benchmark_reminder(reminder_from_environment(image_index=ImageIndex()), sink)
+        else:
+            report = benchmark_newsletter(newsletter_from_environment(image_index=None, history=None), sink)
+    print_report(report)
+    problems = report_problems(report)
+    if problems:
+        raise SystemExit("\n".join(problems))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cold-start benchmark for the newsletter entry points.
+
+Runs every command in a fresh interpreter a few times and prints the median
+wall time, then lists the heavy modules that a plain import actually
+executed. pandas, numpy, requests, jinja2 and pillow-heif are imported
+lazily, so none of them should show up.
+
+    python startup_benchmark.py --runs 7
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+HEAVY_MODULES = ("pandas", "numpy", "requests", "jinja2", "pillow_heif")
+COMMANDS = {
+    "import main": ["-c", "import main"],
+    "import preview": ["-c", "import preview"],
+    "import reminder": ["-c", "import reminder"],
+    "preview.py --help": ["preview.py", "--help"],
+    "pipeline.py --help": ["pipeline.py", "--help"],
+    "batch.py --help": ["batch.py", "--help"],
+}
+EXECUTED_PROBE = """
+import importlib.util, json, sys
+import {module}
+lazy = importlib.util._LazyModule
+print(json.dumps([name for name in {heavy!r}
+                  if name in sys.modules and not isinstance(sys.modules[name], lazy)]))
+"""
+
+
+def time_command(arguments, runs):
+    """Return the wall time of each of ``runs`` fresh interpreter runs."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + arguments,
+            cwd=BASE_DIR,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def executed_heavy_modules(module):
+    """Return the heavy modules that importing ``module`` actually ran."""
+    probe = EXECUTED_PROBE.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=BASE_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure entry point start-up time.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command (default: 5).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = statistics.median(time_command(["-c", "pass"], args.runs))
+    print("{:<22} {:>10} {:>14}".format("command", "median", "over python"))
+    for name, arguments in COMMANDS.items():
+        median = statistics.median(time_command(arguments, args.runs))
+        print("{:<22} {:>8.0f}ms {:>12.0f}ms".format(name, median * 1000, (median - baseline) * 1000))
+    for module in ("main", "preview", "reminder"):
+        executed = executed_heavy_modules(module)
+        print("import {}: {}".format(module, ", ".join(executed) if executed else "no heavy modules loaded"))
+
+
+if __name__ == "__main__":
+    main()
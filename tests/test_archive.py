@@ -0,0 +1,110 @@
+import json
+import tempfile
+import unittest
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from dateutil.relativedelta import relativedelta
+
+import archive
+import main
+
+
+GIF_BYTES = b"GIF89a\x01\x00\x01\x00\x00\x00\x00;"
+
+
+def _message(subject="Chatime Newsletter 🍵 08/31"):
+    msg = MIMEMultipart()
+    msg["Subject"] = subject
+    gif = MIMEImage(GIF_BYTES, _subtype="gif")
+    gif.add_header("Content-ID", "<questiongif0>")
+    msg.attach(gif)
+    msg.attach(MIMEText('<p>DIYL</p><img src="cid:questiongif0"><img src="https://example.test/photo.jpg">', "html"))
+    return main.serialize_message(msg)
+
+
+class ArchiveBuildsTests(unittest.TestCase):
+    def test_checkpointed_editions_are_added_once(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            build_root = Path(temp_dir) / "editions"
+            output = Path(temp_dir) / "archive"
+            (build_root / "27").mkdir(parents=True)
+            (build_root / "27" / "standard.eml").write_bytes(_message())
+            (build_root / "27" / "status.json").write_text(json.dumps({"date": "2026-08-31"}), encoding="utf8")
+
+            added = archive.archive_builds(build_root, output)
+            page = (output / "27" / "index.html").read_text(encoding="utf8")
+            asset = (output / "27" / "questiongif0.gif").read_bytes()
+            again = archive.archive_builds(build_root, output)
+            archive.write_index(output)
+            index = (output / "index.html").read_text(encoding="utf8")
+
+        self.assertEqual((added, again), ([27], []))
+        self.assertIn('<img src="questiongif0.gif">', page)
+        self.assertIn("https://example.test/photo.jpg", page)
+        self.assertEqual(asset, GIF_BYTES)
+        self.assertIn('<a href="27/index.html">Edition 27</a> 2026-08-31 Chatime Newsletter 🍵 08/31', index)
+
+
+class BackfillTests(unittest.TestCase):
+    def test_missing_editions_use_snapshots_or_the_sheet(self):
+        built = {}
+
+        def for_edition(edition, responses=None, sheet=None):
+            built[edition] = (responses, sheet)
+            return SimpleNamespace(
+                responses=responses or sheet,
+                datetime_now=main.datetime(2026, edition, 1),
+                generate_newsletter=mock.Mock(),
+                serialized_message=mock.Mock(return_value=_message("Edition {}".format(edition))),
+            )
+
+        newsletter = SimpleNamespace(sheet_url="https://example.test/sheet.csv", session=None, for_edition=for_edition)
+        sheet = main.Responses.from_columns({"Timestamp": ["01/02/2026 10:00:00"]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            build_root = Path(temp_dir) / "editions"
+            output = Path(temp_dir) / "archive"
+            archive.archive_message(1, _message("Edition 1"), output)
+            (build_root / "2").mkdir(parents=True)
+            sheet.to_csv(build_root / "2" / "responses.csv")
+            with mock.patch.object(archive, "read_responses", wraps=main.read_responses) as read, mock.patch.object(
+                main.requests, "get", return_value=mock.Mock(content=b"Timestamp\n01/03/2026 10:00:00\n")
+            ):
+                rebuilt = archive.backfill(newsletter, [1, 2, 3], build_root, output, workers=2)
+            dates = {metadata["edition"]: metadata["date"] for metadata in archive.archived_editions(output)}
+
+        self.assertEqual(sorted(rebuilt), [2, 3])
+        self.assertEqual(sorted(built), [2, 3])
+        self.assertEqual(built[2][0]["Timestamp"], ["01/02/2026 10:00:00"])
+        self.assertIsNone(built[3][0])
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(dates, {1: None, 2: "2026-02-01", 3: "2026-03-01"})
+
+
+class EditionWindowTests(unittest.TestCase):
+    def test_past_editions_get_their_date_and_window(self):
+        newsletter = main.Newsletter.__new__(main.Newsletter)
+        newsletter.first_edition_date = "2024/03/01"
+        newsletter.frequency_unit = "month"
+        newsletter.time_delta = relativedelta(months=+1)
+        newsletter.timezone = "Pacific/Auckland"
+        newsletter.sheet_url = "https://example.test/sheet.csv"
+        newsletter.session = None
+        newsletter.sources = None
+        sheet = main.Responses.from_columns(
+            {"Timestamp": ["10/05/2024 09:00:00", "25/05/2024 09:00:00", "28/05/2024 09:00:00", "20/06/2024 09:00:00"]}
+        )
+
+        past = newsletter.for_edition(4, sheet=sheet)
+
+        self.assertEqual(past.datetime_now.strftime("%Y-%m-%d"), "2024-06-01")
+        self.assertEqual(past.responses["Timestamp"], ["25/05/2024 09:00:00", "28/05/2024 09:00:00"])
+        self.assertIsNot(past.sources, newsletter.sources)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import smtplib
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import batch
+import main
+
+
+class ManifestTests(unittest.TestCase):
+    def _write(self, directory, manifest):
+        path = Path(directory) / "newsletters.json"
+        path.write_text(json.dumps(manifest), encoding="utf8")
+        return path
+
+    def test_entries_get_defaults_and_paths_next_to_the_manifest(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = self._write(temp_dir, {
+                "defaults": {"timezone": "Europe/London"},
+                "newsletters": [
+                    {"name": "flat", "sheet_id": "1", "sheet_name": "Form", "recipients": ["a@example.test"],
+                     "background_url": "https://example.test/cover.jpg",
+                     "templates": ["flat.html", "flat_spark.html"]},
+                    {"name": "uni", "sheet_id": "2", "sheet_name": "Form", "recipients": ["b@example.test"],
+                     "background_url": "https://example.test/cover.jpg", "frequency_unit": "day"},
+                ],
+            })
+            flat, uni = batch.load_manifest(path)
+
+            self.assertEqual(flat["timezone"], "Europe/London")
+            self.assertEqual(flat["frequency_unit"], "month")
+            self.assertEqual(uni["frequency_unit"], "day")
+            self.assertEqual(flat["log"], Path(temp_dir) / "log_flat.txt")
+            self.assertEqual(flat["templates"], (Path(temp_dir) / "flat.html", Path(temp_dir) / "flat_spark.html"))
+            self.assertNotIn("templates", uni)
+
+    def test_rejects_duplicate_names_and_missing_fields(self):
+        entry = {"name": "flat", "sheet_id": "1", "sheet_name": "Form", "recipients": [],
+                 "background_url": "https://example.test/cover.jpg"}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with self.assertRaisesRegex(ValueError, "unique"):
+                batch.load_manifest(self._write(temp_dir, {"newsletters": [entry, entry]}))
+            with self.assertRaisesRegex(ValueError, "sheet_id"):
+                batch.load_manifest(self._write(temp_dir, {"newsletters": [{"name": "flat"}]}))
+
+
+class BatchRunTests(unittest.TestCase):
+    def test_newsletters_share_resources_and_fail_independently(self):
+        entries = [
+            dict(batch.MANIFEST_DEFAULTS, name=name, sheet_id=name, sheet_name="Form", recipients=[],
+                 background_url="https://example.test/cover.jpg", log=Path(name + ".txt"))
+            for name in ("flat", "uni")
+        ]
+        built = []
+
+        def fake_newsletter(*args, **options):
+            newsletter = mock.Mock(sheet_id=args[8], **options)
+            built.append(newsletter)
+            return newsletter
+
+        def fake_send(newsletter, build_root):
+            if newsletter.sheet_id == "uni":
+                raise RuntimeError("sheet unavailable")
+
+        with mock.patch.object(batch, "Newsletter", side_effect=fake_newsletter), mock.patch.object(
+            batch, "ImageIndex"
+        ), mock.patch.object(batch, "ResponseHistory"), mock.patch.dict(batch.STAGES, {"send": fake_send}):
+            failures = batch.run("send", entries, build_root=Path("editions"))
+
+        self.assertEqual(list(failures), ["uni"])
+        first, second = sorted(built, key=lambda newsletter: newsletter.sheet_id)
+        for shared in ("session", "image_index", "asset_cache", "message_cache", "smtp_session"):
+            self.assertIs(getattr(first, shared), getattr(second, shared))
+        self.assertEqual(first.log_path, Path("flat.txt"))
+
+
+class SMTPSessionTests(unittest.TestCase):
+    def test_logs_in_once_and_reconnects_after_a_drop(self):
+        servers = [mock.Mock(), mock.Mock()]
+        with mock.patch.object(main.smtplib, "SMTP_SSL", side_effect=servers):
+            session = main.SMTPSession("sender@example.test", "password")
+            with session.connection() as first:
+                pass
+            with session.connection() as again:
+                pass
+            servers[0].noop.side_effect = smtplib.SMTPServerDisconnected()
+            with session.connection() as replaced:
+                pass
+            session.close()
+
+        self.assertIs(first, again)
+        self.assertIs(replaced, servers[1])
+        self.assertEqual(session.logins, 2)
+        servers[1].quit.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,540 @@
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+from unittest import mock
+
+import main
+import pipeline
+
+
+JPEG_BYTES = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00" + b"\x00" * 16
+
+
+class AssetCacheTests(unittest.TestCase):
+    def test_built_assets_are_reused_from_disk(self):
+        build = mock.Mock(return_value=b"encoded")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first = main.AssetCache(Path(temp_dir))
+            self.assertEqual(first.get_or_build(("jpeg", "url", 1.0), build), b"encoded")
+
+            second = main.AssetCache(Path(temp_dir))
+            self.assertEqual(second.get_or_build(("jpeg", "url", 1.0), build), b"encoded")
+            second.get_or_build(("jpeg", "url", 0.5), build)
+
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual((second.hits, second.misses), (1, 1))
+
+    def test_failed_builds_are_not_cached(self):
+        build = mock.Mock(return_value=None)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = main.AssetCache(Path(temp_dir))
+            cache.get_or_build(("jpeg", "url", 1.0), build)
+            cache.get_or_build(("jpeg", "url", 1.0), build)
+
+        self.assertEqual(build.call_count, 2)
+
+
+class PipelineTests(unittest.TestCase):
+    def _newsletter(self, cache):
+        newsletter = main.Newsletter.__new__(main.Newsletter)
+        newsletter.sender = "sender@example.test"
+        newsletter.password = "password"
+        newsletter.recipients = ["friend@example.test"]
+        newsletter.recipients_spark = ["spark@example.test"]
+        newsletter.background_url = "https://example.test/cover.jpg"
+        newsletter.max_image_byte = 1.0
+        newsletter.image_index = None
+        newsletter.asset_cache = cache
+        newsletter.message_cache = None
+        newsletter.batch_size = main.RECIPIENT_BATCH_SIZE
+        newsletter.send_interval = 0
+        newsletter.workers = 2
+        newsletter.near_duplicate_distance = None
+        newsletter.image_profile = main.SPARK_IMAGE_PROFILE
+        newsletter.log_path = None
+        newsletter.session = None
+        newsletter.frequency_unit = "month"
+        newsletter.datetime_now = main.datetime(2026, 8, 31)
+        newsletter.smtp_session = None
+        newsletter.html_sizes = {}
+        newsletter.incomplete_variants = set()
+        newsletter._content_keys = {}
+        newsletter._prefetched = {}
+        newsletter.sources = main.SourceImages(
+            lambda url: newsletter._fetch_source(url), key=lambda url: newsletter._content_key(url)
+        )
+        newsletter.responses = main.Responses.from_columns({"Your Name": ["Maya"]})
+        newsletter.email_content = "<p>standard</p>"
+        newsletter.email_content_spark = '<img src="cid:image0">'
+
+        def generate_newsletter(update_edition=True, edition=None):
+            newsletter.update_edition = update_edition
+            newsletter.edition = edition
+            newsletter.email_data = {
+                "subject": "Chatime Newsletter",
+                "date": newsletter.datetime_now,
+                "images": [],
+                "question_mode": "text",
+            }
+
+        newsletter.generate_newsletter = generate_newsletter
+        return newsletter
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = Path(self.temp_dir.name)
+        (self.base_dir / "log.txt").write_text("26", encoding="utf8")
+        self.build_root = self.base_dir / "editions"
+        patcher = mock.patch.object(main, "BASE_DIR", self.base_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def _log(self):
+        return (self.base_dir / "log.txt").read_text(encoding="utf8")
+
+    @staticmethod
+    def _drop_spark_connection(smtp_server, sender, recipients, path):
+        if "spark@example.test" in recipients:
+            raise OSError("connection dropped")
+        return {}
+
+    def test_send_reuses_assets_encoded_by_prepare(self):
+        cache_dir = self.base_dir / "assets"
+        prepared = self._newsletter(main.AssetCache(cache_dir))
+        with mock.patch.object(
+            main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES
+        ) as encode:
+            pipeline.prepare(prepared)
+        self.assertFalse(prepared.update_edition)
+        self.assertEqual(self._log(), "26")
+        encode.assert_called_once()
+
+        sending = self._newsletter(main.AssetCache(cache_dir))
+        with mock.patch.object(
+            main.Newsletter, "_encode_attachment", side_effect=AssertionError("re-encoded")
+        ), mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(main, "stream_message", return_value={}) as stream:
+            pipeline.send(sending, build_root=self.build_root)
+
+        self.assertEqual(sending.edition, 27)
+        self.assertEqual(self._log(), "27")
+        recipients = sorted(call.args[2] for call in stream.call_args_list)
+        self.assertEqual(
+            recipients,
+            [
+                ["sender@example.test", "friend@example.test"],
+                ["sender@example.test", "spark@example.test"],
+            ],
+        )
+
+    def test_failed_send_resumes_without_bumping_the_edition(self):
+        first = self._newsletter(None)
+        with mock.patch.object(main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES), mock.patch.object(
+            main.smtplib, "SMTP_SSL"
+        ), mock.patch.object(main, "stream_message", side_effect=self._drop_spark_connection):
+            with self.assertRaises(OSError):
+                pipeline.send(first, build_root=self.build_root)
+
+        status = pipeline.EditionBuild(self.build_root / "27", 27).status
+        self.assertEqual(status["variants"], {"standard": "sent", "spark": "built"})
+        spark_message = self.build_root / "27" / "spark.eml"
+
+        retry = self._newsletter(None)
+        retry.responses = main.Responses.from_columns({"Your Name": ["Changed"]})
+        with mock.patch.object(
+            main.Newsletter, "build_message", side_effect=AssertionError("rebuilt")
+        ), mock.patch.object(main.smtplib, "SMTP_SSL") as smtp, mock.patch.object(main, "stream_message", return_value={}) as stream:
+            pipeline.send(retry, build_root=self.build_root)
+
+        server = smtp.return_value.__enter__.return_value
+        stream.assert_called_once_with(
+            server,
+            "sender@example.test",
+            ["sender@example.test", "spark@example.test"],
+            spark_message,
+        )
+        self.assertEqual(self._log(), "27")
+        self.assertEqual(retry.edition, 27)
+        self.assertEqual(retry.responses["Your Name"], ["Maya"])
+        self.assertTrue(pipeline.EditionBuild(self.build_root / "27", 27).status["complete"])
+
+    def test_completed_edition_starts_a_new_build(self):
+        for _ in range(2):
+            with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+                main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES
+            ), mock.patch.object(main, "stream_message", return_value={}):
+                pipeline.send(self._newsletter(None), build_root=self.build_root)
+
+        self.assertEqual(self._log(), "28")
+        self.assertTrue((self.build_root / "28" / "standard.eml").exists())
+
+    def test_send_reuses_messages_serialized_by_prepare(self):
+        message_cache = main.AssetCache(self.base_dir / "messages", suffix=".eml")
+        prepared = self._newsletter(main.AssetCache(self.base_dir / "assets"))
+        prepared.message_cache = message_cache
+        with mock.patch.object(main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES):
+            pipeline.prepare(prepared)
+
+        sending = self._newsletter(None)
+        sending.message_cache = message_cache
+        with mock.patch.object(
+            main.Newsletter, "build_message", side_effect=AssertionError("rebuilt")
+        ), mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(main, "stream_message", return_value={}):
+            pipeline.send(sending, build_root=self.build_root)
+
+        standard = (self.build_root / "27" / "standard.eml").read_bytes()
+        self.assertEqual(standard, message_cache.get_or_build(sending.message_key(False), None))
+        self.assertIn(b"\r\n", standard)
+
+    def test_message_with_a_failed_attachment_is_not_stored(self):
+        message_cache = main.AssetCache(self.base_dir / "messages", suffix=".eml")
+        failing = self._newsletter(None)
+        failing.message_cache = message_cache
+        with mock.patch.object(main.Newsletter, "_encode_attachment", return_value=None), mock.patch.object(
+            main.smtplib, "SMTP_SSL"
+        ), mock.patch.object(main, "stream_message", return_value={}), mock.patch.object(
+            main.Newsletter, "send_message", autospec=True, return_value={}
+        ) as send:
+            pipeline.send(failing, build_root=self.build_root)
+
+        sent = {call.kwargs["spark"]: call.args[1] for call in send.call_args_list}
+        self.assertIsInstance(sent[True], bytes)
+        self.assertNotIn(b"<image0>", sent[True])
+        self.assertFalse(message_cache.path(failing.message_key(True)).exists())
+        self.assertFalse((self.build_root / "27" / "spark.eml").exists())
+        self.assertTrue(message_cache.path(failing.message_key(False)).exists())
+
+    def test_fresh_send_finds_the_message_prepared_with_duplicates(self):
+        message_cache = main.AssetCache(self.base_dir / "messages", suffix=".eml")
+        photos = [
+            ["https://drive.google.com/open?id=1first", "Maya", "Lunch"],
+            ["https://drive.google.com/open?id=1resubmitted", "Maya", "Lunch again"],
+        ]
+
+        def newsletter():
+            created = self._newsletter(None)
+            created.message_cache = message_cache
+            created.image_index = main.ImageIndex(self.base_dir / "image_index.json", self.base_dir / "images")
+            created.generate_newsletter()
+            created.email_data["images"] = photos
+            return created
+
+        photo = BytesIO()
+        main.Image.new("RGB", (40, 30), "teal").save(photo, format="JPEG")
+        prepared = newsletter()
+        key_before = prepared.message_key(spark=True)
+        with mock.patch.object(main, "download_image", side_effect=lambda url, **kwargs: BytesIO(photo.getvalue())), \
+                mock.patch.object(main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES):
+            prepared.prepare_assets()
+
+        self.assertEqual(prepared.message_key(spark=True), key_before)
+        self.assertTrue(message_cache.path(newsletter().message_key(spark=True)).exists())
+
+    def test_content_change_invalidates_the_stored_message(self):
+        newsletter = self._newsletter(None)
+        newsletter.generate_newsletter()
+        key = newsletter.message_key(spark=True)
+
+        newsletter.email_content_spark = '<img src="cid:image0"><p>late answer</p>'
+
+        self.assertNotEqual(newsletter.message_key(spark=True), key)
+
+    def test_message_key_does_not_download_images(self):
+        newsletter = self._newsletter(None)
+        newsletter.image_index = main.ImageIndex(self.base_dir / "image_index.json", self.base_dir / "images")
+        newsletter.generate_newsletter()
+        newsletter.email_data["images"] = [["https://drive.google.com/open?id=1photo", "Maya", "Lunch"]]
+
+        with mock.patch.object(main, "download_image", side_effect=AssertionError("downloaded")):
+            newsletter.message_key(spark=True)
+
+        self.assertEqual(newsletter._prefetched, {})
+
+    def test_failed_build_drops_prefetched_images(self):
+        newsletter = self._newsletter(None)
+        newsletter.image_index = main.ImageIndex(self.base_dir / "image_index.json", self.base_dir / "images")
+        newsletter.generate_newsletter()
+        newsletter.email_data["images"] = [["https://drive.google.com/open?id=1photo", "Maya", "Lunch"]]
+
+        with mock.patch.object(
+            newsletter, "_open_remote_image", return_value=main.Image.new("RGB", (40, 30), "teal")
+        ), mock.patch.object(main.Newsletter, "_encode_attachment", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                newsletter.build_messages()
+
+        self.assertEqual(newsletter._prefetched, {})
+
+    def test_resend_streams_the_stored_message_to_new_recipients(self):
+        with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+            main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES
+        ), mock.patch.object(main, "stream_message", return_value={}):
+            pipeline.send(self._newsletter(None), build_root=self.build_root)
+
+        with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(main, "stream_message", return_value={}) as stream:
+            pipeline.resend(self._newsletter(None), ["late@example.test"], build_root=self.build_root)
+
+        self.assertEqual(stream.call_args.args[2:], (["late@example.test"], self.build_root / "27" / "standard.eml"))
+
+    def test_recipients_are_sent_in_paced_batches(self):
+        newsletter = self._newsletter(None)
+        newsletter.recipients = ["a@example.test", "b@example.test", "c@example.test", "d@example.test"]
+        newsletter.batch_size = 2
+        newsletter.send_interval = 1.5
+        with mock.patch.object(main.smtplib, "SMTP_SSL") as smtp, mock.patch.object(main.time, "sleep") as sleep:
+            server = smtp.return_value.__enter__.return_value
+            server.sendmail.return_value = {}
+            results = newsletter.send_message(b"message")
+
+        batches = [call.args[1] for call in server.sendmail.call_args_list]
+        self.assertEqual(
+            batches,
+            [["sender@example.test", "a@example.test"], ["b@example.test", "c@example.test"], ["d@example.test"]],
+        )
+        self.assertEqual(sleep.call_args_list, [mock.call(1.5), mock.call(1.5)])
+        self.assertEqual(set(results.values()), {"sent"})
+        smtp.assert_called_once()
+
+    def test_deferred_batch_is_retried_on_its_own(self):
+        def newsletter():
+            created = self._newsletter(None)
+            created.recipients = ["a@example.test", "b@example.test", "gone@example.test"]
+            created.recipients_spark = []
+            created.batch_size = 2
+            return created
+
+        deferred = main.smtplib.SMTPDataError(451, b"try again later")
+        refused = {"gone@example.test": (550, b"no such user")}
+        with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+            main, "stream_message", side_effect=[{}, deferred]
+        ):
+            with self.assertRaises(SystemExit):
+                pipeline.send(newsletter(), build_root=self.build_root)
+
+        status = pipeline.EditionBuild(self.build_root / "27", 27).status
+        self.assertEqual(status["variants"], {"standard": "partial"})
+        self.assertTrue(status["recipients"]["standard"]["gone@example.test"].startswith("deferred 451"))
+
+        with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+            main, "stream_message", return_value=refused
+        ) as stream:
+            pipeline.send(newsletter(), build_root=self.build_root)
+
+        self.assertEqual(stream.call_args.args[2], ["b@example.test", "gone@example.test"])
+        status = pipeline.EditionBuild(self.build_root / "27", 27).status
+        self.assertTrue(status["complete"])
+        self.assertEqual(status["recipients"]["standard"]["a@example.test"], "sent")
+        self.assertEqual(status["recipients"]["standard"]["gone@example.test"], "refused 550 no such user")
+        self.assertEqual(self._log(), "27")
+
+    def test_lasting_deferral_gives_up_after_a_few_runs(self):
+        full = main.smtplib.SMTPDataError(452, b"mailbox full")
+        for attempt in range(pipeline.MAX_DEFERRED_ATTEMPTS):
+            newsletter = self._newsletter(None)
+            newsletter.recipients_spark = []
+            with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+                main, "stream_message", side_effect=full
+            ):
+                if attempt < pipeline.MAX_DEFERRED_ATTEMPTS - 1:
+                    with self.assertRaises(SystemExit):
+                        pipeline.send(newsletter, build_root=self.build_root)
+                else:
+                    pipeline.send(newsletter, build_root=self.build_root)
+
+        status = pipeline.EditionBuild(self.build_root / "27", 27).status
+        self.assertTrue(status["complete"])
+        self.assertTrue(
+            status["recipients"]["standard"]["friend@example.test"].startswith("undelivered after 3 attempts: deferred 452")
+        )
+        self.assertEqual(self._log(), "27")
+
+    def test_unfinished_build_from_an_earlier_window_is_abandoned(self):
+        stale = self._newsletter(None)
+        stale.datetime_now = main.datetime(2026, 7, 31)
+        with mock.patch.object(main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES), mock.patch.object(
+            main.smtplib, "SMTP_SSL"
+        ), mock.patch.object(main, "stream_message", side_effect=self._drop_spark_connection):
+            with self.assertRaises(OSError):
+                pipeline.send(stale, build_root=self.build_root)
+        self.assertEqual(pipeline.EditionBuild(self.build_root / "27", 27).status["date"], "2026-07-31")
+
+        current = self._newsletter(None)
+        with mock.patch.object(main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES), mock.patch.object(
+            main.smtplib, "SMTP_SSL"
+        ), mock.patch.object(main, "stream_message", return_value={}):
+            pipeline.send(current, build_root=self.build_root)
+
+        self.assertEqual(current.edition, 28)
+        self.assertEqual(self._log(), "28")
+        self.assertTrue(pipeline.EditionBuild(self.build_root / "27", 27).status["abandoned"])
+        self.assertTrue(pipeline.EditionBuild(self.build_root / "28", 28).status["complete"])
+
+    def test_image_index_is_saved_when_delivery_fails(self):
+        newsletter = self._newsletter(None)
+        newsletter.image_index = main.ImageIndex(self.base_dir / "image_index.json", self.base_dir / "images")
+        deferred = main.smtplib.SMTPDataError(451, b"try again later")
+        with mock.patch.object(main.smtplib, "SMTP_SSL"), mock.patch.object(
+            main.Newsletter, "_encode_attachment", return_value=JPEG_BYTES
+        ), mock.patch.object(
+            main.Newsletter, "_open_remote_image", return_value=main.Image.new("RGB", (40, 30), "teal")
+        ), mock.patch.object(main, "stream_message", side_effect=deferred):
+            with self.assertRaises(SystemExit):
+                pipeline.send(newsletter, build_root=self.build_root)
+
+        self.assertTrue((self.base_dir / "image_index.json").exists())
+
+    def test_variants_share_decoded_source_images(self):
+        newsletter = self._newsletter(None)
+        newsletter.generate_newsletter()
+        newsletter.email_data.update(
+            question_mode="diyl_gif",
+            question_answers=[("Maya", "questiongif0", "Morning", ["https://example.test/a.jpg", "https://example.test/b.jpg"])],
+            images=[["https://example.test/photo.jpg", "Maya", "Lunch"]],
+        )
+        opened = []
+
+        def open_remote_image(url):
+            opened.append(url)
+            return main.Image.new("RGB", (40, 30), "teal")
+
+        with mock.patch.object(newsletter, "_open_remote_image", side_effect=open_remote_image):
+            messages = newsletter.build_messages()
+
+        self.assertEqual(
+            sorted(opened),
+            [
+                "https://example.test/a.jpg",
+                "https://example.test/b.jpg",
+                "https://example.test/cover.jpg",
+                "https://example.test/photo.jpg",
+            ],
+        )
+        content_ids = [part["Content-ID"] for part in messages[True].get_payload() if part["Content-ID"]]
+        self.assertEqual(content_ids, ["<questiongif0>", "<image0>", "<image1>"])
+        self.assertEqual([part["Content-ID"] for part in messages[False].get_payload()][0], "<questiongif0>")
+        self.assertEqual(newsletter.sources._images, {})
+
+    def test_repeated_photos_are_downloaded_encoded_and_attached_once(self):
+        newsletter = self._newsletter(None)
+        newsletter.image_index = main.ImageIndex(self.base_dir / "image_index.json", self.base_dir / "images")
+        newsletter.generate_newsletter()
+        first = "https://drive.google.com/open?id=1first"
+        resubmitted = "https://drive.google.com/open?id=1resubmitted"
+        newsletter.email_data["images"] = [[first, "Maya", "Lunch"], [resubmitted, "Maya", "Lunch again"]]
+        newsletter.email_content_spark = '<img src="cid:image0"><img src="cid:image1"><img src="cid:image2">'
+        photo = BytesIO()
+        main.Image.new("RGB", (40, 30), "teal").save(photo, format="JPEG")
+        cover = BytesIO()
+        main.Image.new("RGB", (40, 30), "navy").save(cover, format="JPEG")
+        downloads = []
+
+        def download_image(url, **kwargs):
+            downloads.append(url)
+            return BytesIO((cover if "cover" in url else photo).getvalue())
+
+        with mock.patch.object(main, "download_image", side_effect=download_image), mock.patch.object(
+            main.Newsletter, "_encode_attachment", autospec=True, side_effect=lambda self, url, budget: JPEG_BYTES
+        ) as encode:
+            message = newsletter.build_message(spark=True)
+
+        self.assertEqual(len(downloads), 3)
+        self.assertEqual(encode.call_count, 2)
+        parts = message.get_payload()
+        self.assertEqual([part["Content-ID"] for part in parts[:-1]], ["<image0>", "<image1>"])
+        self.assertEqual(
+            parts[-1].get_payload(decode=True).decode("utf8"),
+            '<img src="cid:image0"><img src="cid:image1"><img src="cid:image1">',
+        )
+        self.assertAlmostEqual(newsletter._spark_budget_mb(), 25.0 * 0.72 / 2)
+        # Only the form photos get a reminder derivative, not the cover.
+        self.assertEqual(
+            sorted(path.name for path in (self.base_dir / "images").iterdir()), ["1first.jpg", "1resubmitted.jpg"]
+        )
+
+    def test_message_is_addressed_from_the_configured_sender(self):
+        newsletter = self._newsletter(None)
+        newsletter.generate_newsletter()
+
+        msg = newsletter.build_message()
+
+        self.assertEqual(msg["From"], "sender@example.test")
+
+
+class SourceImagesTests(unittest.TestCase):
+    def test_unannounced_images_are_not_kept(self):
+        open_image = mock.Mock(side_effect=lambda url: main.Image.new("RGB", (2, 2)))
+        sources = main.SourceImages(open_image)
+
+        sources.get("https://example.test/a.jpg")
+        sources.get("https://example.test/a.jpg")
+
+        self.assertEqual(open_image.call_count, 2)
+
+    def test_announced_image_is_dropped_after_last_release(self):
+        open_image = mock.Mock(side_effect=lambda url: main.Image.new("RGB", (2, 2)))
+        sources = main.SourceImages(open_image)
+        sources.expect(["https://example.test/a.jpg"])
+        sources.expect(["https://example.test/a.jpg"])
+
+        first = sources.get("https://example.test/a.jpg")
+        sources.release(["https://example.test/a.jpg"])
+        self.assertIs(sources.get("https://example.test/a.jpg"), first)
+        sources.release(["https://example.test/a.jpg"])
+
+        self.assertEqual(open_image.call_count, 1)
+        self.assertEqual(sources._images, {})
+
+
+class FakeSMTP:
+    def __init__(self, data_code=250):
+        self.data_code = data_code
+        self.commands = []
+        self.sent = b""
+
+    def mail(self, sender):
+        self.commands.append(("mail", sender))
+        return 250, b"ok"
+
+    def rcpt(self, recipient):
+        self.commands.append(("rcpt", recipient))
+        return (550, b"unknown") if recipient.startswith("gone") else (250, b"ok")
+
+    def docmd(self, command):
+        self.commands.append((command,))
+        return 354, b"go ahead"
+
+    def send(self, data):
+        self.sent += data
+
+    def getreply(self):
+        return self.data_code, b"queued"
+
+    def rset(self):
+        self.commands.append(("rset",))
+
+
+class StreamMessageTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = Path(self.temp_dir.name) / "message.eml"
+        self.path.write_bytes(b"Subject: hi\r\n\r\n.leading dot\nbare newline\r\n")
+
+    def test_message_is_dot_stuffed_and_terminated(self):
+        server = FakeSMTP()
+
+        refused = main.stream_message(server, "me@example.test", ["a@example.test", "gone@example.test"], self.path, chunk_size=8)
+
+        self.assertEqual(server.sent, b"Subject: hi\r\n\r\n..leading dot\r\nbare newline\r\n.\r\n")
+        self.assertEqual(list(refused), ["gone@example.test"])
+
+    def test_rejected_data_raises(self):
+        server = FakeSMTP(data_code=552)
+
+        with self.assertRaises(main.smtplib.SMTPDataError):
+            main.stream_message(server, "me@example.test", ["a@example.test"], self.path)
+        self.assertEqual(server.commands[-1], ("rset",))
+
+
+if __name__ == "__main__":
+    unittest.main()
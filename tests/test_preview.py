@@ -1,5 +1,7 @@
 import os
 import re
+import subprocess
+import sys
 import tempfile
 import threading
 import unittest
@@ -11,8 +13,18 @@ from unittest import mock
 from urllib.error import HTTPError
 from urllib.request import Request, urlopen
 
+from markupsafe import Markup
+
 import main
 import preview
+import startup_benchmark
+
+
+def _drive_response(content, content_type):
+    response = mock.MagicMock(headers={"Content-Type": content_type})
+    response.__enter__.return_value = response
+    response.iter_content.return_value = [content]
+    return response
 
 
 class EditionNumberTests(unittest.TestCase):
@@ -50,6 +62,33 @@ class EditionNumberTests(unittest.TestCase):
 
             self.assertEqual(log_path.read_text(encoding="utf8"), "27")
 
+    def test_newsletters_can_keep_their_own_log(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_path = Path(temp_dir) / "log_flat.txt"
+            log_path.write_text("4", encoding="utf8")
+
+            self.assertEqual(main.edition_number(log_path=log_path), 5)
+
+            self.assertEqual(log_path.read_text(encoding="utf8"), "5")
+            self.assertFalse((Path(temp_dir) / "log.txt").exists())
+
+
+class TemplateCacheTests(unittest.TestCase):
+    def test_templates_compile_once_until_edited(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "template.html"
+            path.write_text("<p>{{ subject }}</p>", encoding="utf8")
+
+            first = main.load_template(path)
+            self.assertIs(main.load_template(path), first)
+
+            path.write_text("<h1>{{ subject }}</h1>", encoding="utf8")
+            os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+            edited = main.load_template(path)
+
+        self.assertIsNot(edited, first)
+        self.assertEqual(edited.render(subject="Hi"), "<h1>Hi</h1>")
+
 
 class NewsletterDataFilterTests(unittest.TestCase):
     def test_sheet_dates_are_parsed_day_first(self):
@@ -60,7 +99,7 @@ class NewsletterDataFilterTests(unittest.TestCase):
             def now(cls, tz):
                 return fixed_now.astimezone(tz)
 
-        responses = main.pd.DataFrame(
+        responses = main.Responses.from_columns(
             {
                 "Timestamp": [
                     "01/08/2026 12:00:00",
@@ -69,8 +108,8 @@ class NewsletterDataFilterTests(unittest.TestCase):
             }
         )
         with mock.patch.object(main, "datetime", FixedDatetime), mock.patch.object(
-            main.pd,
-            "read_csv",
+            main,
+            "read_responses",
             return_value=responses,
         ):
             newsletter = main.Newsletter(
@@ -88,11 +127,260 @@ class NewsletterDataFilterTests(unittest.TestCase):
             )
 
         self.assertEqual(
-            newsletter.data_df["Timestamp"].tolist(),
+            newsletter.responses["Timestamp"],
             ["01/08/2026 12:00:00"],
         )
 
 
+class ResponseHistoryTests(unittest.TestCase):
+    def _sheet(self, life_update="New job"):
+        return main.Responses.from_columns(
+            {
+                "Timestamp": ["20/08/2025 10:00:00", "25/08/2025 18:30:00", "20/08/2026 09:00:00"],
+                "Your Name": ["Maya", "Sam", "Maya"],
+                "✨ Any life updates?": [life_update, "Moved flats", "Back at uni"],
+                "😋 Food spot of the month?": ["Dumpling House", "", "Dumpling House again"],
+            }
+        )
+
+    def test_only_new_or_edited_rows_are_written(self):
+        history = main.ResponseHistory(":memory:")
+
+        self.assertEqual(history.ingest(self._sheet()), 3)
+        self.assertEqual(history.ingest(self._sheet()), 0)
+        self.assertEqual(history.ingest(self._sheet(life_update="New job in Wellington")), 1)
+
+        self.assertEqual(
+            history.answers_by("Maya", question="✨ Any life updates?"),
+            [("2025-08-20", "✨ Any life updates?", "New job in Wellington"), ("2026-08-20", "✨ Any life updates?", "Back at uni")],
+        )
+        self.assertEqual(
+            history.answers_to("😋 Food spot of the month?", until=main.date(2025, 12, 31)),
+            [("2025-08-20", "Maya", "Dumpling House")],
+        )
+        self.assertEqual(
+            [row[:2] for row in history.search("dumpling")],
+            [("2026-08-20", "Maya"), ("2025-08-20", "Maya")],
+        )
+        self.assertEqual(history.search("Wellington")[0][3], "New job in Wellington")
+
+    def test_newsletter_shows_answers_from_a_year_ago(self):
+        history = main.ResponseHistory(":memory:")
+        history.ingest(self._sheet())
+        newsletter = main.Newsletter.__new__(main.Newsletter)
+        newsletter.history = history
+        newsletter.frequency_unit = "month"
+        newsletter.datetime_now = datetime(2026, 8, 31, 12, 0, tzinfo=timezone.utc)
+
+        self.assertEqual(newsletter._on_this_day(), [("Maya", "New job"), ("Sam", "Moved flats")])
+
+    def test_copy_reads_the_history_without_writing_to_it(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "history.sqlite3"
+            stored = main.ResponseHistory(path)
+            stored.ingest(self._sheet())
+            stored.close()
+            before = path.read_bytes()
+
+            copy = main.ResponseHistory.copy_of(path)
+            written = copy.ingest(self._sheet(life_update="New job in Wellington"))
+            copy.close()
+
+            self.assertEqual(path.read_bytes(), before)
+        self.assertEqual(written, 1)
+        self.assertEqual(copy.path, Path(":memory:"))
+
+    def test_preview_newsletter_gets_a_copy_of_the_history(self):
+        config = preview.PreviewConfig(sheet_id="sheet-id", sheet_name="Form Responses 1", background_url="")
+        history = main.ResponseHistory(":memory:")
+        with mock.patch.object(main.ResponseHistory, "copy_of", return_value=history) as copy_of, mock.patch.object(
+            preview, "PreviewNewsletter"
+        ) as newsletter:
+            preview.open_newsletter(config)
+
+        copy_of.assert_called_once_with()
+        self.assertIs(newsletter.call_args.kwargs["history"], history)
+
+
+class ResponsesTests(unittest.TestCase):
+    SHEET = (
+        "\ufeffTimestamp,Your Name,Question of the month?,Your Name,Year?\r\n"
+        '01/08/2026 12:00:00,Maya,"Line one\nline, two",again,2024\r\n'
+        "02/08/2026 09:30:00,Sam,,,\r\n"
+    )
+
+    def _backends(self):
+        backends = ["csv"]
+        try:
+            import pandas  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            backends.append("pandas")
+        return backends
+
+    def test_backends_read_the_same_responses(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "responses.csv"
+            path.write_text(self.SHEET, encoding="utf8")
+            for backend in self._backends():
+                with self.subTest(backend=backend):
+                    responses = main.read_responses(path, backend=backend)
+
+                    self.assertEqual(
+                        responses.columns,
+                        ["Timestamp", "Your Name", "Question of the month?", "Your Name.1", "Year?"],
+                    )
+                    self.assertEqual(len(responses), 2)
+                    self.assertEqual(responses["Question of the month?"], ["Line one\nline, two", ""])
+                    self.assertEqual(responses["Your Name.1"], ["again", ""])
+                    self.assertEqual(responses["Year?"], ["2024", ""])
+
+    def test_backends_fetch_urls_through_the_session(self):
+        session = mock.Mock()
+        session.get.return_value = SimpleNamespace(content=self.SHEET.encode("utf8"), raise_for_status=mock.Mock())
+        for backend in self._backends():
+            with self.subTest(backend=backend):
+                responses = main.read_responses("https://example.test/sheet.csv", backend=backend, session=session)
+
+                self.assertEqual(responses["Your Name"], ["Maya", "Sam"])
+        self.assertEqual(session.get.call_count, len(self._backends()))
+
+    def test_saved_responses_round_trip(self):
+        responses = main.Responses.from_columns({"Your Name": ["Maya", "Sam"], "Answer": ['She said "hi"', ""]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "responses.csv"
+            responses.to_csv(path)
+            restored = main.read_responses(path, backend="csv")
+
+        self.assertEqual(restored.columns, ["Your Name", "Answer"])
+        self.assertEqual(restored["Answer"], ['She said "hi"', ""])
+        self.assertEqual(restored.where([False, True])["Your Name"], ["Sam"])
+
+    def test_line_separators_inside_answers_survive_a_round_trip(self):
+        answer = "first\u2028second\x85third\x0cfourth\r\nfifth"
+        responses = main.Responses.from_columns({"Your Name": ["Maya"], "Answer": [answer]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "responses.csv"
+            responses.to_csv(path)
+            restored = main.read_responses(path, backend="csv")
+
+        self.assertEqual(len(restored), 1)
+        self.assertEqual(restored["Answer"], [answer])
+
+    def test_timestamps_are_read_day_first(self):
+        self.assertEqual(main.response_date("01/08/2026 12:00:00"), main.date(2026, 8, 1))
+        self.assertEqual(main.response_date("2/8/2026 9:05"), main.date(2026, 8, 2))
+        self.assertIsNone(main.response_date(""))
+
+
+class EmailHtmlOptimizerTests(unittest.TestCase):
+    PAGE = (
+        "<html>\n<head>\n<style>\n  p { color : red ; }\n</style>\n</head>\n<body>\n"
+        "    <!-- layout -->\n    <!--[if mso]><table><![endif]-->\n"
+        '    <p class="card" style="margin:0;  color:#000000;">Ana</p>\n'
+        '    <p style="margin:0; color:#000000">Ben:  a\u00a0b</p>\n'
+        '    <div style="display:none">preheader</div>\n'
+        "    <pre>keep\n  this</pre>\n</body>\n</html>"
+    )
+
+    def test_standard_variant_is_minified_and_hoists_repeated_styles(self):
+        html, before, after = main.optimize_email_html(self.PAGE, "standard")
+
+        self.assertIn("<style>p{color:red}</style><style>.hs0{margin:0;color:#000000}</style>", html)
+        self.assertIn('<p class="card hs0">Ana</p><p class="hs0">Ben: a\u00a0b</p>', html)
+        self.assertIn('<div style="display:none">preheader</div>', html)
+        self.assertIn("<!--[if mso]><table><![endif]-->", html)
+        self.assertIn("<pre>keep\n  this</pre>", html)
+        self.assertNotIn("layout", html)
+        self.assertEqual((before, after), (len(self.PAGE.encode("utf8")), len(html.encode("utf8"))))
+
+    def test_spark_variant_keeps_styles_inline(self):
+        html, _, _ = main.optimize_email_html(self.PAGE, "spark")
+
+        self.assertNotIn("hs0", html)
+        self.assertIn('<p class="card" style="margin:0;color:#000000">Ana</p>', html)
+
+    def test_clipped_email_warns_or_fails(self):
+        page = "<p>{}</p>".format("x" * main.GMAIL_CLIP_BYTES)
+        with mock.patch("builtins.print") as printed:
+            main.optimize_email_html(page, "spark")
+        self.assertIn("Gmail clips", printed.call_args[0][0])
+        with self.assertRaises(main.EmailTooLargeError):
+            main.optimize_email_html(page, "spark", policy="fail")
+
+
+class NewsletterSectionTests(unittest.TestCase):
+    def _responses(self, life_update):
+        today = datetime.now(timezone.utc).strftime("%d/%m/%Y 12:00:00")
+        row = {
+            "Timestamp": today,
+            "Your Name": "Maya",
+            "Question of the month?": "Answer",
+            "☀️ One Good Thing!": "Good",
+            "✨ Any life updates?": life_update,
+            "😋 Food spot of the month?": "",
+            "🤫 Any interesting, funny, or embarrassing moments?": "",
+        }
+        for i in range(1, 4):
+            row["Image {}".format(i)] = ""
+            row["Caption {}".format(i)] = ""
+        row["Image 1"] = "https://drive.google.com/open?id=1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"
+        return main.Responses(row, [list(row.values())])
+
+    def test_only_changed_sections_are_rebuilt(self):
+        with mock.patch.object(
+            main, "read_responses", return_value=self._responses("Moved house")
+        ), mock.patch.object(main, "edition_number", return_value=27):
+            newsletter = main.Newsletter(
+                "2024/03/01",
+                "month",
+                1,
+                "Pacific/Auckland",
+                sender=None,
+                recipients=[],
+                recipients_spark=[],
+                password=None,
+                sheet_id="sheet-id",
+                sheet_name="Form Responses 1",
+                background_url="https://example.test/cover.jpg",
+            )
+            newsletter.generate_newsletter(update_edition=False)
+            first_images = newsletter.email_data["images"]
+            self.assertIn("images", newsletter.changed_sections)
+
+        with mock.patch.object(
+            main, "read_responses", return_value=self._responses("New job")
+        ), mock.patch.object(
+            main, "edition_number", return_value=27
+        ), mock.patch.object(
+            newsletter, "_build_images", side_effect=AssertionError("rebuilt")
+        ):
+            newsletter.load_responses()
+            newsletter.generate_newsletter(update_edition=False)
+
+        self.assertEqual(newsletter.changed_sections, {"life_updates"})
+        self.assertIs(newsletter.email_data["images"], first_images)
+        self.assertEqual(
+            newsletter.email_data["life_updates"], [("Maya", "New job")]
+        )
+        self.assertIn("New job", newsletter.email_content)
+
+        with mock.patch.object(
+            main, "read_responses", return_value=self._responses("Back at uni")
+        ), mock.patch.object(main, "edition_number", return_value=27):
+            fresh = newsletter.reloaded()
+            fresh.generate_newsletter(update_edition=False)
+
+        self.assertEqual(fresh.changed_sections, {"life_updates"})
+        self.assertIs(fresh.email_data["images"], first_images)
+        self.assertIn("Back at uni", fresh.email_content)
+        # The reload never shows through the newsletter it started from.
+        self.assertEqual(newsletter.changed_sections, {"life_updates"})
+        self.assertIn("New job", newsletter.email_content)
+        self.assertEqual(newsletter.email_data["life_updates"], [("Maya", "New job")])
+
+
 class PreviewRenderingTests(unittest.TestCase):
     def _template_context(self):
         return {
@@ -106,6 +394,7 @@ class PreviewRenderingTests(unittest.TestCase):
             "one_good_thing": [("Good Name", "Good Answer")],
             "food_spot": [("Food Name", "Food Answer")],
             "confessions": [("Confession Name", "Confession Answer")],
+            "on_this_day": [("Year Ago Name", "Year Ago Answer")],
             "images": [
                 ["https://example.test/photo-a.jpg", "Photo Name A", "Photo Caption A"],
                 ["https://example.test/photo-b.jpg", "Photo Name B", "Photo Caption B"],
@@ -160,6 +449,7 @@ class PreviewRenderingTests(unittest.TestCase):
             "Good Answer",
             "Food Answer",
             "Confession Answer",
+            "Year Ago Answer",
             "Photo Name A",
             "Photo Caption B",
             "Issue No. 98765",
@@ -192,8 +482,9 @@ class PreviewRenderingTests(unittest.TestCase):
             spark_sources,
             ["cid:image0", "cid:image1", "cid:image2"],
         )
+        # The standard variant's cards also carry their hoisted style class.
         self.assertEqual(
-            rendered["standard"].count('class="photo-card"'),
+            len(re.findall(r'class="photo-card[ "]', rendered["standard"])),
             2,
         )
         self.assertEqual(
@@ -201,6 +492,30 @@ class PreviewRenderingTests(unittest.TestCase):
             2,
         )
 
+    def test_card_fragments_are_shared_between_variants(self):
+        renderer = main.CardRenderer(
+            (main.BASE_DIR / "cards.html").read_text(encoding="utf8")
+        )
+        with mock.patch.object(main, "card_renderer", return_value=renderer):
+            first = self._render_live_templates()
+            misses = renderer.misses
+            second = self._render_live_templates()
+
+        # Answer cards are identical in both variants; only photo cards differ.
+        self.assertEqual(misses, 7 + 2 * 2)
+        self.assertEqual(renderer.misses, misses)
+        self.assertEqual(first, second)
+
+    def test_card_cache_keeps_escaped_and_raw_input_apart(self):
+        renderer = main.CardRenderer(
+            (main.BASE_DIR / "cards.html").read_text(encoding="utf8")
+        )
+        raw = renderer.render("answer_card", "Name", "<b>")
+        escaped = renderer.render("answer_card", "Name", Markup("<b>"))
+
+        self.assertIn("&lt;b&gt;", raw)
+        self.assertIn(": <b>", escaped)
+
     def test_question_names_and_responses_share_one_line(self):
         rendered = self._render_live_templates()
 
@@ -304,6 +619,28 @@ class PreviewRenderingTests(unittest.TestCase):
         self.assertIn('src="/image/{}"'.format(drive_id), result)
         self.assertNotIn("drive.google.com", result)
 
+    def test_image_references_are_rewritten_in_one_pass(self):
+        drive_id = "1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"
+        rendered = (
+            '<img src="cid:image0"><img src="cid:image1">'
+            '<img src="https://drive.google.com/open?id={}">'
+            '<a href="cid:unknown">'
+        ).format(drive_id)
+        cid_sources = {
+            "image0": "https://drive.google.com/uc?export=view&id=" + drive_id,
+            "image1": "https://example.test/photo.jpg?a=1&b=2",
+        }
+
+        with mock.patch.object(
+            preview.re, "sub", side_effect=AssertionError("extra scan")
+        ):
+            result = preview._rewrite_image_references(rendered, cid_sources)
+
+        self.assertEqual(result.count('src="/image/{}"'.format(drive_id)), 2)
+        self.assertIn('src="https://example.test/photo.jpg?a=1&amp;b=2"', result)
+        self.assertIn('href="{}"'.format(preview.PLACEHOLDER_IMAGE), result)
+        self.assertNotIn("cid:", result)
+
     def test_drive_image_fetch_is_cached(self):
         config = preview.PreviewConfig(
             sheet_id="sheet-id",
@@ -311,14 +648,10 @@ class PreviewRenderingTests(unittest.TestCase):
             background_url="https://example.test/cover.jpg",
         )
         state = preview.PreviewState(config)
-        response = SimpleNamespace(
-            content=b"jpeg-bytes",
-            headers={"Content-Type": "image/jpeg; charset=binary"},
-            raise_for_status=mock.Mock(),
-        )
+        response = _drive_response(b"jpeg-bytes", "image/jpeg; charset=binary")
         drive_id = "1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"
 
-        with mock.patch.object(preview.requests, "get", return_value=response) as get:
+        with mock.patch.object(main.requests, "get", return_value=response) as get:
             first = state.get_image(drive_id)
             second = state.get_image(drive_id)
 
@@ -326,6 +659,59 @@ class PreviewRenderingTests(unittest.TestCase):
         self.assertEqual(second, first)
         get.assert_called_once()
 
+    def test_state_counts_drive_fetches_made_while_building_gifs(self):
+        config = preview.PreviewConfig(
+            sheet_id="sheet-id",
+            sheet_name="Form Responses 1",
+            background_url="https://example.test/cover.jpg",
+        )
+        state = preview.PreviewState(config)
+        photo = _drive_response(b"not-an-image", "image/jpeg")
+        missing = mock.MagicMock()
+        missing.__enter__.return_value.raise_for_status.side_effect = OSError("404")
+
+        with mock.patch.object(main.requests, "get", side_effect=[photo, missing, missing, missing]):
+            self.assertIsNone(main.open_remote_image("https://drive.google.com/open?id=abc"))
+        body = state.metrics.render()
+
+        self.assertIn("preview_drive_fetch_seconds_count 4\n", body)
+        self.assertIn('preview_drive_fetch_errors_total{error="OSError"} 3', body)
+
+    def test_state_records_image_cache_drive_and_build_metrics(self):
+        config = preview.PreviewConfig(
+            sheet_id="sheet-id",
+            sheet_name="Form Responses 1",
+            background_url="https://example.test/cover.jpg",
+        )
+        state = preview.PreviewState(config)
+        image = _drive_response(b"jpeg-bytes", "image/jpeg")
+        page = _drive_response(b"<html>", "text/html")
+        newsletter = SimpleNamespace(email_data={"question_mode": "text"}, generate_newsletter=mock.Mock())
+        snapshot = SimpleNamespace(standard_html="a", spark_html="b")
+
+        with mock.patch.object(main.requests, "get", side_effect=[image, page]):
+            state.get_image("1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF")
+            state.get_image("1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF")
+            with self.assertRaises(ValueError):
+                state.get_image("1IUrWCdUdtwRD91bcKb5qdugiyzXZWHa4")
+        with mock.patch.object(preview, "open_newsletter", return_value=newsletter), mock.patch.object(
+            preview, "render_snapshot", return_value=snapshot
+        ):
+            state.get_snapshot()
+        body = state.metrics.render()
+        newsletter.generate_newsletter.assert_called_once_with(update_edition=False)
+
+        self.assertIn('preview_image_cache_requests_total{result="hit"} 1', body)
+        self.assertIn('preview_image_cache_requests_total{result="miss"} 2', body)
+        self.assertIn("preview_image_cache_hit_ratio 0.333", body)
+        self.assertIn("preview_image_cache_entries 1\n", body)
+        self.assertIn("preview_image_cache_bytes 10\n", body)
+        self.assertIn("preview_drive_fetch_seconds_count 2\n", body)
+        self.assertIn('preview_drive_fetch_errors_total{error="ValueError"} 1', body)
+        for stage in ("sheet", "data", "gifs", "render"):
+            self.assertIn('preview_snapshot_build_seconds_count{{stage="{}"}} 1'.format(stage), body)
+        self.assertRegex(body, r"preview_snapshot_age_seconds \d")
+
     def test_diyl_gif_is_generated_in_memory(self):
         newsletter = SimpleNamespace(
             email_data={
@@ -341,6 +727,15 @@ class PreviewRenderingTests(unittest.TestCase):
         self.assertTrue(result["questiongif0"].startswith("data:image/gif;base64,"))
         newsletter._make_gif_bytes.assert_called_once()
 
+    def test_preview_newsletter_refuses_to_send(self):
+        newsletter = preview.PreviewNewsletter.__new__(preview.PreviewNewsletter)
+        with mock.patch.object(main.smtplib, "SMTP_SSL") as smtp:
+            for send in (newsletter.send_email, lambda: newsletter.send_message(b"message")):
+                with self.assertRaises(RuntimeError):
+                    send()
+
+        smtp.assert_not_called()
+
     def test_build_snapshot_has_no_send_path_and_uses_read_only_edition(self):
         calls = []
 
@@ -348,7 +743,7 @@ class PreviewRenderingTests(unittest.TestCase):
             def __init__(self, *args, **kwargs):
                 self.background_url = kwargs["background_url"]
                 self.datetime_now = datetime(2026, 8, 1, tzinfo=timezone.utc)
-                self.data_df = SimpleNamespace(index=[0, 1])
+                self.responses = main.Responses(["Your Name"], [["A"], ["B"]])
 
             def generate_newsletter(self, update_edition=True):
                 calls.append(update_edition)
@@ -388,6 +783,196 @@ class PreviewRenderingTests(unittest.TestCase):
         self.assertNotIn("cid:", snapshot.spark_html)
 
 
+class PreviewWatchTests(unittest.TestCase):
+    def _state_with_fake_newsletter(self, rendered):
+        config = preview.PreviewConfig(
+            sheet_id="sheet-id",
+            sheet_name="Form Responses 1",
+            background_url="https://example.test/cover.jpg",
+        )
+        newsletter = SimpleNamespace(
+            background_url=config.background_url,
+            datetime_now=datetime(2026, 8, 1, tzinfo=timezone.utc),
+            responses=main.Responses(["Your Name"], [["A"]]),
+            email_data={
+                "edition_number": 27,
+                "images": [],
+                "question_mode": "text",
+                "question_answers": [],
+            },
+            generate_newsletter=mock.Mock(),
+        )
+        state = preview.PreviewState(config)
+        patches = (
+            mock.patch.object(
+                preview, "open_newsletter", return_value=newsletter
+            ),
+            mock.patch.object(
+                preview, "_render_templates", side_effect=rendered
+            ),
+        )
+        return state, patches
+
+    def test_template_change_rerenders_without_reloading_sheet(self):
+        rendered = [
+            {"standard": "<p>one</p>", "spark": "<p>one</p>"},
+            {"standard": "<p>two</p>", "spark": "<p>two</p>"},
+            {"standard": "<p>two</p>", "spark": "<p>two</p>"},
+        ]
+        state, (load_patch, render_patch) = self._state_with_fake_newsletter(
+            rendered
+        )
+
+        with load_patch as load, render_patch:
+            state.get_snapshot()
+            first_version = state.version
+            self.assertTrue(state.rerender())
+            self.assertFalse(state.rerender())
+
+        load.assert_called_once()
+        self.assertEqual(state.version, first_version + 1)
+        self.assertEqual(state.get_snapshot().standard_html, "<p>two</p>")
+
+    def test_sheet_poll_swaps_in_a_new_newsletter(self):
+        rendered = [
+            {"standard": "<p>one</p>", "spark": "<p>one</p>"},
+            {"standard": "<p>two</p>", "spark": "<p>two</p>"},
+        ]
+        state, (load_patch, render_patch) = self._state_with_fake_newsletter(
+            rendered
+        )
+        with load_patch, render_patch:
+            state.get_snapshot()
+            live = state._newsletter
+            fresh = SimpleNamespace(**vars(live))
+            fresh.generate_newsletter = mock.Mock()
+            live.reloaded = mock.Mock(return_value=fresh)
+            live.generate_newsletter.reset_mock()
+
+            self.assertTrue(state.poll_sheet())
+
+        live.generate_newsletter.assert_not_called()
+        fresh.generate_newsletter.assert_called_once_with(update_edition=False)
+        self.assertIs(state._newsletter, fresh)
+        self.assertEqual(state.get_snapshot().standard_html, "<p>two</p>")
+
+    def test_sheet_poll_only_rebuilds_changed_gifs(self):
+        def answers(*rows):
+            return SimpleNamespace(
+                email_data={
+                    "question_mode": "diyl_gif",
+                    "question_answers": list(rows),
+                },
+                _make_gif_bytes=mock.Mock(return_value=b"GIF89a-preview"),
+            )
+
+        cache = {}
+        first = answers(
+            ("Maya", "questiongif0", "A day", ["https://example.test/1"]),
+            ("Sam", "questiongif1", "A day", ["https://example.test/2"]),
+        )
+        preview._question_cid_sources(first, cache)
+        second = answers(
+            ("Sam", "questiongif0", "A day", ["https://example.test/2"]),
+            ("Ana", "questiongif1", "A day", ["https://example.test/3"]),
+        )
+        sources = preview._question_cid_sources(second, cache)
+
+        second._make_gif_bytes.assert_called_once_with(
+            ["https://example.test/3"],
+            max_image_byte=8.0,
+            intro_text="Day in my life: Ana",
+        )
+        self.assertEqual(set(sources), {"questiongif0", "questiongif1"})
+        self.assertNotIn(("Maya", ("https://example.test/1",)), cache)
+
+    def test_watcher_rerenders_when_template_changes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template = Path(temp_dir) / "template.html"
+            template.write_text("one", encoding="utf8")
+            state = mock.Mock()
+            watcher = preview.PreviewWatcher(
+                state, [template], sheet_interval=0, poll_interval=0.01
+            )
+            os.utime(template, ns=(0, 0))
+            watcher.start()
+            try:
+                for _ in range(200):
+                    if state.rerender.called:
+                        break
+                    threading.Event().wait(0.01)
+            finally:
+                watcher.stop()
+                watcher.join(timeout=2)
+
+        state.rerender.assert_called_once()
+        state.poll_sheet.assert_not_called()
+
+
+class PreviewBundleTests(unittest.TestCase):
+    def _snapshot(self):
+        gif = "data:image/gif;base64,R0lGODlhAQABAAAAACw="
+        document = '<img src="/image/1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"><img src="{}">'
+        return preview.PreviewSnapshot(
+            standard_html=document.format(gif),
+            spark_html=document.format(gif) + "<p>spark</p>",
+            loaded_at="Friday, August 01 at 12:00 PM UTC",
+            edition_number=27,
+            response_count=2,
+            question_mode="diyl_gif",
+        )
+
+    def test_bundle_round_trip_serves_snapshot_and_images_offline(self):
+        snapshot = self._snapshot()
+        drive_id = "1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "edition.bundle"
+            preview.write_bundle(path, snapshot, {drive_id: ("image/jpeg", b"jpeg")})
+            bundle = preview.PreviewBundle(path)
+            try:
+                state = preview.BundledPreviewState(bundle)
+                with mock.patch.object(
+                    main.requests, "get", side_effect=AssertionError("network")
+                ):
+                    self.assertEqual(state.get_snapshot(refresh=True), snapshot)
+                    self.assertEqual(state.get_image(drive_id), ("image/jpeg", b"jpeg"))
+                    with self.assertRaises(ValueError):
+                        state.get_image("1" * 20)
+            finally:
+                bundle.close()
+
+    def test_gif_payloads_are_stored_once_as_raw_bytes(self):
+        snapshot = self._snapshot()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "edition.bundle"
+            preview.write_bundle(path, snapshot, {})
+            payload = path.read_bytes()
+
+        self.assertNotIn(b"R0lGODlh", payload)
+        self.assertEqual(payload.count(b"GIF89a"), 1)
+
+    def test_rejects_files_that_are_not_bundles(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "edition.bundle"
+            path.write_bytes(b"not a bundle at all, just some bytes")
+            with self.assertRaises(ValueError):
+                preview.PreviewBundle(path)
+
+    def test_export_fetches_every_proxied_image(self):
+        snapshot = self._snapshot()
+        state = mock.Mock()
+        state.get_snapshot.return_value = snapshot
+        state.get_image.return_value = ("image/png", b"png")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "edition.bundle"
+            preview.export_bundle(state, path)
+            bundle = preview.PreviewBundle(path)
+            image_ids = bundle.image_ids()
+            bundle.close()
+
+        self.assertEqual(image_ids, ["1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"])
+
+
 class PreviewServerTests(unittest.TestCase):
     def setUp(self):
         self.snapshot = preview.PreviewSnapshot(
@@ -404,6 +989,7 @@ class PreviewServerTests(unittest.TestCase):
                 inner_self.snapshot = snapshot
                 inner_self.calls = 0
                 inner_self.image_calls = []
+                inner_self.metrics = preview.PreviewMetrics()
 
             def get_snapshot(inner_self, refresh=False):
                 inner_self.calls += 1
@@ -463,12 +1049,74 @@ class PreviewServerTests(unittest.TestCase):
         self.assertEqual(self.state.image_calls, [drive_id])
         self.assertEqual(self.state.calls, 0)
 
+    def test_live_reload_routes_are_off_by_default(self):
+        with self.assertRaises(HTTPError) as caught:
+            urlopen(self.base_url + "/events")
+        self.assertEqual(caught.exception.code, HTTPStatus.NOT_FOUND)
+
+        with urlopen(self.base_url + "/") as response:
+            self.assertNotIn("live-reload.js", response.read().decode("utf8"))
+
+    def test_live_reload_sends_reload_event(self):
+        self.state.version = 4
+        self.state.wait_for_change = mock.Mock(return_value=5)
+        server = preview.LocalPreviewServer(
+            (preview.LOCAL_HOST, 0),
+            preview.create_handler(self.state, live_reload=True),
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base_url = "http://{}:{}".format(
+            preview.LOCAL_HOST, server.server_address[1]
+        )
+        try:
+            with urlopen(base_url + "/") as response:
+                dashboard = response.read().decode("utf8")
+                policy = response.headers["Content-Security-Policy"]
+            with urlopen(base_url + "/events?since=4", timeout=5) as response:
+                self.assertEqual(
+                    response.headers["Content-Type"],
+                    "text/event-stream; charset=utf-8",
+                )
+                event = response.readline() + response.readline()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join(timeout=2)
+
+        self.assertIn('data-version="4"', dashboard)
+        self.assertIn("script-src 'self'", policy)
+        self.assertEqual(event, b"event: reload\ndata: 5\n")
+        self.state.wait_for_change.assert_any_call(4, timeout=15.0)
+
     def test_post_is_not_allowed(self):
         request = Request(self.base_url + "/", data=b"", method="POST")
         with self.assertRaises(HTTPError) as caught:
             urlopen(request)
         self.assertEqual(caught.exception.code, HTTPStatus.METHOD_NOT_ALLOWED)
 
+    def test_metrics_count_requests_per_route(self):
+        drive_id = "1bKIKBOzyq7LjG0mKRpu2UktBLWwbnmGF"
+        self.state.metrics.increment("preview_image_cache_requests_total", result="miss")
+        for path in ("/", "/email?variant=spark", "/image/" + drive_id, "/image/" + drive_id, "/missing"):
+            try:
+                urlopen(self.base_url + path).close()
+            except HTTPError:
+                pass
+
+        with urlopen(self.base_url + "/metrics") as response:
+            content_type = response.headers["Content-Type"]
+            body = response.read().decode("utf8")
+
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn('preview_requests_total{route="/image",status="200"} 2', body)
+        self.assertIn('preview_requests_total{route="other",status="404"} 1', body)
+        self.assertIn('preview_request_duration_seconds_count{route="/email"} 1', body)
+        self.assertIn('preview_request_duration_seconds_bucket{route="/",le="+Inf"} 1', body)
+        self.assertIn("# TYPE preview_drive_fetch_seconds histogram", body)
+        # Without its own metrics the handler reports the state's counters.
+        self.assertIn('preview_image_cache_requests_total{result="miss"} 1', body)
+
     def test_server_is_loopback_only(self):
         self.assertEqual(preview.LOCAL_HOST, "127.0.0.1")
 
@@ -479,5 +1127,20 @@ def json_load(payload):
     return json.loads(payload.decode("utf8"))
 
 
+class StartupTests(unittest.TestCase):
+    def test_importing_preview_defers_heavy_modules(self):
+        self.assertEqual(startup_benchmark.executed_heavy_modules("preview"), [])
+
+    def test_lazy_modules_load_on_first_use(self):
+        self.assertTrue(callable(main.requests.get))
+        self.assertIs(main.lazy_import("requests"), main.requests)
+
+    def test_main_imports_without_pandas_or_numpy(self):
+        code = "import sys; sys.modules['pandas'] = sys.modules['numpy'] = None; import main"
+        result = subprocess.run([sys.executable, "-c", code], cwd=str(main.BASE_DIR), capture_output=True, text=True)
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
 if __name__ == "__main__":
     unittest.main()
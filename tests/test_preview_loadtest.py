@@ -0,0 +1,32 @@
+import unittest
+
+import preview_loadtest
+
+
+class PercentileTests(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = [0.1 * number for number in range(1, 101)]
+
+        self.assertAlmostEqual(preview_loadtest.percentile(values, 50), 5.0)
+        self.assertAlmostEqual(preview_loadtest.percentile(values, 99), 9.9)
+        self.assertEqual(preview_loadtest.percentile([0.3], 95), 0.3)
+        self.assertEqual(preview_loadtest.percentile([], 50), 0.0)
+
+
+class LoadTestRunTests(unittest.TestCase):
+    def test_clients_view_every_route_against_the_stand_in(self):
+        report = preview_loadtest.run(clients=2, views=2, respondents=2, refresh_every=2, drive_latency=0.0)
+        routes = report["routes"]
+
+        self.assertEqual(sum(route["errors"] for route in routes.values()), 0)
+        self.assertEqual((routes["/"]["requests"], routes["refresh"]["requests"]), (2, 2))
+        self.assertEqual(routes["/email"]["requests"], 4)
+        # Two respondents with three photos each, plus the cover.
+        self.assertEqual(routes["/image"]["requests"], 4 * 7)
+        self.assertEqual(report["distinct_images"], 7)
+        self.assertEqual(report["sheet_fetches"], 3)
+        self.assertGreater(report["throughput"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
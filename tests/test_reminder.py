@@ -0,0 +1,342 @@
+import tempfile
+import unittest
+from email.mime.multipart import MIMEMultipart
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+from PIL import Image, ImageDraw
+
+import main
+import reminder
+
+
+def _noise_image(width, height):
+    return Image.merge(
+        "RGB",
+        [Image.effect_noise((width, height), sigma) for sigma in (40, 60, 80)],
+    )
+
+
+def _jpeg_bytes(image):
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+class FakeStreamResponse:
+    def __init__(self, payload):
+        self.payload = payload
+        self.headers = {"Content-Type": "image/jpeg"}
+        self.closed = False
+
+    def raise_for_status(self):
+        return None
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.payload), chunk_size):
+            yield self.payload[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+class FetchImageTests(unittest.TestCase):
+    @unittest.skipUnless(main.HEIF_SUPPORT, "pillow-heif is not installed")
+    def test_heif_is_decoded_without_a_failed_first_attempt(self):
+        main.register_heif()
+        buffer = BytesIO()
+        _noise_image(64, 48).save(buffer, format="HEIF", quality=50)
+        response = FakeStreamResponse(buffer.getvalue())
+
+        with mock.patch.object(main.requests, "get", return_value=response) as get, mock.patch.object(
+            main.Image, "open", wraps=Image.open
+        ) as image_open:
+            image = main.fetch_image("https://example.test/photo.heic")
+
+        get.assert_called_once_with("https://example.test/photo.heic", stream=True, timeout=30)
+        image_open.assert_called_once()
+        self.assertEqual(image_open.call_args.kwargs["formats"], ["HEIF"])
+        self.assertEqual(image.size, (64, 48))
+        self.assertTrue(response.closed)
+
+    def test_large_jpeg_is_decoded_at_reduced_scale(self):
+        payload = BytesIO(_jpeg_bytes(_noise_image(1600, 1200)))
+
+        image, image_format, size = main.decode_image(payload, max_side=400)
+
+        self.assertEqual((image_format, size), ("JPEG", (1600, 1200)))
+        self.assertEqual(image.size, (400, 300))
+
+    def test_formats_are_sniffed_from_magic_bytes(self):
+        heic = b"\x00\x00\x00\x18ftypmif1\x00\x00\x00\x00mif1heic"
+        self.assertEqual(main.sniff_image_format(heic), "HEIF")
+        self.assertEqual(main.sniff_image_format(b"\x00\x00\x00\x14ftypisom\x00\x00\x00\x00isom"), None)
+        self.assertEqual(main.sniff_image_format(_jpeg_bytes(_noise_image(8, 8))[:64]), "JPEG")
+        self.assertEqual(main.sniff_image_format(b"GIF89a\x01\x00"), "GIF")
+
+        with self.assertRaises(main.UnidentifiedImageError):
+            main.decode_image(BytesIO(b"<html>not an image</html>"))
+
+    def test_download_is_capped(self):
+        response = FakeStreamResponse(b"x" * 1000)
+
+        with mock.patch.object(main.requests, "get", return_value=response):
+            with self.assertRaises(ValueError):
+                main.fetch_image("https://example.test/huge.jpg", max_bytes=100)
+
+
+class EncodeJpegTests(unittest.TestCase):
+    def test_output_fits_target_and_max_side(self):
+        encoded = main.encode_jpeg(_noise_image(900, 600), 20000, max_side=400)
+
+        self.assertLessEqual(len(encoded), 20000)
+        self.assertLessEqual(max(Image.open(BytesIO(encoded)).size), 400)
+
+    def test_downscales_when_lowest_quality_is_too_large(self):
+        image = _noise_image(600, 600)
+        encoded = main.encode_jpeg(image, 5000)
+
+        self.assertLessEqual(len(encoded), 5000)
+        self.assertLess(Image.open(BytesIO(encoded)).width, 600)
+
+    def test_keeps_small_images_at_high_quality(self):
+        image = _noise_image(64, 64)
+        encoded = main.encode_jpeg(image, 10 ** 6)
+
+        self.assertEqual(Image.open(BytesIO(encoded)).size, (64, 64))
+
+
+class EncodeImageTests(unittest.TestCase):
+    def _photo(self):
+        image = _noise_image(320, 240)
+        exif = Image.Exif()
+        exif[0x010F] = "PhoneMaker" * 1000
+        image.info["exif"] = exif.tobytes()
+        image.info["icc_profile"] = b"\0" * 50000
+        return image
+
+    def test_profiles_write_progressive_files_without_metadata(self):
+        stats = main.EncoderStats()
+        encoded = main.encode_image(self._photo(), 60000, "spark-tight", stats=stats)
+        decoded = Image.open(BytesIO(encoded))
+
+        self.assertLessEqual(len(encoded), 60000)
+        self.assertTrue(decoded.info.get("progressive"))
+        self.assertNotIn("exif", decoded.info)
+        self.assertNotIn("icc_profile", decoded.info)
+        self.assertEqual(stats.profiles["spark-tight"]["images"], 1)
+        self.assertEqual(stats.profiles["spark-tight"]["bytes"], len(encoded))
+        self.assertTrue(stats.summary()[0].startswith("spark-tight: 1 images"))
+
+    def test_webp_profiles_keep_the_smaller_encoding(self):
+        profiles = dict(main.ENCODER_PROFILES, preview={"min_quality": 40, "max_quality": 90,
+                                                        "subsampling": "4:2:0", "webp": True})
+        image = _noise_image(64, 64)
+        with mock.patch.dict(main.ENCODER_PROFILES, profiles):
+            encoded = main.encode_image(image, 10 ** 6, "preview", stats=None)
+            jpeg = main.encode_image(image, 10 ** 6, "standard", stats=None)
+
+        self.assertIn(Image.open(BytesIO(encoded)).format, ("WEBP", "JPEG"))
+        self.assertLessEqual(len(encoded), len(jpeg))
+
+
+class EncodeGifTests(unittest.TestCase):
+    def _frames(self):
+        first = Image.new("RGB", (120, 80), "white")
+        ImageDraw.Draw(first).rectangle((10, 10, 50, 50), fill="navy")
+        second = first.copy()
+        ImageDraw.Draw(second).ellipse((70, 20, 110, 60), fill="orange")
+        third = second.copy()
+        ImageDraw.Draw(third).rectangle((10, 60, 30, 75), fill="green")
+        return [first, second, third]
+
+    def test_frames_round_trip_through_one_palette(self):
+        frames = self._frames()
+        gif = Image.open(BytesIO(main.encode_gif(frames, color_count=16)))
+
+        self.assertEqual(gif.n_frames, 3)
+        for index, frame in enumerate(frames):
+            gif.seek(index)
+            decoded = gif.convert("RGB")
+            self.assertEqual(decoded.getpixel((30, 30)), frame.getpixel((30, 30)))
+            self.assertEqual(decoded.getpixel((90, 40)), frame.getpixel((90, 40)))
+            self.assertEqual(decoded.getpixel((20, 70)), frame.getpixel((20, 70)))
+
+    def test_later_frames_only_store_the_changed_region(self):
+        gif = Image.open(BytesIO(main.encode_gif(self._frames(), color_count=16)))
+
+        gif.seek(1)
+        self.assertEqual(gif.dispose_extent, (70, 20, 111, 61))
+        gif.seek(2)
+        self.assertEqual(gif.dispose_extent, (10, 60, 31, 76))
+
+
+class ReminderImageTests(unittest.TestCase):
+    def test_hero_image_is_attached_within_budget(self):
+        hero = SimpleNamespace(
+            email_data={"image_url": "https://drive.google.com/open?id=abc"},
+            image_index=None,
+        )
+        msg = MIMEMultipart()
+
+        with mock.patch.object(reminder, "open_remote_image", return_value=_noise_image(2400, 1600)):
+            reminder.Reminder.image_to_byte(hero, msg)
+
+        attachment = msg.get_payload()[0]
+        self.assertEqual(attachment["Content-ID"], "<image>")
+        self.assertLessEqual(
+            len(attachment.get_payload(decode=True)),
+            reminder.HERO_IMAGE_MAX_BYTES,
+        )
+
+    def test_unreadable_hero_image_fails_loudly(self):
+        hero = SimpleNamespace(
+            email_data={"image_url": "https://example.test/broken"},
+            image_index=None,
+        )
+
+        with mock.patch.object(reminder, "open_remote_image", return_value=None):
+            with self.assertRaises(RuntimeError):
+                reminder.Reminder.image_to_byte(hero, MIMEMultipart())
+
+
+class ImageIndexTests(unittest.TestCase):
+    def test_records_persist_and_filter_candidates(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            base_dir = Path(temp_dir)
+            index = main.ImageIndex(base_dir / "image_index.json", base_dir / "images")
+            good = "https://drive.google.com/open?id=1goodgoodgood"
+            huge = "https://drive.google.com/open?id=1hugehugehuge"
+            broken = "https://drive.google.com/open?id=1brokenbroken"
+            index.record(good, image=_noise_image(400, 300), image_format="JPEG", byte_size=90000, derivative=True)
+            index.record(huge, image=_noise_image(40, 30), image_format="HEIF", byte_size=40 * 1000 * 1000, derivative=True)
+            index.record(broken, error=main.UnidentifiedImageError("bad"))
+            index.save()
+
+            reloaded = main.ImageIndex(base_dir / "image_index.json", base_dir / "images")
+            candidates = reloaded.candidates([good, huge, broken, "https://example.test/unknown"])
+            derivatives = [reloaded.derivative_path(url).exists() for url in (good, huge)]
+
+        self.assertEqual(candidates, [good])
+        self.assertEqual(derivatives, [True, False])
+        self.assertEqual(reloaded.entries["1brokenbroken"], {"ok": False, "error": "UnidentifiedImageError"})
+
+    def test_content_keys_group_identical_and_similar_photos(self):
+        photo = Image.linear_gradient("L").resize((256, 192)).convert("RGB")
+        draw = ImageDraw.Draw(photo)
+        draw.ellipse((40, 30, 120, 120), fill="red")
+        draw.rectangle((160, 80, 240, 176), fill="blue")
+        mirrored = photo.transpose(Image.FLIP_LEFT_RIGHT)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index = main.ImageIndex(Path(temp_dir) / "image_index.json", Path(temp_dir) / "images")
+            first, resubmitted, resized, other = (
+                "https://drive.google.com/open?id=1first",
+                "https://drive.google.com/open?id=1resubmitted",
+                "https://drive.google.com/open?id=1resized",
+                "https://drive.google.com/open?id=1other",
+            )
+            index.record(first, image=photo, digest="a" * 64, dhash=main.difference_hash(photo))
+            index.record(resubmitted, image=photo, digest="a" * 64, dhash=main.difference_hash(photo))
+            small = photo.resize((128, 96))
+            index.record(resized, image=small, digest="b" * 64, dhash=main.difference_hash(small))
+            index.record(other, image=mirrored, digest="c" * 64, dhash=main.difference_hash(mirrored))
+            urls = [first, resubmitted, resized, other, "https://example.test/unseen.jpg"]
+
+            exact = index.content_keys(urls)
+            near = index.content_keys(urls, max_distance=main.NEAR_DUPLICATE_DISTANCE)
+
+        self.assertEqual(
+            [exact[url] for url in urls],
+            ["a" * 64, "a" * 64, "b" * 64, "c" * 64, "https://example.test/unseen.jpg"],
+        )
+        self.assertEqual(near[resized], "a" * 64)
+        self.assertEqual(near[other], "c" * 64)
+
+    def test_open_remote_image_records_outcome(self):
+        payload = _jpeg_bytes(_noise_image(32, 24))
+        index = mock.Mock()
+
+        with mock.patch.object(main.requests, "get", return_value=FakeStreamResponse(payload)):
+            image = main.open_remote_image("https://drive.google.com/open?id=1goodgoodgood", index=index)
+
+        index.record.assert_called_once_with(
+            "https://drive.google.com/open?id=1goodgoodgood",
+            image=image,
+            image_format="JPEG",
+            byte_size=len(payload),
+            size=(32, 24),
+            digest=main.hashlib.sha256(payload).hexdigest(),
+            dhash=main.difference_hash(image),
+            derivative=False,
+        )
+
+    def test_derivatives_are_only_written_when_asked(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index = main.ImageIndex(Path(temp_dir) / "image_index.json", Path(temp_dir) / "images")
+            cover = "https://drive.google.com/open?id=1covercover"
+            index.record(cover, image=_noise_image(400, 300), image_format="JPEG", byte_size=90000)
+
+            self.assertFalse(index.derivative_path(cover).exists())
+            self.assertEqual(index.candidates([cover]), [cover])
+
+
+class ReminderSelectionTests(unittest.TestCase):
+    def _reminder(self, urls, index):
+        responses = main.Responses.from_columns(
+            {
+                "Image 1": urls,
+                "Image 2": [""] * len(urls),
+                "Image 3": [""] * len(urls),
+            }
+        )
+        return SimpleNamespace(responses=responses, image_index=index)
+
+    def test_prefers_validated_images(self):
+        index = mock.Mock()
+        index.candidates.return_value = ["https://drive.google.com/open?id=1goodgoodgood"]
+        hero = self._reminder(
+            ["https://drive.google.com/open?id=1goodgoodgood", "https://drive.google.com/open?id=1other"],
+            index,
+        )
+
+        self.assertEqual(
+            reminder.Reminder.choose_image_url(hero),
+            "https://drive.google.com/uc?export=view&id=1goodgoodgood",
+        )
+
+    def test_falls_back_to_any_image_without_candidates(self):
+        index = mock.Mock()
+        index.candidates.return_value = []
+        hero = self._reminder(["https://drive.google.com/open?id=1other"], index)
+
+        self.assertEqual(
+            reminder.Reminder.choose_image_url(hero),
+            "https://drive.google.com/uc?export=view&id=1other",
+        )
+
+    def test_uses_prerendered_derivative(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            derivative = Path(temp_dir) / "hero.jpg"
+            prerendered = _jpeg_bytes(_noise_image(20, 20))
+            derivative.write_bytes(prerendered)
+            index = mock.Mock()
+            index.derivative_path.return_value = derivative
+            hero = SimpleNamespace(
+                email_data={"image_url": "https://drive.google.com/open?id=1goodgoodgood"},
+                image_index=index,
+            )
+            msg = MIMEMultipart()
+
+            with mock.patch.object(reminder, "open_remote_image", side_effect=AssertionError("download")):
+                reminder.Reminder.image_to_byte(hero, msg)
+
+        self.assertEqual(msg.get_payload()[0].get_payload(decode=True), prerendered)
+
+
+if __name__ == "__main__":
+    unittest.main()
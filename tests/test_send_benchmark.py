@@ -0,0 +1,103 @@
+import shutil
+import smtplib
+import unittest
+from email.mime.image import MIMEImage
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from unittest import mock
+
+import main
+import reminder
+import send_benchmark
+
+GIF_BYTES = b"GIF89a\x01\x00\x01\x00\x00\x00\x00;"
+
+
+def _message(html, cids=()):
+    msg = MIMEMultipart()
+    msg["Subject"] = "Chatime Newsletter"
+    for cid in cids:
+        image = MIMEImage(GIF_BYTES, _subtype="gif")
+        image.add_header("Content-ID", "<{}>".format(cid))
+        msg.attach(image)
+    msg.attach(MIMEText(html, "html"))
+    return msg
+
+
+@unittest.skipUnless(shutil.which("openssl"), "the SMTP sink needs openssl")
+class SMTPSinkTests(unittest.TestCase):
+    def test_receives_over_tls_after_login(self):
+        payload = b"Subject: dots\r\n\r\n.leading dot\r\n..two\r\nend\r\n"
+        with send_benchmark.SMTPSink() as sink:
+            session = sink.session("sender@example.test")
+            with session.connection() as server:
+                server.sendmail("sender@example.test", ["a@example.test", "b@example.test"], payload)
+            session.close()
+            intruder = main.SMTPSession("sender@example.test", "wrong", *sink.server_address, context=session.context)
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                with intruder.connection():
+                    pass
+
+        self.assertEqual(sink.messages, [("sender@example.test", ["a@example.test", "b@example.test"], payload)])
+        self.assertEqual(sink.logins, 1)
+
+    def test_newsletter_variants_are_sent_intact_and_cids_checked(self):
+        newsletter = main.Newsletter.__new__(main.Newsletter)
+        newsletter.sender = "sender@example.test"
+        newsletter.recipients = ["friend{}@example.test".format(number) for number in range(3)]
+        newsletter.recipients_spark = ["spark@example.test"]
+        newsletter.batch_size = 2
+        newsletter.send_interval = 1
+        newsletter.smtp_session = None
+        newsletter.message_cache = mock.Mock()
+        newsletter.generate_newsletter = mock.Mock()
+        newsletter.build_messages = mock.Mock(return_value={
+            False: _message('<img src="cid:questiongif0">'),
+            True: _message('<img src="cid:image0"><img src="cid:image1">', ["image0", "image1", "image2"]),
+        })
+
+        with send_benchmark.SMTPSink() as sink, mock.patch("builtins.print"):
+            report = send_benchmark.benchmark_newsletter(newsletter, sink)
+
+        standard, spark = report["variants"]["standard"], report["variants"]["spark"]
+        newsletter.generate_newsletter.assert_called_once_with(False)
+        self.assertIsNone(newsletter.message_cache)
+        self.assertEqual((standard["messages"], standard["recipients"]), (2, 4))
+        self.assertEqual((spark["messages"], spark["recipients"]), (1, 2))
+        self.assertTrue(standard["intact"] and spark["intact"])
+        self.assertEqual(standard["missing_cids"], ["questiongif0"])
+        self.assertEqual((spark["missing_cids"], spark["unused_cids"]), ([], ["image2"]))
+        self.assertEqual(report["logins"], 1)
+        self.assertEqual(send_benchmark.report_problems(report), ["standard: no attachment for questiongif0"])
+        self.assertEqual(set(report["stages"]), {"render", "mime build", "serialize standard", "serialize spark"})
+
+    def test_reminder_is_sent_to_the_sink(self):
+        hero = reminder.Reminder.__new__(reminder.Reminder)
+        hero.sender = None
+        hero.recipients = ["friend@example.test"]
+        hero.recipients_spark = []
+        hero.generate_email = mock.Mock()
+        hero.build_message = mock.Mock(return_value=_message('<img src="cid:image">', ["image"]))
+
+        with send_benchmark.SMTPSink() as sink, mock.patch("builtins.print"):
+            report = send_benchmark.benchmark_reminder(hero, sink)
+
+        transfer = report["variants"]["reminder"]
+        self.assertEqual(sink.messages[0][1], [send_benchmark.BENCHMARK_SENDER, "friend@example.test"])
+        self.assertTrue(transfer["intact"])
+        self.assertEqual(send_benchmark.report_problems(report), [])
+
+    def test_newsletter_benchmark_leaves_the_caches_alone(self):
+        report = {"variants": {}}
+        with mock.patch.object(send_benchmark, "SMTPSink"), mock.patch.object(
+            send_benchmark, "newsletter_from_environment"
+        ) as from_environment, mock.patch.object(
+            send_benchmark, "benchmark_newsletter", return_value=report
+        ), mock.patch.object(send_benchmark, "print_report"):
+            send_benchmark.main(["newsletter"])
+
+        from_environment.assert_called_once_with(image_index=None, history=None)
+
+
+if __name__ == "__main__":
+    unittest.main()